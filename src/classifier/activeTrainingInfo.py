@@ -8,7 +8,6 @@ from typing import List, Dict, Any
 from .config.classifierConfig import ClassifierConfig
 from .config.config import Config
 from .utils.timeUtils import TimeUtils
-from .utils.imagePlotterUtils import ImagePlotterUtils
 
 
 class TrainingStatus(IntEnum):
@@ -379,6 +378,9 @@ class ActiveTrainingInfo:
     def saveLossAndAccuracyDiagram(basePath: str, name: str) -> None:
         '''Create and save loss and accuracy diagram from the collected data'''
 
+        # Matplotlib is only imported by the processes that train
+        from .utils.imagePlotterUtils import ImagePlotterUtils
+
         savePath = f'{basePath}/{name}.png'
         lossData = ActiveTrainingInfo.getRunningLoss()
         accuracyData = ActiveTrainingInfo.getRunningAccuracy()
@@ -0,0 +1,204 @@
+import math
+import threading
+from collections import OrderedDict, deque
+from timeit import default_timer as timer
+from typing import Any, Deque, Dict
+
+from .deadline import Deadline, DeadlineExceededError
+from .metrics import Metrics
+
+
+class RequestRejectedError(Exception):
+    '''Raised when a request is not admitted, holds the response status and the seconds to retry after'''
+
+    def __init__(self, message: str, statusCode: int, retryAfter: int) -> None:
+        '''Init error with the message, the http status code and the Retry-After seconds'''
+
+        super().__init__(message)
+        self.statusCode = statusCode
+        self.retryAfter = retryAfter
+
+
+class AdmissionTicket:
+    '''Place of a request in the admission queue, held while it is classified'''
+
+    def __init__(self, clientId: str) -> None:
+        '''Init ticket of the given client'''
+
+        self.clientId = clientId
+        self.admitted = False
+        self.released = False
+        self.enqueueTime = timer()
+        self.startTime: float = None
+
+
+class AdmissionController:
+    '''Bound the classifications running at once and the requests waiting for them
+
+    Waiting requests are admitted taking turns between the clients, so a client sending many
+    requests cannot delay the requests of the others by more than one request each.
+    '''
+
+    def __init__(self, maxActive: int, maxQueued: int, maxClientRequests: int = 0) -> None:
+        '''Init controller with the running and waiting limits, 0 client requests means no per client limit'''
+
+        self.maxActive = max(1, maxActive)
+        self.maxQueued = maxQueued
+        self.maxClientRequests = maxClientRequests
+
+        self._condition = threading.Condition()
+        self._active = 0
+        self._queued = 0
+        # Client id -> its waiting tickets, the first client is admitted next and then moves to the end
+        self._waiting: 'OrderedDict[str, Deque[AdmissionTicket]]' = OrderedDict()
+        # Client id -> its waiting and running requests
+        self._clientRequests: Dict[str, int] = {}
+        # Moving average of the classification time, estimates when a rejected request should retry
+        self._serviceSeconds = 0.0
+
+        self._admitted = 0
+        self._rejectedClient = 0
+        self._rejectedFull = 0
+        self._expired = 0
+        self._totalWaitMs = 0.0
+
+    def acquire(self, clientId: str, deadline: Deadline = None) -> AdmissionTicket:
+        '''Wait for a free slot and return the ticket to release once classified
+
+        RequestRejectedError is raised with 429 if the client has too many requests, with 503 if the
+        queue is full, DeadlineExceededError if the deadline passes while waiting.
+        '''
+
+        with self._condition:
+            if self.maxClientRequests and self._clientRequests.get(clientId, 0) >= self.maxClientRequests:
+                self._rejectedClient += 1
+                raise RequestRejectedError(
+                    f'Too many requests of the client, at most {self.maxClientRequests} are accepted at once',
+                    429, self.estimateRetryAfter())
+
+            ticket = AdmissionTicket(clientId)
+
+            if self._active < self.maxActive and not self._queued:
+                self._clientRequests[clientId] = self._clientRequests.get(clientId, 0) + 1
+                self._admit(ticket)
+                return ticket
+
+            if self._queued >= self.maxQueued:
+                self._rejectedFull += 1
+                raise RequestRejectedError(
+                    'Inference queue is full', 503, self.estimateRetryAfter())
+
+            self._waiting.setdefault(clientId, deque()).append(ticket)
+            self._queued += 1
+            self._clientRequests[clientId] = self._clientRequests.get(clientId, 0) + 1
+
+            while not ticket.admitted:
+                timeout = deadline.getRemaining() if deadline else None
+
+                if timeout is not None and timeout <= 0:
+                    self._removeWaiting(ticket)
+                    self._expired += 1
+                    raise DeadlineExceededError(
+                        'Deadline exceeded while waiting in the inference queue')
+
+                self._condition.wait(timeout)
+
+            return ticket
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        '''Free the slot of the classified request and admit the next waiting one, only the first call counts'''
+
+        with self._condition:
+            if ticket.released:
+                return
+
+            ticket.released = True
+            self._active -= 1
+            self._decrementClient(ticket.clientId)
+
+            serviceSeconds = timer() - ticket.startTime
+            self._serviceSeconds = serviceSeconds if not self._serviceSeconds else \
+                0.8 * self._serviceSeconds + 0.2 * serviceSeconds
+
+            self._admitNext()
+
+    def estimateRetryAfter(self) -> int:
+        '''Return the estimated seconds until a new request would be admitted, the lock must be held'''
+
+        return max(1, math.ceil(self._serviceSeconds * (self._queued + 1) / self.maxActive))
+
+    def _admit(self, ticket: AdmissionTicket) -> None:
+        '''Mark the ticket running, the lock must be held'''
+
+        ticket.admitted = True
+        ticket.startTime = timer()
+
+        waitSeconds = ticket.startTime - ticket.enqueueTime
+        Metrics.observe(Metrics.QUEUE_WAIT_SECONDS, waitSeconds, queue='admission')
+
+        self._active += 1
+        self._admitted += 1
+        self._totalWaitMs += waitSeconds * 1000.0
+
+    def _admitNext(self) -> None:
+        '''Admit waiting tickets while there are free slots, one client after the other, the lock must be held'''
+
+        admitted = False
+
+        while self._active < self.maxActive and self._waiting:
+            clientId, tickets = next(iter(self._waiting.items()))
+            ticket = tickets.popleft()
+
+            if tickets:
+                self._waiting.move_to_end(clientId)
+            else:
+                del self._waiting[clientId]
+
+            self._queued -= 1
+            self._admit(ticket)
+            admitted = True
+
+        if admitted:
+            self._condition.notify_all()
+
+    def _removeWaiting(self, ticket: AdmissionTicket) -> None:
+        '''Remove a ticket that stopped waiting, the lock must be held'''
+
+        tickets = self._waiting.get(ticket.clientId)
+        if tickets is None or ticket not in tickets:
+            return
+
+        tickets.remove(ticket)
+        if not tickets:
+            del self._waiting[ticket.clientId]
+
+        self._queued -= 1
+        self._decrementClient(ticket.clientId)
+
+    def _decrementClient(self, clientId: str) -> None:
+        '''Count one request less for the client, the lock must be held'''
+
+        requests = self._clientRequests.get(clientId, 0) - 1
+        if requests > 0:
+            self._clientRequests[clientId] = requests
+        else:
+            self._clientRequests.pop(clientId, None)
+
+    def getStats(self) -> Dict[str, Any]:
+        '''Return admission statistics as a json dictionary'''
+
+        with self._condition:
+            return {
+                'maxActive': self.maxActive,
+                'maxQueued': self.maxQueued,
+                'maxClientRequests': self.maxClientRequests,
+                'active': self._active,
+                'queued': self._queued,
+                'clients': len(self._clientRequests),
+                'admitted': self._admitted,
+                'rejectedClient': self._rejectedClient,
+                'rejectedFull': self._rejectedFull,
+                'expired': self._expired,
+                'averageQueueWaitMs': self._totalWaitMs / max(self._admitted, 1),
+                'averageServiceMs': self._serviceSeconds * 1000.0
+            }
@@ -0,0 +1,300 @@
+import queue
+import tarfile
+import zipfile
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+
+import torch
+
+from .config.classifierConfig import ClassifierConfig
+from .deadline import Deadline, DeadlineExceededError, checkDeadline
+from .modelRegistry import ModelRegistry
+from .multiModelClassifier import ImageTooLargeError, MultiModelClassifier, checkImageBudget
+from .resultCache import ResultCache
+
+
+class BatchImage:
+    '''Encoded image of a batch request with its own grid size'''
+
+    def __init__(self, name: str, data: bytes, rows: int = 1, cols: int = 1) -> None:
+        '''Init image with its name, encoded bytes and the rows and columns to split it to'''
+
+        self.name = name
+        self.data = data
+        self.rows = rows
+        self.cols = cols
+
+
+def readArchiveImages(file, maxImages: int = 0, maxBytes: int = 0) -> List[Tuple[str, bytes]]:
+    '''Return the name and the bytes of every file in the zip or tar archive, in archive order
+
+    The member count and the uncompressed sizes in the archive index are checked before any member is
+    extracted, ImageTooLargeError is raised above maxImages members or maxBytes bytes, 0 means no limit.
+    A member is never read past the size its header declares.
+    '''
+
+    file.seek(0)
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            members = [info for info in archive.infolist()
+                       if not info.is_dir() and not isHiddenMember(info.filename)]
+            checkArchiveBudget([info.file_size for info in members], maxImages, maxBytes)
+
+            images = []
+            for info in members:
+                with archive.open(info) as memberFile:
+                    images.append((info.filename, readMember(memberFile, info.filename, info.file_size)))
+
+        return images
+
+    file.seek(0)
+    try:
+        with tarfile.open(fileobj=file) as archive:
+            members = [member for member in archive.getmembers()
+                       if member.isfile() and not isHiddenMember(member.name)]
+            checkArchiveBudget([member.size for member in members], maxImages, maxBytes)
+
+            return [(member.name, readMember(archive.extractfile(member), member.name, member.size))
+                    for member in members]
+    except tarfile.TarError:
+        raise ValueError('Archive is not a zip or tar file')
+
+
+def checkArchiveBudget(sizes: List[int], maxImages: int, maxBytes: int) -> None:
+    '''Raise ImageTooLargeError if the archive has too many members or they are too large uncompressed'''
+
+    if maxImages and len(sizes) > maxImages:
+        raise ImageTooLargeError(
+            f'Too many images in the archive: {len(sizes)}, at most {maxImages} are accepted')
+
+    totalBytes = sum(sizes)
+    if maxBytes and totalBytes > maxBytes:
+        raise ImageTooLargeError(
+            f'Archive holds {totalBytes} bytes uncompressed, at most {maxBytes} are accepted')
+
+
+def readMember(memberFile, name: str, size: int) -> bytes:
+    '''Read the archive member, raise ImageTooLargeError if it holds more than its declared size'''
+
+    data = memberFile.read(size + 1)
+    if len(data) > size:
+        raise ImageTooLargeError(f'Archive member {name} is larger than its declared size')
+
+    return data
+
+
+def isHiddenMember(name: str) -> bool:
+    '''Return whether the archive member is metadata like __MACOSX or a dot file'''
+
+    return any(part.startswith(('.', '__MACOSX')) for part in name.split('/') if part)
+
+
+def checkBatchBudget(config: ClassifierConfig, images: List[BatchImage]) -> None:
+    '''Check the budgets of the batch before it is queued or decoded, only the image headers are read
+
+    ValueError is raised for too many images, ImageTooLargeError if the tiles summed over the images exceed
+    their budget. The budget of each image is checked by BatchClassifier.classifyImages, so an oversized
+    image only fails its own result.
+    '''
+
+    maxImages = config.getMaxBatchImages()
+    if len(images) > maxImages:
+        raise ValueError(
+            f'Too many images: {len(images)}, at most {maxImages} are accepted')
+
+    maxTiles = config.getMaxRequestTiles()
+    tiles = sum(image.rows * image.cols for image in images)
+    if maxTiles and tiles > maxTiles:
+        raise ImageTooLargeError(
+            f'{tiles} tiles requested, at most {maxTiles} are accepted')
+
+
+class BatchClassifier:
+    '''Classify many images at once, decoding in a worker pool while the networks run on the decoded ones'''
+
+    def __init__(self, deadline: Deadline = None) -> None:
+        '''Basic initialization, the networks and the decode pool are borrowed from the model registry
+
+        With a deadline the request is cancelled between the forward passes once it passed.
+        '''
+
+        self.snapshot = ModelRegistry.getSnapshot()
+        self.baseConfig = self.snapshot.getConfig()
+        self.engine = self.snapshot.getEngine()
+        self.executor = ModelRegistry.getDecodeExecutor()
+        self.resultCache = ModelRegistry.getResultCache()
+        self.modelVersions = self.snapshot.getModelVersions()
+        self.deadline = deadline
+
+    def prepareImage(self, image: BatchImage) -> Tuple[MultiModelClassifier, torch.Tensor]:
+        '''Decode the image and return its classifier with every tile, runs in the decode pool'''
+
+        classifier = MultiModelClassifier(self.snapshot)
+        classifier.dataSetup(image.data, image.rows, image.cols)
+
+        batch = torch.cat([tiles for _, tiles in classifier.iterateBands()])
+        classifier.releaseImage()
+
+        return classifier, batch
+
+    def classifyImages(self, images: List[BatchImage]) -> List[Dict[str, Any]]:
+        '''Classify the images, the results are in the same order, a failing image only fails its own result'''
+
+        checkBatchBudget(self.baseConfig, images)
+
+        results: List[Dict[str, Any]] = [None] * len(images)
+        cacheKeys: List[str] = [None] * len(images)
+        toDecode: List[int] = []
+
+        for index, image in enumerate(images):
+            try:
+                checkImageBudget(self.baseConfig, image.data, image.rows, image.cols)
+            except ImageTooLargeError as exception:
+                print(f'Error checking {image.name}: {exception}')
+                results[index] = self.createError(image, exception)
+                continue
+
+            cacheKeys[index] = self.getCacheKey(image)
+            if cacheKeys[index]:
+                cachedResult = self.resultCache.get(cacheKeys[index])
+                if cachedResult is not None:
+                    results[index] = self.createResult(image, cachedResult)
+                    continue
+
+            toDecode.append(index)
+
+        decoded: queue.Queue = queue.Queue()
+        inFlight = 0
+
+        while toDecode or inFlight:
+            inFlight += self.submitImages(images, toDecode, decoded, inFlight)
+
+            group = self.collectGroup(decoded, inFlight)
+            inFlight -= len(group)
+
+            # The next images are submitted before the forward pass, so decoding overlaps it
+            inFlight += self.submitImages(images, toDecode, decoded, inFlight)
+
+            checkDeadline(self.deadline)
+            self.classifyGroup(group, images, results, cacheKeys)
+
+        return results
+
+    def submitImages(self, images: List[BatchImage], toDecode: List[int], decoded: queue.Queue,
+                     inFlight: int) -> int:
+        '''Submit images to the decode pool while there are free slots, return the number submitted'''
+
+        # Limited so decoded tiles cannot pile up faster than the networks consume them
+        maxInFlight = 2 * self.baseConfig.getDecodeWorkers()
+        submitted = 0
+
+        while toDecode and inFlight + submitted < maxInFlight:
+            index = toDecode.pop(0)
+            future = self.executor.submit(self.prepareImage, images[index])
+            future.add_done_callback(
+                lambda done, index=index: decoded.put((index, done)))
+            submitted += 1
+
+        return submitted
+
+    def getCacheKey(self, image: BatchImage) -> str:
+        '''Return the result cache key of the image, None if caching is disabled'''
+
+        if not self.resultCache:
+            return None
+
+        params = {'rows': image.rows, 'cols': image.cols,
+                  'config': self.baseConfig.getOutputHash()}
+
+        return ResultCache.createKey(ResultCache.hashContent(image.data), params, self.modelVersions)
+
+    def collectGroup(self, decoded: queue.Queue, pending: int) -> List[Tuple[int, Future]]:
+        '''Wait for a decoded image, then add the already decoded ones up to the inference batch size'''
+
+        group = [decoded.get()]
+        tiles = self.getTileCount(group[0][1])
+
+        while len(group) < pending and tiles < self.engine.getBatchSize():
+            try:
+                item = decoded.get_nowait()
+            except queue.Empty:
+                break
+
+            group.append(item)
+            tiles += self.getTileCount(item[1])
+
+        return group
+
+    def getTileCount(self, future: Future) -> int:
+        '''Return the number of tiles of a decoded image, 0 if decoding failed'''
+
+        if future.exception():
+            return 0
+
+        return future.result()[1].shape[0]
+
+    def classifyGroup(self, group: List[Tuple[int, Future]], images: List[BatchImage],
+                      results: List[Dict[str, Any]], cacheKeys: List[str]) -> None:
+        '''Run the networks once on the tiles of every successfully decoded image of the group'''
+
+        prepared = []
+
+        for index, future in group:
+            error = future.exception()
+            if error:
+                print(f'Error decoding {images[index].name}: {error}')
+                results[index] = self.createError(images[index], error)
+            else:
+                prepared.append((index, *future.result()))
+
+        if not prepared:
+            return
+
+        try:
+            batch = torch.cat([tiles for _, _, tiles in prepared])
+            logits = self.engine.predictLogits(batch, self.deadline)
+        except DeadlineExceededError:
+            raise
+        except Exception as exception:
+            print(f'Error classifying batch: {exception}')
+            for index, _, _ in prepared:
+                results[index] = self.createError(images[index], exception)
+            return
+
+        sizes = [tiles.shape[0] for _, _, tiles in prepared]
+        splitPredictions = {key: torch.argmax(value, 1).split(sizes)
+                            for key, value in logits.items()}
+
+        for position, (index, classifier, _) in enumerate(prepared):
+            result = classifier.createResponseSkeleton(
+                classifier.rows, classifier.cols)
+            predictions = {key: value[position]
+                           for key, value in splitPredictions.items()}
+            classifier.fillResult(result, 0, predictions)
+
+            if cacheKeys[index]:
+                self.resultCache.put(
+                    cacheKeys[index], result, self.modelVersions)
+
+            results[index] = self.createResult(images[index], result)
+
+    def createResult(self, image: BatchImage, result: List[List[Dict[str, int]]]) -> Dict[str, Any]:
+        '''Create the response entry of a classified image'''
+
+        return {
+            'name': image.name,
+            'rows': image.rows,
+            'cols': image.cols,
+            'result': result
+        }
+
+    def createError(self, image: BatchImage, error: Exception) -> Dict[str, Any]:
+        '''Create the response entry of an image that could not be classified'''
+
+        return {
+            'name': image.name,
+            'rows': image.rows,
+            'cols': image.cols,
+            'error': str(error) or type(error).__name__
+        }
@@ -0,0 +1,224 @@
+import queue
+import threading
+from timeit import default_timer as timer
+from typing import Dict, List, Any
+
+import torch
+
+from .deadline import Deadline, DeadlineExceededError
+from .inferenceEngine import InferenceEngine
+from .metrics import Metrics
+
+
+class BatchItem:
+    '''Tiles of a single request waiting in the batching queue'''
+
+    def __init__(self, batch: torch.Tensor, deadline: Deadline = None) -> None:
+        '''Init item with the (N, 3, H, W) tiles and the deadline of the request'''
+
+        self.batch = batch
+        self.deadline = deadline
+        self.size = batch.shape[0]
+        self.enqueueTime = timer()
+        self.done = threading.Event()
+        self.result: Dict[str, torch.Tensor] = None
+        self.error: Exception = None
+
+
+class BatchScheduler:
+    '''Collect tiles of concurrent requests into shared batches'''
+
+    def __init__(self, engine: InferenceEngine, maxBatchSize: int = 64, maxWaitMs: float = 5.0) -> None:
+        '''Init scheduler with the engine to run and the batching limits'''
+
+        self.engine = engine
+        self.maxBatchSize = maxBatchSize
+        self.maxWaitMs = maxWaitMs
+
+        self._queue: queue.Queue = queue.Queue()
+        self._pending: BatchItem = None
+        self._thread: threading.Thread = None
+        self._running = False
+        # Guards that nothing is queued after the stop marker
+        self._stateLock = threading.Lock()
+
+        self._statsLock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._tiles = 0
+        self._totalWaitMs = 0.0
+        self._maxWaitMsSeen = 0.0
+
+    def start(self) -> None:
+        '''Start the batching worker thread'''
+
+        if self._running:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name='batchScheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''Stop the batching worker thread, the queued tiles are still classified'''
+
+        with self._stateLock:
+            self._running = False
+            self._queue.put(None)
+
+    def getMaxBatchSize(self) -> int:
+        '''Get the maximum number of tiles in a shared batch'''
+
+        return self.maxBatchSize
+
+    def submit(self, batch: torch.Tensor, deadline: Deadline = None) -> Dict[str, torch.Tensor]:
+        '''Queue the tiles and wait for the logits of each classification
+
+        Tiles whose deadline passes while they are queued are left out of the shared batch.
+        '''
+
+        item = BatchItem(batch, deadline)
+
+        with self._stateLock:
+            isRunning = self._running
+            if isRunning:
+                self._queue.put(item)
+
+        # Requests still holding a stopped scheduler run on its engine directly
+        if not isRunning:
+            return self.engine.predictLogits(batch, deadline)
+
+        item.done.wait()
+
+        if item.error:
+            raise item.error
+
+        return item.result
+
+    def _nextItem(self, timeout: float = None) -> BatchItem:
+        '''Return the item left over from the last batch or the next queued one'''
+
+        if self._pending:
+            item = self._pending
+            self._pending = None
+            return item
+
+        if timeout is None:
+            return self._queue.get()
+
+        if timeout == 0:
+            return self._queue.get_nowait()
+
+        return self._queue.get(timeout=timeout)
+
+    def _collect(self) -> List[BatchItem]:
+        '''Wait for the first item, then gather more until the batch is full or the wait is over'''
+
+        first = self._nextItem()
+        if first is None:
+            return []
+
+        items = [first]
+        size = first.size
+        deadline = first.enqueueTime + self.maxWaitMs / 1000.0
+
+        while size < self.maxBatchSize:
+            # Items already queued are always taken, the wait only applies to new ones
+            remaining = max(deadline - timer(), 0.0)
+
+            try:
+                item = self._nextItem(remaining)
+            except queue.Empty:
+                break
+
+            if item is None:
+                break
+
+            if size + item.size > self.maxBatchSize:
+                self._pending = item
+                break
+
+            items.append(item)
+            size += item.size
+
+        return items
+
+    def _run(self) -> None:
+        '''Worker loop running one forward per classification for each shared batch'''
+
+        while self._running:
+            items = self._collect()
+            if items:
+                self._runItems(items)
+
+        # Items taken before the stop marker but left out of the last batch
+        while self._pending or not self._queue.empty():
+            item = self._nextItem(0)
+            if item is not None:
+                self._runItems([item])
+
+    def _runItems(self, items: List[BatchItem]) -> None:
+        '''Classify the items in one shared batch and wake up their requests'''
+
+        startTime = timer()
+
+        expired = [item for item in items if item.deadline and item.deadline.isExpired()]
+        for item in expired:
+            item.error = DeadlineExceededError('Deadline exceeded while waiting for a shared batch')
+            item.done.set()
+
+        items = [item for item in items if item not in expired]
+        if not items:
+            return
+
+        try:
+            batch = torch.cat([item.batch for item in items])
+            logits = self.engine.predictLogits(batch)
+
+            offset = 0
+            for item in items:
+                item.result = {key: value[offset:offset + item.size]
+                               for key, value in logits.items()}
+                offset += item.size
+        except Exception as exception:
+            for item in items:
+                item.error = exception
+
+        self._addStats(items, startTime)
+
+        for item in items:
+            item.done.set()
+
+    def _addStats(self, items: List[BatchItem], startTime: float) -> None:
+        '''Update queue statistics with the given batch'''
+
+        with self._statsLock:
+            self._batches += 1
+            self._requests += len(items)
+            for item in items:
+                self._tiles += item.size
+                waitMs = (startTime - item.enqueueTime) * 1000.0
+                Metrics.observe(Metrics.QUEUE_WAIT_SECONDS, waitMs / 1000.0, queue='batching')
+                self._totalWaitMs += waitMs
+                self._maxWaitMsSeen = max(self._maxWaitMsSeen, waitMs)
+
+    def getStats(self) -> Dict[str, Any]:
+        '''Return batching statistics as a json dictionary'''
+
+        with self._statsLock:
+            batches = max(self._batches, 1)
+            requests = max(self._requests, 1)
+
+            return {
+                'maxBatchSize': self.maxBatchSize,
+                'maxWaitMs': self.maxWaitMs,
+                'queueDepth': self._queue.qsize(),
+                'batches': self._batches,
+                'requests': self._requests,
+                'tiles': self._tiles,
+                'averageBatchSize': self._tiles / batches,
+                'averageRequestsPerBatch': self._requests / batches,
+                'averageQueueWaitMs': self._totalWaitMs / requests,
+                'maxQueueWaitMs': self._maxWaitMsSeen
+            }
@@ -1,13 +1,16 @@
+import hashlib
 import os
-from typing import List, Dict, Tuple
-
-from torchvision import models
+from typing import Any, List, Dict, Tuple
 
 from .classificationType import ClassificationType
 from .config.classifierConfig import ClassifierConfig
+from .config.config import Config
 from .labelItem import LabelItem
 from .models.baseNetwork import BaseNetwork
 from .models.FirstNetwork import FirstNetwork
+from .models.foldedNetwork import FoldedNetwork
+from .models.inferenceBackend import createInferenceModel, createSampleBatch, checkParity
+from .models.quantization import quantizeModel, loadCalibrationBatch
 from .models.resNetNetwork import ResNetNetwork
 
 class BaseClassification:
@@ -22,7 +25,13 @@ class BaseClassification:
         self.classes = {}
         self.configuration: ClassifierConfig = None
         self.network = None
+        self.foldedNetwork: FoldedNetwork = None
+        self.inferenceModel = None
+        # Quantization of the served model, none if it was not configured or quantizing failed
+        self.quantization = 'none'
         self.device: str = None
+        self.modelLoaded = False
+        self.modelHash: str = None
 
     def getLabelByValue(self, value) -> LabelItem:
         '''Return label item by value'''
@@ -58,6 +67,12 @@ class BaseClassification:
 
         return tuple(self.getClassLabels())
 
+    def getLabelDescriptions(self) -> List[Dict[str, Any]]:
+        '''Return the value and the description of each label'''
+
+        return [{'value': label.getName(), 'description': label.getDescription()}
+                for label in self.classes.values()]
+
     def getClassNum(self) -> int:
         '''Get the number of current classes'''
 
@@ -79,10 +94,134 @@ class BaseClassification:
         if self.configuration.getUseResNet():
             self.network = ResNetNetwork()
 
+        self.modelLoaded = False
+        self.modelHash = None
         if self.configuration.getLoadModel():
-            self.network.loadToDevice(
+            self.modelLoaded = self.network.loadToDevice(
                 self.configuration.getModelPath(), self.device)
 
+    def isModelLoaded(self) -> bool:
+        '''Return whether the weights of the model file were loaded into the network'''
+
+        return self.modelLoaded
+
+    def setupInferenceModel(self, backend: str = None) -> None:
+        '''Prepare the loaded network for serving with the configured backend'''
+
+        if backend is None:
+            backend = self.configuration.getInferenceBackend()
+
+        model = self.getServingNetwork().getModel()
+        model.to(self.device)
+        model.eval()
+
+        self.quantization = 'none'
+        quantization = self.configuration.getQuantization()
+        if quantization != 'none':
+            model = self.quantizeNetwork(model, quantization)
+
+        self.inferenceModel = model
+
+        if backend == 'eager':
+            return
+
+        try:
+            sample = createSampleBatch(
+                self.configuration.getImageSize(), self.device)
+            candidate = createInferenceModel(
+                backend, model, self.configuration.getModelPath(), sample, self.device, self.getArtifactVariant())
+
+            if checkParity(model, candidate, sample):
+                self.inferenceModel = candidate
+                print(f'Using {backend} backend for {self.name}')
+            else:
+                print(
+                    f'The {backend} backend does not match eager results for {self.name}, using eager')
+        except Exception as exception:
+            print(
+                f'Error setting up {backend} backend for {self.name}, using eager: {exception}')
+
+    def foldNetwork(self) -> bool:
+        '''Fold the input normalization and the batch norms into the weights of a serving copy of the network
+
+        The folded copy is only kept if it matches the network, return whether it is used.
+        '''
+
+        self.foldedNetwork = None
+
+        if not FoldedNetwork.canFold(self.network):
+            print(f'The network of {self.name} cannot be folded')
+            return False
+
+        mean = tuple(self.configuration.getMean())
+        std = tuple(self.configuration.getStd())
+
+        model = self.network.getModel()
+        model.to(self.device)
+        model.eval()
+
+        folded = FoldedNetwork(model, mean, std).to(self.device)
+        if not FoldedNetwork.checkParity(model, folded, mean, std, self.configuration.getImageSize(), self.device):
+            print(f'The folded network of {self.name} does not match the network')
+            return False
+
+        self.foldedNetwork = folded
+
+        return True
+
+    def clearFoldedNetwork(self) -> None:
+        '''Serve the network as it is, its input has to be normalized'''
+
+        self.foldedNetwork = None
+
+    def isFolded(self) -> bool:
+        '''Return whether the folded network taking uint8 scaled input is served'''
+
+        return self.foldedNetwork is not None
+
+    def getServingNetwork(self) -> BaseNetwork:
+        '''Get the folded network if there is one, the network otherwise'''
+
+        if self.foldedNetwork is not None:
+            return self.foldedNetwork
+
+        return self.network
+
+    def quantizeNetwork(self, model, quantization: str):
+        '''Return the int8 quantized copy of the model, the model itself if it cannot be quantized'''
+
+        if self.device != 'cpu':
+            print(f'Quantization is only supported on the cpu, {self.name} stays fp32')
+            return model
+
+        try:
+            calibrationBatch = None
+            if quantization == 'static':
+                calibrationBatch = self.loadCalibrationBatch()
+
+            quantized = quantizeModel(model, quantization, calibrationBatch)
+            print(f'Using {quantization} int8 quantization for {self.name}')
+
+            self.quantization = quantization
+            return quantized
+        except Exception as exception:
+            print(f'Error quantizing {self.name}, using fp32: {exception}')
+            return model
+
+    def loadCalibrationBatch(self):
+        '''Load a sample of the classification's training images, or of all images if it has none'''
+
+        dataPath = self.configuration.getDataPath()
+        if not os.path.isdir(dataPath):
+            dataPath = Config.getImagesPath()
+
+        # The folded network takes the uint8 scaled tiles without normalization
+        mean = None if self.isFolded() else tuple(self.configuration.getMean())
+        std = None if self.isFolded() else tuple(self.configuration.getStd())
+
+        return loadCalibrationBatch(dataPath, self.configuration.getImageSize(), mean, std,
+                                    self.configuration.getCalibrationSamples())
+
     def configureAndSetupNetwork(self, config: ClassifierConfig) -> None:
         '''Configure classification and setup network'''
 
@@ -104,6 +243,73 @@ class BaseClassification:
 
         return self.network
 
+    def getModelHash(self) -> str:
+        '''Return the sha256 of the loaded model file, None if no weights were loaded
+
+        The hash is calculated once per load, so the version and the artifacts agree on it.
+        '''
+
+        modelPath = self.configuration.getModelPath()
+        if not self.modelLoaded or not os.path.exists(modelPath):
+            return None
+
+        if self.modelHash is None:
+            hasher = hashlib.sha256()
+            with open(modelPath, 'rb') as modelFile:
+                for block in iter(lambda: modelFile.read(1024 * 1024), b''):
+                    hasher.update(block)
+
+            self.modelHash = hasher.hexdigest()
+
+        return self.modelHash
+
+    def getModelVersion(self) -> str:
+        '''Return the version of the served model, derived from the content of its file and the applied quantization'''
+
+        modelHash = self.getModelHash()
+        if modelHash is None:
+            return 'untrained'
+
+        version = modelHash[:16]
+
+        if self.quantization != 'none':
+            version = f'{version}-{self.quantization}'
+
+        if self.isFolded():
+            version = f'{version}-folded'
+
+        return version
+
+    def isServingNetworkRun(self) -> bool:
+        '''Return whether the eager fp32 serving network is run, without a backend or quantization'''
+
+        return self.quantization == 'none' and self.getInferenceModel() is self.getServingNetwork().getModel()
+
+    def getArtifactVariant(self) -> str:
+        '''Return the name the backend artifacts of the served model are cached under, None if they are not cached
+
+        It holds the version of the model and, for the folded network, the hash of the folded mean and std,
+        so an artifact is only reused for the weights, quantization and normalization it was compiled from.
+        '''
+
+        version = self.getModelVersion()
+        if version == 'untrained':
+            return None
+
+        if self.isFolded():
+            normalization = repr((tuple(self.configuration.getMean()), tuple(self.configuration.getStd())))
+            version = f'{version}-{hashlib.sha256(normalization.encode("utf-8")).hexdigest()[:8]}'
+
+        return version
+
+    def getInferenceModel(self):
+        '''Get the callable used for serving, the eager model if no backend is set up'''
+
+        if self.inferenceModel is not None:
+            return self.inferenceModel
+
+        return self.network.getModel()
+
     def saveModel(self, path: str, modelName='model') -> None:
         '''Save current classification's model'''
 
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 from typing import Dict, Any, List, Tuple
@@ -34,7 +35,42 @@ class ClassifierConfig:
             'std': [0.18385245, 0.17220756, 0.16941115],
             'augmentDataSet': True,
             'balanceDataSet': True,
-            'useResNet': False
+            'useResNet': False,
+            'inferenceBatchSize': 256,
+            'tileRemainder': 'crop',
+            'microBatching': False,
+            'microBatchMaxSize': 64,
+            'microBatchMaxWaitMs': 5.0,
+            'fusedInference': False,
+            'inferenceBackend': 'eager',
+            'quantization': 'none',
+            'calibrationSamples': 64,
+            'inferenceWorkers': 2,
+            'torchThreads': 0,
+            'resultCacheBytes': 64 * 1024 * 1024,
+            'resultCacheDisk': False,
+            'resultCacheDiskBytes': 1024 * 1024 * 1024,
+            'streamingBandRows': 0,
+            'requestMemoryBytes': 0,
+            'decodeWorkers': 2,
+            'maxBatchImages': 256,
+            'denseInference': False,
+            'foldNormalization': True,
+            'interopThreads': 0,
+            'channelsLast': False,
+            'useInferenceProfile': True,
+            'servingWorkers': 0,
+            'modelWatchInterval': 5.0,
+            'maxQueuedRequests': 32,
+            'maxClientRequests': 8,
+            'maxRequestTiles': 40000,
+            'maxDecodedPixels': 250000000,
+            'requestDeadlineMs': 0,
+            'metricsEnabled': True,
+            'profilingToken': '',
+            'profileTopCount': 30,
+            'maxArchiveBytes': 1073741824,
+            'maxActiveRequests': 0
         }
 
         if fileName:
@@ -115,6 +151,111 @@ class ClassifierConfig:
         if 'useResNet' in configData:
             self.setUseResNet(configData['useResNet'])
 
+        if 'inferenceBatchSize' in configData:
+            self.setInferenceBatchSize(configData['inferenceBatchSize'])
+
+        if 'tileRemainder' in configData:
+            self.setTileRemainder(configData['tileRemainder'])
+
+        if 'microBatching' in configData:
+            self.setMicroBatching(configData['microBatching'])
+
+        if 'microBatchMaxSize' in configData:
+            self.setMicroBatchMaxSize(configData['microBatchMaxSize'])
+
+        if 'microBatchMaxWaitMs' in configData:
+            self.setMicroBatchMaxWaitMs(configData['microBatchMaxWaitMs'])
+
+        if 'fusedInference' in configData:
+            self.setFusedInference(configData['fusedInference'])
+
+        if 'inferenceBackend' in configData:
+            self.setInferenceBackend(configData['inferenceBackend'])
+
+        if 'quantization' in configData:
+            self.setQuantization(configData['quantization'])
+
+        if 'calibrationSamples' in configData:
+            self.setCalibrationSamples(configData['calibrationSamples'])
+
+        if 'inferenceWorkers' in configData:
+            self.setInferenceWorkers(configData['inferenceWorkers'])
+
+        if 'torchThreads' in configData:
+            self.setTorchThreads(configData['torchThreads'])
+
+        if 'resultCacheBytes' in configData:
+            self.setResultCacheBytes(configData['resultCacheBytes'])
+
+        if 'resultCacheDisk' in configData:
+            self.setResultCacheDisk(configData['resultCacheDisk'])
+
+        if 'resultCacheDiskBytes' in configData:
+            self.setResultCacheDiskBytes(configData['resultCacheDiskBytes'])
+
+        if 'streamingBandRows' in configData:
+            self.setStreamingBandRows(configData['streamingBandRows'])
+
+        if 'requestMemoryBytes' in configData:
+            self.setRequestMemoryBytes(configData['requestMemoryBytes'])
+
+        if 'decodeWorkers' in configData:
+            self.setDecodeWorkers(configData['decodeWorkers'])
+
+        if 'maxBatchImages' in configData:
+            self.setMaxBatchImages(configData['maxBatchImages'])
+
+        if 'denseInference' in configData:
+            self.setDenseInference(configData['denseInference'])
+
+        if 'foldNormalization' in configData:
+            self.setFoldNormalization(configData['foldNormalization'])
+
+        if 'interopThreads' in configData:
+            self.setInteropThreads(configData['interopThreads'])
+
+        if 'channelsLast' in configData:
+            self.setChannelsLast(configData['channelsLast'])
+
+        if 'useInferenceProfile' in configData:
+            self.setUseInferenceProfile(configData['useInferenceProfile'])
+
+        if 'servingWorkers' in configData:
+            self.setServingWorkers(configData['servingWorkers'])
+
+        if 'modelWatchInterval' in configData:
+            self.setModelWatchInterval(configData['modelWatchInterval'])
+
+        if 'maxQueuedRequests' in configData:
+            self.setMaxQueuedRequests(configData['maxQueuedRequests'])
+
+        if 'maxClientRequests' in configData:
+            self.setMaxClientRequests(configData['maxClientRequests'])
+
+        if 'maxRequestTiles' in configData:
+            self.setMaxRequestTiles(configData['maxRequestTiles'])
+
+        if 'maxDecodedPixels' in configData:
+            self.setMaxDecodedPixels(configData['maxDecodedPixels'])
+
+        if 'requestDeadlineMs' in configData:
+            self.setRequestDeadlineMs(configData['requestDeadlineMs'])
+
+        if 'metricsEnabled' in configData:
+            self.setMetricsEnabled(configData['metricsEnabled'])
+
+        if 'profilingToken' in configData:
+            self.setProfilingToken(configData['profilingToken'])
+
+        if 'profileTopCount' in configData:
+            self.setProfileTopCount(configData['profileTopCount'])
+
+        if 'maxArchiveBytes' in configData:
+            self.setMaxArchiveBytes(configData['maxArchiveBytes'])
+
+        if 'maxActiveRequests' in configData:
+            self.setMaxActiveRequests(configData['maxActiveRequests'])
+
         self.originalJsonData = configData
 
     def overrideFromEnv(self) -> None:
@@ -137,6 +278,41 @@ class ClassifierConfig:
         self.setAugmentDataSet(os.environ.get('AUGMENT_DATASET'))
         self.setBalanceDataSet(os.environ.get('BALANCE_DATASET'))
         self.setUseResNet(os.environ.get('USE_RESNET'))
+        self.setInferenceBatchSize(os.environ.get('INFERENCE_BATCH_SIZE'))
+        self.setTileRemainder(os.environ.get('TILE_REMAINDER'))
+        self.setMicroBatching(os.environ.get('MICRO_BATCHING'))
+        self.setMicroBatchMaxSize(os.environ.get('MICRO_BATCH_MAX_SIZE'))
+        self.setMicroBatchMaxWaitMs(os.environ.get('MICRO_BATCH_MAX_WAIT_MS'))
+        self.setFusedInference(os.environ.get('FUSED_INFERENCE'))
+        self.setInferenceBackend(os.environ.get('INFERENCE_BACKEND'))
+        self.setQuantization(os.environ.get('QUANTIZATION'))
+        self.setCalibrationSamples(os.environ.get('CALIBRATION_SAMPLES'))
+        self.setInferenceWorkers(os.environ.get('INFERENCE_WORKERS'))
+        self.setTorchThreads(os.environ.get('TORCH_THREADS'))
+        self.setResultCacheBytes(os.environ.get('RESULT_CACHE_BYTES'))
+        self.setResultCacheDisk(os.environ.get('RESULT_CACHE_DISK'))
+        self.setResultCacheDiskBytes(os.environ.get('RESULT_CACHE_DISK_BYTES'))
+        self.setStreamingBandRows(os.environ.get('STREAMING_BAND_ROWS'))
+        self.setRequestMemoryBytes(os.environ.get('REQUEST_MEMORY_BYTES'))
+        self.setDecodeWorkers(os.environ.get('DECODE_WORKERS'))
+        self.setMaxBatchImages(os.environ.get('MAX_BATCH_IMAGES'))
+        self.setDenseInference(os.environ.get('DENSE_INFERENCE'))
+        self.setFoldNormalization(os.environ.get('FOLD_NORMALIZATION'))
+        self.setInteropThreads(os.environ.get('INTEROP_THREADS'))
+        self.setChannelsLast(os.environ.get('CHANNELS_LAST'))
+        self.setUseInferenceProfile(os.environ.get('USE_INFERENCE_PROFILE'))
+        self.setServingWorkers(os.environ.get('SERVING_WORKERS'))
+        self.setModelWatchInterval(os.environ.get('MODEL_WATCH_INTERVAL'))
+        self.setMaxQueuedRequests(os.environ.get('MAX_QUEUED_REQUESTS'))
+        self.setMaxClientRequests(os.environ.get('MAX_CLIENT_REQUESTS'))
+        self.setMaxRequestTiles(os.environ.get('MAX_REQUEST_TILES'))
+        self.setMaxDecodedPixels(os.environ.get('MAX_DECODED_PIXELS'))
+        self.setRequestDeadlineMs(os.environ.get('REQUEST_DEADLINE_MS'))
+        self.setMetricsEnabled(os.environ.get('METRICS_ENABLED'))
+        self.setProfilingToken(os.environ.get('PROFILING_TOKEN'))
+        self.setProfileTopCount(os.environ.get('PROFILE_TOP_COUNT'))
+        self.setMaxArchiveBytes(os.environ.get('MAX_ARCHIVE_BYTES'))
+        self.setMaxActiveRequests(os.environ.get('MAX_ACTIVE_REQUESTS'))
         # TODO: Set mean and std values
 
     def print(self) -> None:
@@ -408,6 +584,406 @@ class ClassifierConfig:
         
         return self._config['useResNet']
 
+    def setInferenceBatchSize(self, newValue: int) -> None:
+        '''Set the maximum number of tiles sent through a network at once'''
+
+        if Config.isSet(newValue):
+            self._config['inferenceBatchSize'] = max(1, int(newValue))
+
+    def getInferenceBatchSize(self) -> int:
+        '''Get the maximum number of tiles sent through a network at once'''
+
+        return self._config['inferenceBatchSize']
+
+    def setTileRemainder(self, newValue: str) -> None:
+        '''Set how to handle pixels not divisible by the rows and columns (crop or pad)'''
+
+        if Config.isSet(newValue):
+            if newValue not in ['crop', 'pad']:
+                raise ValueError('Invalid tile remainder value in configuration')
+            self._config['tileRemainder'] = newValue
+
+    def getTileRemainder(self) -> str:
+        '''Get how to handle pixels not divisible by the rows and columns'''
+
+        return self._config['tileRemainder']
+
+    def setMicroBatching(self, newValue: bool) -> None:
+        '''Set whether to batch tiles of concurrent requests together'''
+
+        if Config.isSet(newValue):
+            self._config['microBatching'] = Config.toBool(newValue)
+
+    def getMicroBatching(self) -> bool:
+        '''Return whether to batch tiles of concurrent requests together'''
+
+        return self._config['microBatching']
+
+    def setMicroBatchMaxSize(self, newValue: int) -> None:
+        '''Set the maximum number of tiles in a shared batch'''
+
+        if Config.isSet(newValue):
+            self._config['microBatchMaxSize'] = max(1, int(newValue))
+
+    def getMicroBatchMaxSize(self) -> int:
+        '''Get the maximum number of tiles in a shared batch'''
+
+        return self._config['microBatchMaxSize']
+
+    def setMicroBatchMaxWaitMs(self, newValue: float) -> None:
+        '''Set how long a request may wait for others to fill a shared batch'''
+
+        if Config.isSet(newValue):
+            self._config['microBatchMaxWaitMs'] = max(0.0, float(newValue))
+
+    def getMicroBatchMaxWaitMs(self) -> float:
+        '''Get how long a request may wait for others to fill a shared batch'''
+
+        return self._config['microBatchMaxWaitMs']
+
+    def setFusedInference(self, newValue: bool) -> None:
+        '''Set whether to run networks of the same architecture as one fused network'''
+
+        if Config.isSet(newValue):
+            self._config['fusedInference'] = Config.toBool(newValue)
+
+    def getFusedInference(self) -> bool:
+        '''Return whether to run networks of the same architecture as one fused network'''
+
+        return self._config['fusedInference']
+
+    def setInferenceBackend(self, newValue: str) -> None:
+        '''Set the backend used to serve the network (eager, torchscript, compile or onnx)'''
+
+        if Config.isSet(newValue):
+            if newValue not in ['eager', 'torchscript', 'compile', 'onnx']:
+                raise ValueError('Invalid inference backend value in configuration')
+            self._config['inferenceBackend'] = newValue
+
+    def getInferenceBackend(self) -> str:
+        '''Get the backend used to serve the network'''
+
+        return self._config['inferenceBackend']
+
+    def setQuantization(self, newValue: str) -> None:
+        '''Set the int8 quantization mode used for serving (none, dynamic or static)'''
+
+        if Config.isSet(newValue):
+            if newValue not in ['none', 'dynamic', 'static']:
+                raise ValueError('Invalid quantization value in configuration')
+            self._config['quantization'] = newValue
+
+    def getQuantization(self) -> str:
+        '''Get the int8 quantization mode used for serving'''
+
+        return self._config['quantization']
+
+    def setCalibrationSamples(self, newValue: int) -> None:
+        '''Set the number of images used to calibrate static quantization'''
+
+        if Config.isSet(newValue):
+            self._config['calibrationSamples'] = max(1, int(newValue))
+
+    def getCalibrationSamples(self) -> int:
+        '''Get the number of images used to calibrate static quantization'''
+
+        return self._config['calibrationSamples']
+
+    def setInferenceWorkers(self, newValue: int) -> None:
+        '''Set the number of threads running classifications of async requests'''
+
+        if Config.isSet(newValue):
+            self._config['inferenceWorkers'] = max(1, int(newValue))
+
+    def getInferenceWorkers(self) -> int:
+        '''Get the number of threads running classifications of async requests'''
+
+        return self._config['inferenceWorkers']
+
+    def setTorchThreads(self, newValue: int) -> None:
+        '''Set the number of intra-op torch threads, 0 splits the cores between the inference workers'''
+
+        if Config.isSet(newValue):
+            self._config['torchThreads'] = max(0, int(newValue))
+
+    def getTorchThreads(self) -> int:
+        '''Get the number of intra-op torch threads, 0 splits the cores between the inference workers'''
+
+        return self._config['torchThreads']
+
+    def setResultCacheBytes(self, newValue: int) -> None:
+        '''Set the memory budget of the result cache in bytes, 0 disables the cache'''
+
+        if Config.isSet(newValue):
+            self._config['resultCacheBytes'] = max(0, int(newValue))
+
+    def getResultCacheBytes(self) -> int:
+        '''Get the memory budget of the result cache in bytes'''
+
+        return self._config['resultCacheBytes']
+
+    def setResultCacheDisk(self, newValue: bool) -> None:
+        '''Set whether to keep cached results on disk too'''
+
+        if Config.isSet(newValue):
+            self._config['resultCacheDisk'] = Config.toBool(newValue)
+
+    def getResultCacheDisk(self) -> bool:
+        '''Return whether to keep cached results on disk too'''
+
+        return self._config['resultCacheDisk']
+
+    def setResultCacheDiskBytes(self, newValue: int) -> None:
+        '''Set the byte budget of the disk tier of the result cache, 0 means no limit'''
+
+        if Config.isSet(newValue):
+            self._config['resultCacheDiskBytes'] = max(0, int(newValue))
+
+    def getResultCacheDiskBytes(self) -> int:
+        '''Get the byte budget of the disk tier of the result cache, 0 means no limit'''
+
+        return self._config['resultCacheDiskBytes']
+
+    def setStreamingBandRows(self, newValue: int) -> None:
+        '''Set the number of tile rows decoded and classified at once, 0 classifies the whole image at once'''
+
+        if Config.isSet(newValue):
+            self._config['streamingBandRows'] = max(0, int(newValue))
+
+    def getStreamingBandRows(self) -> int:
+        '''Get the number of tile rows decoded and classified at once'''
+
+        return self._config['streamingBandRows']
+
+    def setRequestMemoryBytes(self, newValue: int) -> None:
+        '''Set the memory ceiling of a classification request in bytes, 0 means no ceiling'''
+
+        if Config.isSet(newValue):
+            self._config['requestMemoryBytes'] = max(0, int(newValue))
+
+    def getRequestMemoryBytes(self) -> int:
+        '''Get the memory ceiling of a classification request in bytes'''
+
+        return self._config['requestMemoryBytes']
+
+    def setDecodeWorkers(self, newValue: int) -> None:
+        '''Set the number of threads decoding the images of batch requests'''
+
+        if Config.isSet(newValue):
+            self._config['decodeWorkers'] = max(1, int(newValue))
+
+    def getDecodeWorkers(self) -> int:
+        '''Get the number of threads decoding the images of batch requests'''
+
+        return self._config['decodeWorkers']
+
+    def setMaxBatchImages(self, newValue: int) -> None:
+        '''Set the maximum number of images in a batch request'''
+
+        if Config.isSet(newValue):
+            self._config['maxBatchImages'] = max(1, int(newValue))
+
+    def getMaxBatchImages(self) -> int:
+        '''Get the maximum number of images in a batch request'''
+
+        return self._config['maxBatchImages']
+
+    def setDenseInference(self, newValue: bool) -> None:
+        '''Set whether sliding windows are evaluated with fully convolutional versions of the networks'''
+
+        if Config.isSet(newValue):
+            self._config['denseInference'] = Config.toBool(newValue)
+
+    def getDenseInference(self) -> bool:
+        '''Return whether sliding windows are evaluated with fully convolutional versions of the networks'''
+
+        return self._config['denseInference']
+
+    def setFoldNormalization(self, newValue: bool) -> None:
+        '''Set whether the input normalization and the batch norms are folded into the served networks'''
+
+        if Config.isSet(newValue):
+            self._config['foldNormalization'] = Config.toBool(newValue)
+
+    def getFoldNormalization(self) -> bool:
+        '''Get whether the input normalization and the batch norms are folded into the served networks'''
+
+        return self._config['foldNormalization']
+
+    def setInteropThreads(self, newValue: int) -> None:
+        '''Set the number of torch inter-op threads, 0 keeps the torch default'''
+
+        if Config.isSet(newValue):
+            self._config['interopThreads'] = max(0, int(newValue))
+
+    def getInteropThreads(self) -> int:
+        '''Get the number of torch inter-op threads, 0 keeps the torch default'''
+
+        return self._config['interopThreads']
+
+    def setChannelsLast(self, newValue: bool) -> None:
+        '''Set whether the tiles and the networks use the channels last memory format'''
+
+        if Config.isSet(newValue):
+            self._config['channelsLast'] = Config.toBool(newValue)
+
+    def getChannelsLast(self) -> bool:
+        '''Get whether the tiles and the networks use the channels last memory format'''
+
+        return self._config['channelsLast']
+
+    def setUseInferenceProfile(self, newValue: bool) -> None:
+        '''Set whether the measured inference profile is applied at startup'''
+
+        if Config.isSet(newValue):
+            self._config['useInferenceProfile'] = Config.toBool(newValue)
+
+    def getUseInferenceProfile(self) -> bool:
+        '''Get whether the measured inference profile is applied at startup'''
+
+        return self._config['useInferenceProfile']
+
+    def setServingWorkers(self, newValue: int) -> None:
+        '''Set the number of processes forked by servePreforked, 0 forks one per core'''
+
+        if Config.isSet(newValue):
+            self._config['servingWorkers'] = max(0, int(newValue))
+
+    def getServingWorkers(self) -> int:
+        '''Get the number of processes forked by servePreforked, 0 forks one per core'''
+
+        return self._config['servingWorkers']
+
+    def setModelWatchInterval(self, newValue: float) -> None:
+        '''Set the seconds between checks of the model files and the configuration for changes, 0 disables reloading'''
+
+        if Config.isSet(newValue):
+            self._config['modelWatchInterval'] = max(0.0, float(newValue))
+
+    def getModelWatchInterval(self) -> float:
+        '''Get the seconds between checks of the model files and the configuration for changes, 0 disables reloading'''
+
+        return self._config['modelWatchInterval']
+
+    def setMaxQueuedRequests(self, newValue: int) -> None:
+        '''Set the number of requests waiting for inference before new ones are rejected, 0 disables admission control'''
+
+        if Config.isSet(newValue):
+            self._config['maxQueuedRequests'] = max(0, int(newValue))
+
+    def getMaxQueuedRequests(self) -> int:
+        '''Get the number of requests waiting for inference before new ones are rejected'''
+
+        return self._config['maxQueuedRequests']
+
+    def setMaxClientRequests(self, newValue: int) -> None:
+        '''Set the number of waiting and running requests of a client, 0 means no limit'''
+
+        if Config.isSet(newValue):
+            self._config['maxClientRequests'] = max(0, int(newValue))
+
+    def getMaxClientRequests(self) -> int:
+        '''Get the number of waiting and running requests of a client'''
+
+        return self._config['maxClientRequests']
+
+    def setMaxRequestTiles(self, newValue: int) -> None:
+        '''Set the maximum number of tiles of a request, 0 means no limit'''
+
+        if Config.isSet(newValue):
+            self._config['maxRequestTiles'] = max(0, int(newValue))
+
+    def getMaxRequestTiles(self) -> int:
+        '''Get the maximum number of tiles of a request'''
+
+        return self._config['maxRequestTiles']
+
+    def setMaxDecodedPixels(self, newValue: int) -> None:
+        '''Set the maximum number of pixels of a decoded image, 0 means no limit'''
+
+        if Config.isSet(newValue):
+            self._config['maxDecodedPixels'] = max(0, int(newValue))
+
+    def getMaxDecodedPixels(self) -> int:
+        '''Get the maximum number of pixels of a decoded image'''
+
+        return self._config['maxDecodedPixels']
+
+    def setRequestDeadlineMs(self, newValue: int) -> None:
+        '''Set the default deadline of a classification in milliseconds, 0 means no deadline'''
+
+        if Config.isSet(newValue):
+            self._config['requestDeadlineMs'] = max(0, int(newValue))
+
+    def getRequestDeadlineMs(self) -> int:
+        '''Get the default deadline of a classification in milliseconds'''
+
+        return self._config['requestDeadlineMs']
+
+    def setMetricsEnabled(self, newValue: bool) -> None:
+        '''Set whether the latency metrics of the inference path are recorded'''
+
+        if Config.isSet(newValue):
+            self._config['metricsEnabled'] = Config.toBool(newValue)
+
+    def getMetricsEnabled(self) -> bool:
+        '''Get whether the latency metrics of the inference path are recorded'''
+
+        return self._config['metricsEnabled']
+
+    def setProfilingToken(self, newValue: str) -> None:
+        '''Set the token admins send to profile a request or a training, empty disables profiling'''
+
+        if Config.isSet(newValue):
+            self._config['profilingToken'] = str(newValue)
+
+    def getProfilingToken(self) -> str:
+        '''Get the token admins send to profile a request or a training'''
+
+        return self._config['profilingToken']
+
+    def setProfileTopCount(self, newValue: int) -> None:
+        '''Set the number of operators and functions listed in the profile summaries'''
+
+        if Config.isSet(newValue):
+            self._config['profileTopCount'] = max(1, int(newValue))
+
+    def getProfileTopCount(self) -> int:
+        '''Get the number of operators and functions listed in the profile summaries'''
+
+        return self._config['profileTopCount']
+
+    def setMaxArchiveBytes(self, newValue: int) -> None:
+        '''Set the uncompressed bytes a batch archive may hold, 0 means no limit'''
+
+        if Config.isSet(newValue):
+            self._config['maxArchiveBytes'] = max(0, int(newValue))
+
+    def getMaxArchiveBytes(self) -> int:
+        '''Get the uncompressed bytes a batch archive may hold, 0 means no limit'''
+
+        return self._config['maxArchiveBytes']
+
+    def setMaxActiveRequests(self, newValue: int) -> None:
+        '''Set the requests classified at once under admission control, 0 picks it from the inference workers and micro-batching'''
+
+        if Config.isSet(newValue):
+            self._config['maxActiveRequests'] = max(0, int(newValue))
+
+    def getMaxActiveRequests(self) -> int:
+        '''Get the requests classified at once under admission control, 0 picks it from the inference workers and micro-batching'''
+
+        return self._config['maxActiveRequests']
+
+    def getOutputHash(self) -> str:
+        '''Return a hash of the config values that change the classification results, part of the result cache keys'''
+
+        outputConfig = {key: self._config[key]
+                        for key in ['imageWidth', 'imageHeight', 'mean', 'std', 'tileRemainder']}
+        outputJson = json.dumps(outputConfig, sort_keys=True)
+
+        return hashlib.sha256(outputJson.encode('utf-8')).hexdigest()[:16]
+
     def getAsJson(self) -> Dict[str, Any]:
         '''Return configuration as a json dictionary'''
 
@@ -29,6 +29,15 @@ class Config:
 
         return value is not None and value != ''
 
+    @staticmethod
+    def toBool(value: Any) -> bool:
+        '''Convert the given config or environment value to bool'''
+
+        if isinstance(value, str):
+            return value.strip().lower() in ['true', '1', 'yes', 'on']
+
+        return bool(value)
+
     @staticmethod
     def setFromFile(fileName: str) -> None:
         '''Set configuration from the given file'''
@@ -103,6 +112,33 @@ class Config:
             return os.path.realpath(path)
         return os.path.abspath(path)
 
+    @staticmethod
+    def getResultCachePath() -> None:
+        '''Return base path of the on-disk classification result cache'''
+
+        path = os.path.join(Config._config['basePath'], 'resultCache')
+        if Config.getIsRelativePath():
+            return os.path.realpath(path)
+        return os.path.abspath(path)
+
+    @staticmethod
+    def getProfilesPath() -> None:
+        '''Return base path of the profiles of the profiled requests'''
+
+        path = os.path.join(Config._config['basePath'], 'profiles')
+        if Config.getIsRelativePath():
+            return os.path.realpath(path)
+        return os.path.abspath(path)
+
+    @staticmethod
+    def getInferenceProfilePath() -> None:
+        '''Return path of the inference settings measured on this machine'''
+
+        path = os.path.join(Config._config['basePath'], 'inferenceProfile.json')
+        if Config.getIsRelativePath():
+            return os.path.realpath(path)
+        return os.path.abspath(path)
+
     @staticmethod
     def getPath() -> None:
         '''Get path'''
@@ -0,0 +1,48 @@
+from timeit import default_timer as timer
+
+
+class DeadlineExceededError(Exception):
+    '''Raised when the deadline of a request passed before its classification finished'''
+
+
+class Deadline:
+    '''Point in time a request must be answered by, checked between the batches of its classification'''
+
+    def __init__(self, seconds: float) -> None:
+        '''Init deadline the given number of seconds from now'''
+
+        self.seconds = seconds
+        self.expiresAt = timer() + seconds
+
+    @staticmethod
+    def fromMilliseconds(milliseconds: float) -> 'Deadline':
+        '''Create deadline the given milliseconds from now, None for no deadline'''
+
+        if not milliseconds or milliseconds <= 0:
+            return None
+
+        return Deadline(milliseconds / 1000.0)
+
+    def getRemaining(self) -> float:
+        '''Get the seconds left until the deadline, negative once it passed'''
+
+        return self.expiresAt - timer()
+
+    def isExpired(self) -> bool:
+        '''Return whether the deadline passed'''
+
+        return self.getRemaining() <= 0
+
+    def check(self) -> None:
+        '''Raise DeadlineExceededError if the deadline passed'''
+
+        if self.isExpired():
+            raise DeadlineExceededError(
+                f'Deadline of {self.seconds * 1000:.0f} ms exceeded')
+
+
+def checkDeadline(deadline: Deadline) -> None:
+    '''Raise DeadlineExceededError if the given deadline passed, do nothing without a deadline'''
+
+    if deadline:
+        deadline.check()
@@ -0,0 +1,214 @@
+from typing import Callable, Dict, List, Tuple
+
+import torch
+import torch.nn as nn
+
+from .classificationMap import BaseClassification
+from .deadline import Deadline, checkDeadline
+from .metrics import Metrics
+from .models.fullyConvolutionalNetwork import FullyConvolutionalNetwork
+from .models.fusedNetwork import FusedNetwork
+
+
+class InferenceEngine:
+    '''Run batched forward passes of the loaded classification networks'''
+
+    def __init__(self, classifications: Dict[str, BaseClassification], device: str, batchSize: int = 256,
+                 fused: bool = False) -> None:
+        '''Init engine with the classifications to run and the maximum batch size'''
+
+        self.classifications = classifications
+        self.device = device
+        self.batchSize = batchSize
+        self.fusedNetwork: FusedNetwork = None
+        self.denseNetworks: Dict[str, FullyConvolutionalNetwork] = None
+        self.memoryFormat = torch.contiguous_format
+
+        # The networks are either all folded or all take normalized input
+        self.foldedInput = all(classification.isFolded()
+                               for classification in classifications.values())
+
+        if fused:
+            self.setupFusedNetwork()
+
+    def getConvertedKeys(self) -> List[str]:
+        '''Return the classifications run with a backend or quantized, their networks cannot be fused or made dense'''
+
+        return [key for key, classification in self.classifications.items()
+                if not classification.isServingNetworkRun()]
+
+    def setupFusedNetwork(self) -> None:
+        '''Fuse the networks sharing the same architecture into one multi-head network
+
+        The fp32 serving networks are fused, so networks run with a backend or quantized are never fused.
+        '''
+
+        convertedKeys = self.getConvertedKeys()
+        if convertedKeys:
+            print(f'Networks of {convertedKeys} run with a backend or quantized, running them separately')
+            return
+
+        networks = {key: classification.getServingNetwork().getModel()
+                    for key, classification in self.classifications.items()}
+
+        if not FusedNetwork.canFuse(list(networks.values())):
+            print('Networks cannot be fused, running them separately')
+            return
+
+        self.fusedNetwork = FusedNetwork(networks)
+        print(f'Fused networks: {self.fusedNetwork.getNames()}')
+
+    def setupDenseNetworks(self, imageSize: Tuple[int, int]) -> None:
+        '''Convert every network to a fully convolutional one evaluating all sliding windows in one pass'''
+
+        convertedKeys = self.getConvertedKeys()
+        if convertedKeys:
+            print(f'Networks of {convertedKeys} run with a backend or quantized, windows run separately')
+            return
+
+        networks = {key: classification.getServingNetwork().getModel()
+                    for key, classification in self.classifications.items()}
+
+        if not all(FullyConvolutionalNetwork.canConvert(network) for network in networks.values()):
+            print('Networks cannot be converted to fully convolutional ones, windows run separately')
+            return
+
+        denseNetworks = {key: FullyConvolutionalNetwork(network, imageSize)
+                         for key, network in networks.items()}
+
+        for key, network in networks.items():
+            if not FullyConvolutionalNetwork.checkParity(network, denseNetworks[key], imageSize, self.device):
+                print(f'The fully convolutional network of {key} does not match its windows, windows run separately')
+                return
+
+        self.denseNetworks = denseNetworks
+        print(f'Fully convolutional networks: {list(self.denseNetworks.keys())}')
+
+    def getDenseStride(self) -> int:
+        '''Get the window stride of the fully convolutional networks, 0 if there are none'''
+
+        if not self.denseNetworks:
+            return 0
+
+        return next(iter(self.denseNetworks.values())).getOutputStride()
+
+    def predictDense(self, image: torch.Tensor) -> Dict[str, torch.Tensor]:
+        '''Return the (classes, windowRows, windowCols) logits of every window of a (1, 3, H, W) image'''
+
+        result = {}
+
+        with torch.no_grad():
+            image = image.to(self.device).contiguous(
+                memory_format=self.memoryFormat)
+
+            for key, network in self.denseNetworks.items():
+                with Metrics.timeStage('forward', model=f'{key}-dense'):
+                    result[key] = network(image)[0].cpu()
+
+        return result
+
+    def getModules(self) -> List[nn.Module]:
+        '''Return the torch modules run by the engine'''
+
+        modules = [classification.getInferenceModel() for classification in self.classifications.values()]
+        if self.fusedNetwork:
+            modules.append(self.fusedNetwork)
+        if self.denseNetworks:
+            modules.extend(self.denseNetworks.values())
+
+        return [module for module in modules if isinstance(module, nn.Module)]
+
+    def setChannelsLast(self, channelsLast: bool) -> None:
+        '''Set whether the batches and the convolution weights use the channels last memory format'''
+
+        self.memoryFormat = torch.channels_last if channelsLast else torch.contiguous_format
+
+        for module in self.getModules():
+            try:
+                module.to(memory_format=self.memoryFormat)
+            except RuntimeError as error:
+                print(f'Error changing the memory format of {type(module).__name__}: {error}')
+
+    def isChannelsLast(self) -> bool:
+        '''Return whether the batches use the channels last memory format'''
+
+        return self.memoryFormat == torch.channels_last
+
+    def isInputFolded(self) -> bool:
+        '''Return whether the networks take the uint8 scaled tiles without normalization'''
+
+        return self.foldedInput
+
+    def isFused(self) -> bool:
+        '''Return whether the networks run as one fused network'''
+
+        return self.fusedNetwork is not None
+
+    def getBatchSize(self) -> int:
+        '''Get the maximum number of tiles sent through a network at once'''
+
+        return self.batchSize
+
+    def setBatchSize(self, batchSize: int) -> None:
+        '''Set the maximum number of tiles sent through a network at once'''
+
+        self.batchSize = max(1, int(batchSize))
+
+    def runModel(self, model: Callable, batch: torch.Tensor, deadline: Deadline = None) -> torch.Tensor:
+        '''Run the given model on a (N, 3, H, W) batch in chunks, return the logits on the cpu'''
+
+        outputs = []
+
+        with torch.no_grad():
+            for start in range(0, batch.shape[0], self.batchSize):
+                checkDeadline(deadline)
+                chunk = batch[start:start + self.batchSize].to(self.device)
+                # The onnx runtime takes the batches as contiguous numpy arrays
+                if isinstance(model, nn.Module):
+                    chunk = chunk.contiguous(memory_format=self.memoryFormat)
+                outputs.append(model(chunk).cpu())
+
+        return torch.cat(outputs)
+
+    def predictLogits(self, batch: torch.Tensor, deadline: Deadline = None) -> Dict[str, torch.Tensor]:
+        '''Return the (N, classes) logits of each classification for the given batch
+
+        With a deadline DeadlineExceededError is raised between the chunks once it passed.
+        '''
+
+        Metrics.observe(Metrics.BATCH_TILES, batch.shape[0])
+        Metrics.increment(Metrics.TILES_TOTAL, batch.shape[0])
+
+        if self.fusedNetwork:
+            with Metrics.timeStage('forward', model='fused'):
+                return self.runFused(batch, deadline)
+
+        result = {}
+
+        for key, classification in self.classifications.items():
+            model = classification.getInferenceModel()
+            with Metrics.timeStage('forward', model=key):
+                result[key] = self.runModel(model, batch, deadline)
+
+        return result
+
+    def runFused(self, batch: torch.Tensor, deadline: Deadline = None) -> Dict[str, torch.Tensor]:
+        '''Run the fused network on the batch in chunks, return the logits on the cpu'''
+
+        outputs = {key: [] for key in self.fusedNetwork.getNames()}
+
+        for start in range(0, batch.shape[0], self.batchSize):
+            checkDeadline(deadline)
+            chunk = batch[start:start + self.batchSize].to(
+                self.device).contiguous(memory_format=self.memoryFormat)
+            for key, value in self.fusedNetwork.predictLogits(chunk).items():
+                outputs[key].append(value.cpu())
+
+        return {key: torch.cat(value) for key, value in outputs.items()}
+
+    def predict(self, batch: torch.Tensor) -> Dict[str, torch.Tensor]:
+        '''Return the predicted class index of each classification for every tile of the batch'''
+
+        logits = self.predictLogits(batch)
+
+        return {key: torch.argmax(value, 1) for key, value in logits.items()}
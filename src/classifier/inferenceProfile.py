@@ -0,0 +1,101 @@
+import json
+import os
+import platform
+from datetime import datetime
+from typing import Any, Dict, List
+
+import torch
+
+from .config.classifierConfig import ClassifierConfig
+
+
+class InferenceProfile:
+    '''Inference settings measured on a machine by the autotuneInference command'''
+
+    def __init__(self, torchThreads: int, interopThreads: int, batchSize: int, channelsLast: bool,
+                 tilesPerSecond: float = 0.0, networks: List[str] = None) -> None:
+        '''Init profile with the measured best settings'''
+
+        self.torchThreads = torchThreads
+        self.interopThreads = interopThreads
+        self.batchSize = batchSize
+        self.channelsLast = channelsLast
+        self.tilesPerSecond = tilesPerSecond
+        self.networks = networks or []
+
+        self.machine = InferenceProfile.describeMachine()
+        self.createdAt = datetime.now().isoformat(timespec='seconds')
+
+    @staticmethod
+    def describeMachine() -> Dict[str, Any]:
+        '''Return the properties of the current machine the measured settings depend on'''
+
+        return {
+            'cpuCount': os.cpu_count(),
+            'processor': platform.machine(),
+            'torchVersion': torch.__version__,
+            'cuda': torch.cuda.is_available()
+        }
+
+    def isMeasuredHere(self) -> bool:
+        '''Return whether the profile was measured on a machine like the current one'''
+
+        return self.machine == InferenceProfile.describeMachine()
+
+    def applyTo(self, config: ClassifierConfig) -> None:
+        '''Override the thread, batch size and memory format settings of the configuration'''
+
+        config.setTorchThreads(self.torchThreads)
+        config.setInteropThreads(self.interopThreads)
+        config.setInferenceBatchSize(self.batchSize)
+        config.setChannelsLast(self.channelsLast)
+
+    def getAsJson(self) -> Dict[str, Any]:
+        '''Return the profile as a json serializable dictionary'''
+
+        return {
+            'torchThreads': self.torchThreads,
+            'interopThreads': self.interopThreads,
+            'inferenceBatchSize': self.batchSize,
+            'channelsLast': self.channelsLast,
+            'tilesPerSecond': self.tilesPerSecond,
+            'networks': self.networks,
+            'machine': self.machine,
+            'createdAt': self.createdAt
+        }
+
+    def save(self, path: str) -> None:
+        '''Write the profile to the given json file'''
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(path, 'w') as profileFile:
+            json.dump(self.getAsJson(), profileFile, indent=4)
+
+    @staticmethod
+    def fromJson(data: Dict[str, Any]) -> 'InferenceProfile':
+        '''Create profile from its json dictionary'''
+
+        profile = InferenceProfile(int(data['torchThreads']), int(data['interopThreads']),
+                                   int(data['inferenceBatchSize']), bool(data['channelsLast']),
+                                   float(data.get('tilesPerSecond', 0.0)), data.get('networks', []))
+        profile.machine = data.get('machine', {})
+        profile.createdAt = data.get('createdAt')
+
+        return profile
+
+    @staticmethod
+    def load(path: str) -> 'InferenceProfile':
+        '''Load the profile from the given json file, None if there is no valid profile'''
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'r') as profileFile:
+                return InferenceProfile.fromJson(json.load(profileFile))
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            print(f'Error loading inference profile {path}: {error}')
+            return None
@@ -0,0 +1,230 @@
+import bisect
+import threading
+from timeit import default_timer as timer
+from typing import Any, Dict, List, Tuple
+
+'''Process-wide latency histograms and counters of the inference path, rendered in the Prometheus text format'''
+
+LATENCY_BUCKETS: List[float] = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                                30.0]
+SIZE_BUCKETS: List[float] = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384]
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def formatLabels(labels: LabelKey, extra: Tuple[str, str] = None) -> str:
+    '''Format the label pairs as a Prometheus label set, empty without labels'''
+
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def formatValue(value: float) -> str:
+    '''Format a sample value, integral values without a fraction'''
+
+    if value == int(value):
+        return str(int(value))
+
+    return repr(float(value))
+
+
+class Histogram:
+    '''Cumulative bucket counts, sum and count of the observed values of each label set'''
+
+    def __init__(self, name: str, description: str, buckets: List[float]) -> None:
+        '''Init histogram with its metric name, help text and the upper bounds of its buckets'''
+
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # Label set -> [count of each bucket followed by the count above the last bucket, sum]
+        self.values: Dict[LabelKey, List[Any]] = {}
+
+    def observe(self, value: float, labels: LabelKey) -> None:
+        '''Add the value to the bucket it falls in, the lock of the metrics must be held'''
+
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = [[0] * (len(self.buckets) + 1), 0.0]
+            self.values[labels] = entry
+
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self) -> List[str]:
+        '''Return the lines of the histogram in the Prometheus text format'''
+
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{formatLabels(labels, ("le", formatValue(bound)))} {cumulative}')
+
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{formatLabels(labels, ("le", "+Inf"))} {cumulative}')
+            lines.append(f'{self.name}_sum{formatLabels(labels)} {formatValue(total)}')
+            lines.append(f'{self.name}_count{formatLabels(labels)} {cumulative}')
+
+        return lines
+
+
+class Counter:
+    '''Monotonic total of each label set'''
+
+    def __init__(self, name: str, description: str) -> None:
+        '''Init counter with its metric name, ending with _total, and help text'''
+
+        self.name = name
+        self.description = description
+        self.values: Dict[LabelKey, float] = {}
+
+    def increment(self, value: float, labels: LabelKey) -> None:
+        '''Add the value to the total of the label set, the lock of the metrics must be held'''
+
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        '''Return the lines of the counter in the Prometheus text format'''
+
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{formatLabels(labels)} {formatValue(value)}'
+                  for labels, value in sorted(self.values.items())]
+
+        return lines
+
+
+class StageTimer:
+    '''Context manager observing the duration of a stage in the stage histogram'''
+
+    def __init__(self, stage: str, labels: Dict[str, str]) -> None:
+        '''Init timer of the named stage'''
+
+        self.stage = stage
+        self.labels = labels
+        self.startTime = 0.0
+
+    def __enter__(self) -> 'StageTimer':
+        '''Start timing the stage'''
+
+        self.startTime = timer()
+        return self
+
+    def __exit__(self, excType, excValue, traceback) -> None:
+        '''Observe the duration of the stage, also when it failed'''
+
+        Metrics.observeStage(self.stage, timer() - self.startTime, **self.labels)
+
+
+class Metrics:
+    '''Process-wide registry of the inference metrics, recording is a dictionary update under a lock'''
+
+    STAGE_SECONDS = 'classifier_stage_seconds'
+    REQUEST_SECONDS = 'classifier_request_seconds'
+    QUEUE_WAIT_SECONDS = 'classifier_queue_wait_seconds'
+    BATCH_TILES = 'classifier_batch_tiles'
+    REQUEST_TILES = 'classifier_request_tiles'
+    TILES_TOTAL = 'classifier_tiles_total'
+    REQUESTS_TOTAL = 'classifier_requests_total'
+
+    _lock = threading.Lock()
+    _enabled: bool = True
+    _histograms: Dict[str, Histogram] = {
+        STAGE_SECONDS: Histogram(STAGE_SECONDS, 'Duration of each stage of a classification', LATENCY_BUCKETS),
+        REQUEST_SECONDS: Histogram(REQUEST_SECONDS, 'Duration of the API requests until the response is returned',
+                                   LATENCY_BUCKETS),
+        QUEUE_WAIT_SECONDS: Histogram(QUEUE_WAIT_SECONDS, 'Time spent waiting in the admission and batching queues',
+                                      LATENCY_BUCKETS),
+        BATCH_TILES: Histogram(BATCH_TILES, 'Number of tiles of each forward pass', SIZE_BUCKETS),
+        REQUEST_TILES: Histogram(REQUEST_TILES, 'Number of tiles of each classified image', SIZE_BUCKETS)
+    }
+    _counters: Dict[str, Counter] = {
+        TILES_TOTAL: Counter(TILES_TOTAL, 'Tiles run through the networks'),
+        REQUESTS_TOTAL: Counter(REQUESTS_TOTAL, 'API requests by route and status code')
+    }
+
+    def __init__(self) -> None:
+        pass
+
+    @staticmethod
+    def setEnabled(enabled: bool) -> None:
+        '''Set whether metrics are recorded'''
+
+        Metrics._enabled = enabled
+
+    @staticmethod
+    def isEnabled() -> bool:
+        '''Return whether metrics are recorded'''
+
+        return Metrics._enabled
+
+    @staticmethod
+    def observe(name: str, value: float, **labels: str) -> None:
+        '''Add the value to the named histogram'''
+
+        if not Metrics._enabled:
+            return
+
+        key = tuple(sorted(labels.items()))
+        with Metrics._lock:
+            Metrics._histograms[name].observe(value, key)
+
+    @staticmethod
+    def increment(name: str, value: float = 1, **labels: str) -> None:
+        '''Add the value to the named counter'''
+
+        if not Metrics._enabled:
+            return
+
+        key = tuple(sorted(labels.items()))
+        with Metrics._lock:
+            Metrics._counters[name].increment(value, key)
+
+    @staticmethod
+    def observeStage(stage: str, seconds: float, **labels: str) -> None:
+        '''Add the duration of a classification stage'''
+
+        Metrics.observe(Metrics.STAGE_SECONDS, seconds, stage=stage, **labels)
+
+    @staticmethod
+    def timeStage(stage: str, **labels: str) -> StageTimer:
+        '''Return a context manager observing the duration of the stage'''
+
+        return StageTimer(stage, labels)
+
+    @staticmethod
+    def reset() -> None:
+        '''Drop every recorded value'''
+
+        with Metrics._lock:
+            for metric in list(Metrics._histograms.values()) + list(Metrics._counters.values()):
+                metric.values = {}
+
+    @staticmethod
+    def render(values: Dict[str, Tuple[str, float]] = None) -> str:
+        '''Render the metrics and the given name -> (help, value) samples in the Prometheus text format
+
+        The samples are totals kept elsewhere, like the cache hits, names ending in _total are
+        rendered as counters, the others as gauges.
+        '''
+
+        lines = []
+
+        with Metrics._lock:
+            for histogram in Metrics._histograms.values():
+                lines += histogram.render()
+            for counter in Metrics._counters.values():
+                lines += counter.render()
+
+        for name, (description, value) in (values or {}).items():
+            metricType = 'counter' if name.endswith('_total') else 'gauge'
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {metricType}', f'{name} {formatValue(value)}']
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,574 @@
+import glob
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+import torch
+
+from .admissionController import AdmissionController
+from .batchScheduler import BatchScheduler
+from .classificationMap import ClassificationMap, BaseClassification
+from .config.config import Config
+from .config.classifierConfig import ClassifierConfig
+from .inferenceEngine import InferenceEngine
+from .inferenceProfile import InferenceProfile
+from .metrics import Metrics
+from .modelSnapshot import ModelSnapshot
+from .modelWatcher import ModelWatcher
+from .resultCache import ResultCache
+from .utils.imageUtils import tilesToTensors
+
+
+class ModelRegistry:
+    '''Process-wide registry of the networks used for classification'''
+
+    _lock = threading.Lock()
+    # Serializes reloads, held while a new snapshot loads so requests are not blocked meanwhile
+    _reloadLock = threading.Lock()
+    _loaded: bool = False
+    _snapshot: ModelSnapshot = None
+    _device: str = None
+    _executor: ThreadPoolExecutor = None
+    _decodeExecutor: ThreadPoolExecutor = None
+    _resultCache: ResultCache = None
+    _admissionController: AdmissionController = None
+    _watcher: ModelWatcher = None
+    _forking: bool = False
+    _forkedWorker: bool = False
+    _preloadThread: threading.Thread = None
+    _loadError: str = None
+
+    def __init__(self) -> None:
+        pass
+
+    @staticmethod
+    def load() -> None:
+        '''Load every classification's network and prepare it for inference'''
+
+        with ModelRegistry._lock:
+            ModelRegistry._loadUnlocked()
+
+    @staticmethod
+    def ensureLoaded() -> None:
+        '''Load the networks on first use, do nothing if they are already loaded'''
+
+        if ModelRegistry._loaded:
+            return
+
+        with ModelRegistry._lock:
+            if not ModelRegistry._loaded:
+                ModelRegistry._loadUnlocked()
+
+    @staticmethod
+    def preload() -> None:
+        '''Start loading the networks in the background, do nothing if they are loaded or loading'''
+
+        with ModelRegistry._lock:
+            if ModelRegistry._loaded or (ModelRegistry._preloadThread and ModelRegistry._preloadThread.is_alive()):
+                return
+
+            ModelRegistry._loadError = None
+            ModelRegistry._preloadThread = threading.Thread(
+                target=ModelRegistry._preload, name='modelPreload', daemon=True)
+            ModelRegistry._preloadThread.start()
+
+    @staticmethod
+    def _preload() -> None:
+        '''Load the networks and keep the error of a failed load for the readiness check'''
+
+        try:
+            ModelRegistry.ensureLoaded()
+        except Exception as exception:
+            print(f'Error loading models: {exception}')
+            ModelRegistry._loadError = str(exception)
+
+    @staticmethod
+    def getLoadError() -> str:
+        '''Get the error of the last failed background load, None if it did not fail'''
+
+        return ModelRegistry._loadError
+
+    @staticmethod
+    def _loadUnlocked() -> None:
+        '''Build the classification map and load the networks, the lock must be held'''
+
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        print(f'Loading models to device: {device}')
+
+        ModelRegistry._device = device
+        ModelRegistry.swapSnapshot(ModelRegistry.createSnapshot(device))
+        ModelRegistry.setupAdmissionController(ModelRegistry._snapshot.getConfig())
+        Metrics.setEnabled(ModelRegistry._snapshot.getConfig().getMetricsEnabled())
+        ModelRegistry._loaded = True
+
+        if not ModelRegistry._forking:
+            ModelRegistry.startWatcher()
+
+    @staticmethod
+    def createSnapshot(device: str) -> ModelSnapshot:
+        '''Load the model files with the current configuration into a new snapshot'''
+
+        config = ClassifierConfig(Config.getPath())
+
+        classificationMap = ClassificationMap()
+        classifications: Dict[str,
+                              BaseClassification] = classificationMap.getClassifications()
+
+        for key, classification in classifications.items():
+            # Every classification gets its own configuration, the type
+            # specific overrides would leak between them otherwise
+            classification.device = device
+            classification.configureAndSetupNetwork(
+                ClassifierConfig(Config.getPath()))
+
+        if config.getUseInferenceProfile():
+            ModelRegistry.applyInferenceProfile(
+                config, ModelRegistry.getNetworkIds(classifications))
+        ModelRegistry.configureThreads(config)
+
+        if config.getFoldNormalization():
+            ModelRegistry.foldNetworks(classifications)
+
+        for classification in classifications.values():
+            classification.setupInferenceModel()
+
+        versions = {key: classification.getModelVersion()
+                    for key, classification in classifications.items()}
+
+        engine = InferenceEngine(
+            classifications, device, config.getInferenceBatchSize(), config.getFusedInference())
+
+        if config.getDenseInference():
+            engine.setupDenseNetworks(config.getImageSize())
+
+        engine.setChannelsLast(config.getChannelsLast())
+
+        return ModelSnapshot(config, classificationMap, engine,
+                             ModelRegistry.createScheduler(config, engine), versions)
+
+    @staticmethod
+    def createScheduler(config: ClassifierConfig, engine: InferenceEngine) -> BatchScheduler:
+        '''Start the cross-request batching scheduler of the engine, none is started while preparing to fork'''
+
+        if not config.getMicroBatching() or ModelRegistry._forking:
+            return None
+
+        scheduler = BatchScheduler(
+            engine, config.getMicroBatchMaxSize(), config.getMicroBatchMaxWaitMs())
+        scheduler.start()
+
+        return scheduler
+
+    @staticmethod
+    def swapSnapshot(snapshot: ModelSnapshot) -> None:
+        '''Serve the new snapshot, requests holding the old one finish on it'''
+
+        ModelRegistry.setupResultCache(
+            snapshot.getConfig(), snapshot.getModelVersions())
+
+        oldSnapshot = ModelRegistry._snapshot
+        ModelRegistry._snapshot = snapshot
+
+        # A stopped scheduler runs the batches of the remaining requests directly
+        if oldSnapshot and oldSnapshot.getScheduler():
+            oldSnapshot.getScheduler().stop()
+
+    @staticmethod
+    def reload() -> bool:
+        '''Load the current model files and configuration next to the served ones and swap them in if they work
+
+        Return whether the new snapshot is served, the current one stays if loading or validating fails.
+        '''
+
+        with ModelRegistry._reloadLock:
+            print('Reloading models')
+
+            try:
+                snapshot = ModelRegistry.createSnapshot(ModelRegistry._device)
+            except Exception as exception:
+                print(f'Error reloading models, serving the current ones: {exception}')
+                return False
+
+            if not ModelRegistry.validateSnapshot(snapshot):
+                if snapshot.getScheduler():
+                    snapshot.getScheduler().stop()
+                print('The reloaded models failed validation, serving the current ones')
+                return False
+
+            with ModelRegistry._lock:
+                ModelRegistry.swapSnapshot(snapshot)
+
+            print(f'Serving reloaded models: {snapshot.getModelVersions()}')
+
+            return True
+
+    @staticmethod
+    def validateSnapshot(snapshot: ModelSnapshot, tileCount: int = 8) -> bool:
+        '''Check that every model file loaded and the networks give finite logits for a smoke batch of random tiles'''
+
+        config = snapshot.getConfig()
+        classifications = snapshot.getClassificationMap().getClassifications()
+
+        for key, classification in classifications.items():
+            if classification.getConfigutation().getLoadModel() and not classification.isModelLoaded():
+                print(f'The model of {key} could not be loaded')
+                return False
+
+        width, height = config.getImageSize()
+        tiles = np.random.default_rng(0).integers(
+            0, 256, (tileCount, height, width, 3), dtype=np.uint8)
+
+        mean, std = None, None
+        if not snapshot.getEngine().isInputFolded():
+            mean, std = tuple(config.getMean()), tuple(config.getStd())
+
+        try:
+            logits = snapshot.getEngine().predictLogits(
+                tilesToTensors(tiles, (width, height), mean, std))
+        except Exception as exception:
+            print(f'Error running the smoke batch: {exception}')
+            return False
+
+        for key, value in logits.items():
+            if value.ndim != 2 or value.shape[0] != tileCount or not torch.isfinite(value).all():
+                print(f'The network of {key} gives invalid logits for the smoke batch')
+                return False
+
+        return True
+
+    @staticmethod
+    def getWatchedPaths() -> List[str]:
+        '''Return the configuration file, the model files of the classifications and every model in the models folder'''
+
+        paths = {Config.getPath()}
+        paths.update(glob.glob(os.path.join(Config.getModelsPath(), '*.pth')))
+
+        snapshot = ModelRegistry._snapshot
+        if snapshot:
+            for classification in snapshot.getClassificationMap().getClassifications().values():
+                paths.add(classification.getConfigutation().getModelPath())
+
+        return sorted(paths)
+
+    @staticmethod
+    def createWatcher(onChange: Callable[[], bool]) -> ModelWatcher:
+        '''Create a watcher of the model files and the configuration calling onChange, None if watching is disabled'''
+
+        interval = ModelRegistry._snapshot.getConfig().getModelWatchInterval()
+        if interval <= 0:
+            return None
+
+        return ModelWatcher(ModelRegistry.getWatchedPaths, onChange, interval)
+
+    @staticmethod
+    def startWatcher() -> None:
+        '''Start watching the model files and the configuration for changes, if enabled and not running'''
+
+        if ModelRegistry._watcher:
+            return
+
+        ModelRegistry._watcher = ModelRegistry.createWatcher(ModelRegistry.reload)
+        if ModelRegistry._watcher:
+            ModelRegistry._watcher.start()
+
+    @staticmethod
+    def reloadForFork() -> bool:
+        '''Reload the models in the parent process of the pre-forked workers and share the new weights
+
+        Return whether the new models are served, the parent then forks new workers to serve them.
+        '''
+
+        if not ModelRegistry.reload():
+            return False
+
+        with ModelRegistry._lock:
+            ModelRegistry.shareMemory()
+
+        return True
+
+    @staticmethod
+    def loadForFork() -> None:
+        '''Load the networks once in a parent process before it forks the serving workers
+
+        The weights are moved to shared memory, so the workers use them without copying. Torch runs
+        single threaded and no threads are started, since threads do not survive the fork.
+        '''
+
+        with ModelRegistry._lock:
+            ModelRegistry._forking = True
+            ModelRegistry._loadUnlocked()
+            ModelRegistry.shareMemory()
+
+    @staticmethod
+    def shareMemory() -> None:
+        '''Move the weights of every loaded network to shared memory'''
+
+        snapshot = ModelRegistry._snapshot
+
+        modules = snapshot.getEngine().getModules()
+        modules += [classification.getNetwork() for classification in
+                    snapshot.getClassificationMap().getClassifications().values()]
+
+        for module in modules:
+            try:
+                module.share_memory()
+            except RuntimeError as error:
+                print(f'Error sharing the memory of {type(module).__name__}: {error}')
+
+    @staticmethod
+    def setupForkedWorker(cores: List[int]) -> None:
+        '''Pin the forked worker to its cores and restart the thread pools and sessions of the parent
+
+        The worker does not watch the model files, the parent reloads them and forks new workers,
+        so the weights stay shared.
+        '''
+
+        if cores and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+
+        with ModelRegistry._lock:
+            ModelRegistry._forking = False
+            ModelRegistry._forkedWorker = True
+            ModelRegistry._executor = None
+            ModelRegistry._decodeExecutor = None
+            ModelRegistry._admissionController = None
+
+            snapshot = ModelRegistry._snapshot
+            ModelRegistry.configureThreads(snapshot.getConfig())
+            ModelRegistry.setupAdmissionController(snapshot.getConfig())
+
+            for classification in snapshot.getClassificationMap().getClassifications().values():
+                model = classification.getInferenceModel()
+                if hasattr(model, 'restart'):
+                    model.restart()
+
+            snapshot.setScheduler(ModelRegistry.createScheduler(
+                snapshot.getConfig(), snapshot.getEngine()))
+
+    @staticmethod
+    def getAvailableCores() -> List[int]:
+        '''Return the cores the process may run on'''
+
+        if hasattr(os, 'sched_getaffinity'):
+            return sorted(os.sched_getaffinity(0))
+
+        return list(range(os.cpu_count() or 1))
+
+    @staticmethod
+    def getNetworkIds(classifications: Dict[str, BaseClassification]) -> List[str]:
+        '''Return the sorted ids of the network architectures of the classifications'''
+
+        return sorted({classification.getNetwork().getId() for classification in classifications.values()})
+
+    @staticmethod
+    def applyInferenceProfile(config: ClassifierConfig, networkIds: List[str]) -> None:
+        '''Apply the settings measured by the autotuneInference command if they fit this machine and these networks'''
+
+        path = Config.getInferenceProfilePath()
+        profile = InferenceProfile.load(path)
+        if profile is None:
+            return
+
+        if not profile.isMeasuredHere():
+            print(f'Inference profile {path} was measured on another machine, not using it')
+            return
+
+        if profile.networks != networkIds:
+            print(f'Inference profile {path} was measured for other networks, not using it')
+            return
+
+        profile.applyTo(config)
+        print(f'Using inference profile {path}: {profile.torchThreads} threads, '
+              f'{profile.interopThreads} inter-op threads, batch size {profile.batchSize}, '
+              f'channels last {profile.channelsLast}')
+
+    @staticmethod
+    def foldNetworks(classifications: Dict[str, BaseClassification]) -> None:
+        '''Fold the normalization into every network, the tiles are prepared once for all of them so none is folded if one fails'''
+
+        folded = [classification.foldNetwork()
+                  for classification in classifications.values()]
+
+        if all(folded):
+            print(f'Folded networks: {list(classifications.keys())}')
+            return
+
+        for classification in classifications.values():
+            classification.clearFoldedNetwork()
+        print('Not every network can be folded, serving them unfolded')
+
+    @staticmethod
+    def configureThreads(config: ClassifierConfig) -> None:
+        '''Split the cores between the inference workers so torch threads do not oversubscribe them'''
+
+        workers = config.getInferenceWorkers()
+        threads = config.getTorchThreads()
+        coreThreads = max(1, len(ModelRegistry.getAvailableCores()) // workers)
+
+        # A forked worker only owns its partition of the cores, an inference profile measured on the whole
+        # machine would oversubscribe them
+        if threads == 0 or (ModelRegistry._forkedWorker and threads > coreThreads):
+            threads = coreThreads
+
+        # A parent forking after running torch on several threads would leave its workers deadlocked
+        if ModelRegistry._forking:
+            threads = 1
+
+        torch.set_num_threads(threads)
+        print(f'Inference workers: {workers}, torch threads per worker: {threads}')
+
+        interopThreads = config.getInteropThreads()
+        if interopThreads > 0 and torch.get_num_interop_threads() != interopThreads:
+            # Torch only accepts it before the first inter-op parallel work of the process
+            try:
+                torch.set_num_interop_threads(interopThreads)
+                print(f'Torch inter-op threads: {interopThreads}')
+            except RuntimeError as error:
+                print(f'Error setting inter-op threads: {error}')
+
+        if ModelRegistry._executor is None:
+            ModelRegistry._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='inference')
+
+        if ModelRegistry._decodeExecutor is None:
+            ModelRegistry._decodeExecutor = ThreadPoolExecutor(
+                max_workers=config.getDecodeWorkers(), thread_name_prefix='decode')
+
+    @staticmethod
+    def setupResultCache(config: ClassifierConfig, versions: Dict[str, str]) -> None:
+        '''Create the result cache once, drop the entries of models replaced by a new version'''
+
+        if ModelRegistry._resultCache is None:
+            if config.getResultCacheBytes() > 0:
+                diskPath = Config.getResultCachePath() if config.getResultCacheDisk() else None
+                ModelRegistry._resultCache = ResultCache(
+                    config.getResultCacheBytes(), diskPath, config.getResultCacheDiskBytes())
+            return
+
+        oldVersions = ModelRegistry._snapshot.getModelVersions() if ModelRegistry._snapshot else {}
+        for key, oldVersion in oldVersions.items():
+            if versions.get(key) != oldVersion:
+                dropped = ModelRegistry._resultCache.invalidateModel(
+                    key, oldVersion)
+                print(f'Model {key} changed, dropped {dropped} cached results')
+
+    @staticmethod
+    def getMaxActiveRequests(config: ClassifierConfig) -> int:
+        '''Return the requests admitted at once, by default one per inference worker
+
+        With micro-batching small requests are only coalesced if enough of them run at once, so by
+        default as many are admitted as tiles fit into one scheduled batch.
+        '''
+
+        if config.getMaxActiveRequests() > 0:
+            return config.getMaxActiveRequests()
+
+        if config.getMicroBatching() and not ModelRegistry._forking:
+            return max(config.getInferenceWorkers(), config.getMicroBatchMaxSize())
+
+        return config.getInferenceWorkers()
+
+    @staticmethod
+    def setupAdmissionController(config: ClassifierConfig) -> None:
+        '''Create the admission controller once, it admits getMaxActiveRequests requests at once'''
+
+        if ModelRegistry._admissionController is None and config.getMaxQueuedRequests() > 0:
+            ModelRegistry._admissionController = AdmissionController(
+                ModelRegistry.getMaxActiveRequests(config), config.getMaxQueuedRequests(),
+                config.getMaxClientRequests())
+
+    @staticmethod
+    def getAdmissionController() -> AdmissionController:
+        '''Get the admission controller of the classification requests, None if admission control is disabled'''
+
+        ModelRegistry.ensureLoaded()
+        return ModelRegistry._admissionController
+
+    @staticmethod
+    def getExecutor() -> ThreadPoolExecutor:
+        '''Get the size limited thread pool running classifications of async requests'''
+
+        ModelRegistry.ensureLoaded()
+        return ModelRegistry._executor
+
+    @staticmethod
+    def getDecodeExecutor() -> ThreadPoolExecutor:
+        '''Get the thread pool decoding the images of batch requests'''
+
+        ModelRegistry.ensureLoaded()
+        return ModelRegistry._decodeExecutor
+
+    @staticmethod
+    def isLoaded() -> bool:
+        '''Return whether the networks are loaded'''
+
+        return ModelRegistry._loaded
+
+    @staticmethod
+    def reset() -> None:
+        '''Drop the loaded networks, they are loaded again on next use'''
+
+        with ModelRegistry._lock:
+            ModelRegistry._loaded = False
+            ModelRegistry._device = None
+
+            if ModelRegistry._watcher:
+                ModelRegistry._watcher.stop()
+                ModelRegistry._watcher = None
+
+            if ModelRegistry._snapshot and ModelRegistry._snapshot.getScheduler():
+                ModelRegistry._snapshot.getScheduler().stop()
+            ModelRegistry._snapshot = None
+
+    @staticmethod
+    def getSnapshot() -> ModelSnapshot:
+        '''Get the served snapshot, requests use it until they finish even if a reload replaces it'''
+
+        ModelRegistry.ensureLoaded()
+        return ModelRegistry._snapshot
+
+    @staticmethod
+    def getConfig() -> ClassifierConfig:
+        '''Get the base configuration used for classification'''
+
+        return ModelRegistry.getSnapshot().getConfig()
+
+    @staticmethod
+    def getClassificationMap() -> ClassificationMap:
+        '''Get the classification map holding the loaded networks'''
+
+        return ModelRegistry.getSnapshot().getClassificationMap()
+
+    @staticmethod
+    def getDevice() -> str:
+        '''Get the device the networks are loaded to'''
+
+        ModelRegistry.ensureLoaded()
+        return ModelRegistry._device
+
+    @staticmethod
+    def getEngine() -> InferenceEngine:
+        '''Get the inference engine running the loaded networks'''
+
+        return ModelRegistry.getSnapshot().getEngine()
+
+    @staticmethod
+    def getScheduler() -> BatchScheduler:
+        '''Get the cross-request batching scheduler, None if micro-batching is disabled'''
+
+        return ModelRegistry.getSnapshot().getScheduler()
+
+    @staticmethod
+    def getModelVersions() -> Dict[str, str]:
+        '''Get the version of each loaded model'''
+
+        return ModelRegistry.getSnapshot().getModelVersions()
+
+    @staticmethod
+    def getResultCache() -> ResultCache:
+        '''Get the classification result cache, None if caching is disabled'''
+
+        ModelRegistry.ensureLoaded()
+        return ModelRegistry._resultCache
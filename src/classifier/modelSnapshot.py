@@ -0,0 +1,54 @@
+from typing import Dict
+
+from .batchScheduler import BatchScheduler
+from .classificationMap import ClassificationMap
+from .config.classifierConfig import ClassifierConfig
+from .inferenceEngine import InferenceEngine
+
+
+class ModelSnapshot:
+    '''One loaded version of every network with the engine and scheduler running them
+
+    Requests take the current snapshot once and use it until they finish, so a reload swapping
+    the snapshot of the registry never mixes model versions within a request.
+    '''
+
+    def __init__(self, config: ClassifierConfig, classifications: ClassificationMap, engine: InferenceEngine,
+                 scheduler: BatchScheduler, versions: Dict[str, str]) -> None:
+        '''Init snapshot with the loaded networks'''
+
+        self.config = config
+        self.classifications = classifications
+        self.engine = engine
+        self.scheduler = scheduler
+        self.versions = versions
+
+    def getConfig(self) -> ClassifierConfig:
+        '''Get the base configuration the networks were loaded with'''
+
+        return self.config
+
+    def getClassificationMap(self) -> ClassificationMap:
+        '''Get the classification map holding the networks'''
+
+        return self.classifications
+
+    def getEngine(self) -> InferenceEngine:
+        '''Get the inference engine running the networks'''
+
+        return self.engine
+
+    def getScheduler(self) -> BatchScheduler:
+        '''Get the cross-request batching scheduler, None if micro-batching is disabled'''
+
+        return self.scheduler
+
+    def setScheduler(self, scheduler: BatchScheduler) -> None:
+        '''Set the cross-request batching scheduler'''
+
+        self.scheduler = scheduler
+
+    def getModelVersions(self) -> Dict[str, str]:
+        '''Get the version of each network'''
+
+        return self.versions
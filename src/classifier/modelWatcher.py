@@ -0,0 +1,83 @@
+import os
+import threading
+from typing import Callable, Dict, List, Tuple
+
+
+class ModelWatcher:
+    '''Poll the model files and the configuration file and report when they change
+
+    A change is only reported once the files stayed the same for a whole interval, so a model file
+    still being copied is not loaded half written.
+    '''
+
+    def __init__(self, getPaths: Callable[[], List[str]], onChange: Callable[[], bool], interval: float) -> None:
+        '''Init watcher with the function listing the watched files, the change callback and the poll interval'''
+
+        self.getPaths = getPaths
+        self.onChange = onChange
+        self.interval = interval
+
+        self._stopEvent = threading.Event()
+        self._thread: threading.Thread = None
+
+        self._signature = self.scan()
+        self._pendingSignature = None
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        '''Return the modification time and size of each watched file, None for missing ones'''
+
+        signature = {}
+
+        for path in self.getPaths():
+            try:
+                stat = os.stat(path)
+                signature[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature[path] = None
+
+        return signature
+
+    def start(self) -> None:
+        '''Start the polling thread'''
+
+        if self._thread:
+            return
+
+        self._thread = threading.Thread(
+            target=self._run, name='modelWatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        '''Stop the polling thread'''
+
+        self._stopEvent.set()
+
+    def check(self) -> bool:
+        '''Compare the files with the last check, call the callback for a settled change and return its result'''
+
+        signature = self.scan()
+
+        if signature == self._signature:
+            self._pendingSignature = None
+            return False
+
+        if signature != self._pendingSignature:
+            self._pendingSignature = signature
+            return False
+
+        self._pendingSignature = None
+        changed = bool(self.onChange())
+
+        # The reloaded configuration may watch other files, a failed reload is not retried until they change again
+        self._signature = self.scan()
+
+        return changed
+
+    def _run(self) -> None:
+        '''Check the files every interval until stopped'''
+
+        while not self._stopEvent.wait(self.interval):
+            try:
+                self.check()
+            except Exception as exception:
+                print(f'Error checking model files: {exception}')
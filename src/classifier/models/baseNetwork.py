@@ -33,23 +33,34 @@ class BaseNetwork(nn.Module):
 
         return self.id
 
+    def readStateDict(self, path: str, device: str = None) -> dict:
+        '''Read the state dict memory mapped, so the file is not copied to memory before the weights'''
+
+        try:
+            return torch.load(path, map_location=device, mmap=True)
+        except RuntimeError:
+            # Files of the legacy serialization format cannot be memory mapped
+            return torch.load(path, map_location=device)
+
     def load(self, path: str) -> None:
         '''Load model state from the given file'''
 
         try:
-            self.load_state_dict(torch.load(path))
+            self.load_state_dict(self.readStateDict(path))
             print('Model loaded')
         except RuntimeError as error:
             print(f'Error loading model {error}')
 
-    def loadToDevice(self, path: str, device: str) -> None:
-        '''Load model state to the given device'''
+    def loadToDevice(self, path: str, device: str) -> bool:
+        '''Load model state to the given device, return whether it was loaded'''
 
         try:
-            self.load_state_dict(torch.load(path, map_location=device))
+            self.load_state_dict(self.readStateDict(path, device))
             print('Model loaded')
+            return True
         except RuntimeError as error:
             print(f'Error loading model: {error}')
+            return False
 
     def save(self, path: str) -> None:
         '''Save the current model to the given path'''
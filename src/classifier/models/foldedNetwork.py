@@ -0,0 +1,113 @@
+import copy
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+
+from .baseNetwork import BaseNetwork
+
+
+# Pixel value range of the tiles the folded network is fed, they are only converted to float
+INPUT_SCALE = 255.0
+
+
+class FoldedNetwork(BaseNetwork):
+    '''Inference copy of a network with the input normalization and the batch norms folded into the weights
+
+    The first convolution takes the uint8 scaled tiles directly and every convolution or linear layer
+    followed by a batch norm is replaced by a single layer computing both.
+    '''
+
+    def __init__(self, network: BaseNetwork, mean: Tuple[float], std: Tuple[float]) -> None:
+        '''Fold the eval mode network whose inputs are normalized with the given mean and std'''
+
+        super().__init__(f'{network.getId()}_folded')
+
+        if not FoldedNetwork.canFold(network):
+            raise ValueError('The given network cannot be folded')
+
+        layers = [copy.deepcopy(layer).eval() for layer in network.layers]
+        layers[0] = FoldedNetwork.foldInputNormalization(layers[0], mean, std)
+
+        folded = []
+        for layer in layers:
+            if isinstance(layer, nn.BatchNorm2d):
+                folded[-1] = fuse_conv_bn_eval(folded[-1], layer)
+            elif isinstance(layer, nn.BatchNorm1d):
+                folded[-1] = fuse_linear_bn_eval(folded[-1], layer)
+            else:
+                folded.append(layer)
+
+        self.layers = nn.ModuleList(folded)
+        self.eval()
+
+    @staticmethod
+    def foldInputNormalization(conv: nn.Conv2d, mean: Tuple[float], std: Tuple[float]) -> nn.Conv2d:
+        '''Return the convolution computing conv((x / INPUT_SCALE - mean) / std) from the uint8 scaled x'''
+
+        folded = copy.deepcopy(conv)
+
+        weight = conv.weight.detach()
+        meanTensor = torch.tensor(mean, dtype=weight.dtype,
+                                  device=weight.device).view(1, -1, 1, 1)
+        stdTensor = torch.tensor(std, dtype=weight.dtype,
+                                 device=weight.device).view(1, -1, 1, 1)
+
+        bias = conv.bias.detach() if conv.bias is not None else weight.new_zeros(
+            conv.out_channels)
+
+        with torch.no_grad():
+            folded.weight.copy_(weight / (stdTensor * INPUT_SCALE))
+            folded.bias = nn.Parameter(
+                bias - (weight * meanTensor / stdTensor).sum((1, 2, 3)))
+
+        return folded
+
+    @staticmethod
+    def canFold(network: nn.Module) -> bool:
+        '''Return whether every batch norm follows a convolution or linear layer and the first layer is a convolution
+
+        Zero padding of the first convolution would pad the normalized input with a different value
+        than the raw input, only the padding modes copying input pixels keep the folding exact.
+        '''
+
+        if not isinstance(network, BaseNetwork) or network.layers is None:
+            return False
+
+        layers = list(network.layers)
+        if not layers or not isinstance(layers[0], nn.Conv2d) or layers[0].groups != 1:
+            return False
+
+        first = layers[0]
+        if first.padding_mode == 'zeros' and first.padding not in ('valid', (0, 0)):
+            return False
+
+        for previous, layer in zip(layers, layers[1:]):
+            if isinstance(layer, nn.BatchNorm2d) and not isinstance(previous, nn.Conv2d):
+                return False
+            if isinstance(layer, nn.BatchNorm1d) and not isinstance(previous, nn.Linear):
+                return False
+
+        return True
+
+    @staticmethod
+    def checkParity(network: nn.Module, folded: nn.Module, mean: Tuple[float], std: Tuple[float],
+                    imageSize: Tuple[int, int], device: str, tolerance: float = 1e-3) -> bool:
+        '''Return whether the folded network matches the network on a reproducible batch of random tiles'''
+
+        width, height = imageSize
+        generator = torch.Generator().manual_seed(0)
+        sample = torch.randint(0, 256, (8, 3, height, width),
+                               generator=generator).float().to(device)
+
+        meanTensor = torch.tensor(mean, device=device).view(1, -1, 1, 1)
+        stdTensor = torch.tensor(std, device=device).view(1, -1, 1, 1)
+
+        with torch.no_grad():
+            expected = network(
+                (sample / INPUT_SCALE - meanTensor) / stdTensor)
+            actual = folded(sample)
+
+        scale = expected.abs().max().clamp_min(1.0)
+        return bool((expected - actual).abs().max() <= tolerance * scale)
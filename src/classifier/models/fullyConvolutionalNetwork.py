@@ -0,0 +1,170 @@
+import copy
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+
+from .baseNetwork import BaseNetwork
+
+
+# Convolutional layers copied as they are, they work on inputs of any size
+FEATURE_LAYER_TYPES = (nn.Conv2d, nn.BatchNorm2d, nn.ReLU,
+                       nn.AvgPool2d, nn.MaxPool2d, nn.Dropout, nn.Identity)
+
+# Layers of the classifier head kept as they are, they work elementwise
+HEAD_LAYER_TYPES = (nn.ReLU, nn.Dropout, nn.Identity)
+
+
+class FullyConvolutionalNetwork(nn.Module):
+    '''Dense version of a network whose flattened features feed linear layers
+
+    The first linear layer becomes a convolution with the size of the feature map as kernel and the later
+    ones become 1x1 convolutions, so one pass over a large image evaluates every window at once.
+    '''
+
+    def __init__(self, network: BaseNetwork, imageSize: Tuple[int, int]) -> None:
+        '''Convert the eval mode network trained on (width, height) images'''
+
+        super().__init__()
+
+        layers = list(network.layers)
+        flattenIndex = next(index for index, layer in enumerate(layers)
+                            if isinstance(layer, nn.Flatten))
+
+        self.features = nn.Sequential(
+            *[copy.deepcopy(layer) for layer in layers[:flattenIndex]]).eval()
+        self.outputStride = FullyConvolutionalNetwork.calculateOutputStride(
+            self.features)
+
+        width, height = imageSize
+        parameter = next(network.parameters())
+        with torch.no_grad():
+            featureShape = self.features(torch.zeros(
+                1, 3, height, width, dtype=parameter.dtype, device=parameter.device)).shape[1:]
+
+        head = []
+        isFirstLinear = True
+        for layer in layers[flattenIndex + 1:]:
+            if isinstance(layer, nn.Linear):
+                kernelShape = featureShape[1:] if isFirstLinear else (1, 1)
+                head.append(FullyConvolutionalNetwork.linearToConv2d(
+                    layer, kernelShape))
+                isFirstLinear = False
+            elif isinstance(layer, nn.BatchNorm1d):
+                head.append(
+                    FullyConvolutionalNetwork.batchNorm1dToBatchNorm2d(layer))
+            else:
+                head.append(copy.deepcopy(layer))
+
+        self.head = nn.Sequential(*head).eval()
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        '''Map a (N, 3, H, W) image to the (N, classes, windowRows, windowCols) logits of every window'''
+
+        return self.head(self.features(x))
+
+    def getOutputStride(self) -> int:
+        '''Get the distance of neighbouring windows in input pixels'''
+
+        return self.outputStride
+
+    @staticmethod
+    def calculateOutputStride(features: nn.Sequential) -> int:
+        '''Return the product of the strides of the feature layers'''
+
+        stride = 1
+
+        for layer in features:
+            if isinstance(layer, (nn.Conv2d, nn.AvgPool2d, nn.MaxPool2d)):
+                layerStride = layer.stride if isinstance(
+                    layer.stride, int) else layer.stride[0]
+                stride *= layerStride
+
+        return stride
+
+    @staticmethod
+    def linearToConv2d(layer: nn.Linear, kernelShape: Tuple[int, int]) -> nn.Conv2d:
+        '''Return the convolution computing the linear layer on every (channels, *kernelShape) window'''
+
+        kernelHeight, kernelWidth = kernelShape
+        inChannels = layer.in_features // (kernelHeight * kernelWidth)
+
+        conv = nn.Conv2d(inChannels, layer.out_features, (kernelHeight, kernelWidth),
+                         bias=layer.bias is not None)
+        conv = conv.to(layer.weight.device, layer.weight.dtype)
+
+        with torch.no_grad():
+            conv.weight.copy_(layer.weight.view(
+                layer.out_features, inChannels, kernelHeight, kernelWidth))
+            if layer.bias is not None:
+                conv.bias.copy_(layer.bias)
+
+        return conv
+
+    @staticmethod
+    def batchNorm1dToBatchNorm2d(layer: nn.BatchNorm1d) -> nn.BatchNorm2d:
+        '''Return the per channel batch norm with the same statistics and affine parameters'''
+
+        batchNorm = nn.BatchNorm2d(layer.num_features, eps=layer.eps, affine=layer.affine)
+        batchNorm = batchNorm.to(layer.running_mean.device)
+        batchNorm.load_state_dict(layer.state_dict())
+
+        return batchNorm.eval()
+
+    @staticmethod
+    def canConvert(network: nn.Module) -> bool:
+        '''Return whether the network is a stack of convolutional layers followed by a flattened linear head
+
+        A padded convolution would pad the whole image instead of each window, changing the border of every
+        window, so only networks without padding give the same result as evaluating the windows separately.
+        '''
+
+        if not isinstance(network, BaseNetwork) or network.layers is None:
+            return False
+
+        layers = list(network.layers)
+        flattenIndices = [index for index, layer in enumerate(layers)
+                          if isinstance(layer, nn.Flatten)]
+
+        if len(flattenIndices) != 1:
+            return False
+
+        flattenIndex = flattenIndices[0]
+        features = layers[:flattenIndex]
+        head = layers[flattenIndex + 1:]
+
+        if not head or not isinstance(head[0], nn.Linear):
+            return False
+
+        for layer in features:
+            if not isinstance(layer, FEATURE_LAYER_TYPES):
+                return False
+            if isinstance(layer, (nn.AvgPool2d, nn.MaxPool2d)) and layer.kernel_size != layer.stride:
+                return False
+            if isinstance(layer, nn.Conv2d) and layer.padding not in ('valid', (0, 0)):
+                return False
+
+        return all(isinstance(layer, (nn.Linear, nn.BatchNorm1d) + HEAD_LAYER_TYPES) for layer in head)
+
+    @staticmethod
+    def checkParity(network: nn.Module, dense: 'FullyConvolutionalNetwork', imageSize: Tuple[int, int],
+                    device: str, tolerance: float = 1e-3) -> bool:
+        '''Return whether one dense pass matches evaluating each window of a reproducible random image separately'''
+
+        width, height = imageSize
+        stride = dense.getOutputStride()
+
+        generator = torch.Generator().manual_seed(0)
+        image = torch.randn(1, 3, height + stride, width + stride,
+                            generator=generator).to(device)
+
+        # The four windows one output stride apart, in the row major order of the dense output
+        windows = torch.cat([image[:, :, row:row + height, col:col + width]
+                             for row in (0, stride) for col in (0, stride)])
+
+        with torch.no_grad():
+            expected = network(windows)
+            actual = dense(image)[0, :, :2, :2].permute(1, 2, 0).reshape(4, -1)
+
+        scale = expected.abs().max().clamp_min(1.0)
+        return bool((expected - actual).abs().max() <= tolerance * scale)
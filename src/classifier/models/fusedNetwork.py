@@ -0,0 +1,191 @@
+from typing import Dict, List
+
+import torch
+import torch.nn as nn
+
+from .baseNetwork import BaseNetwork
+
+
+# Layers without parameters, applied to the fused tensor as they are
+SHARED_LAYER_TYPES = (nn.ReLU, nn.AvgPool2d, nn.MaxPool2d,
+                      nn.Flatten, nn.Dropout, nn.Identity)
+
+
+class GroupedLinear(nn.Module):
+    '''Independent linear layers applied to consecutive feature groups in one batched matmul'''
+
+    def __init__(self, layers: List[nn.Linear], outFeatures: int) -> None:
+        '''Stack the given linear layers, padding their outputs to the given size'''
+
+        super().__init__()
+
+        self.groups = len(layers)
+        self.inFeatures = layers[0].in_features
+        self.outFeatures = outFeatures
+
+        weight = torch.zeros(self.groups, self.inFeatures, outFeatures,
+                             dtype=layers[0].weight.dtype, device=layers[0].weight.device)
+        bias = weight.new_zeros(self.groups, 1, outFeatures)
+
+        for index, layer in enumerate(layers):
+            weight[index, :, :layer.out_features] = layer.weight.detach().t()
+            if layer.bias is not None:
+                bias[index, 0, :layer.out_features] = layer.bias.detach()
+
+        self.register_buffer('weight', weight)
+        self.register_buffer('bias', bias)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        '''Map (N, groups * in) to (N, groups * out)'''
+
+        batchSize = x.shape[0]
+        x = x.view(batchSize, self.groups, self.inFeatures).transpose(0, 1)
+        result = torch.baddbmm(self.bias, x, self.weight)
+
+        return result.transpose(0, 1).reshape(batchSize, self.groups * self.outFeatures)
+
+
+class FusedNetwork(nn.Module):
+    '''Evaluate several networks of the same architecture in a single pass'''
+
+    def __init__(self, networks: Dict[str, BaseNetwork]) -> None:
+        '''Fuse the given eval mode networks layer by layer'''
+
+        super().__init__()
+
+        if not FusedNetwork.canFuse(list(networks.values())):
+            raise ValueError('The given networks cannot be fused')
+
+        self.names: List[str] = list(networks.keys())
+        layerLists = [list(network.layers) for network in networks.values()]
+        self.classNums: List[int] = [layers[-1].out_features
+                                     for layers in layerLists]
+        self.maxClasses = max(self.classNums)
+
+        fusedLayers = []
+        isInputShared = True
+
+        for index, layers in enumerate(zip(*layerLists)):
+            layer = layers[0]
+
+            if isinstance(layer, nn.Conv2d):
+                fusedLayers.append(
+                    FusedNetwork.fuseConv2d(list(layers), isInputShared))
+                isInputShared = False
+            elif isinstance(layer, (nn.BatchNorm1d, nn.BatchNorm2d)):
+                fusedLayers.append(FusedNetwork.fuseBatchNorm(list(layers)))
+            elif isinstance(layer, nn.Linear):
+                isOutputLayer = index == len(layerLists[0]) - 1
+                outFeatures = self.maxClasses if isOutputLayer else layer.out_features
+                fusedLayers.append(GroupedLinear(list(layers), outFeatures))
+            else:
+                fusedLayers.append(layer)
+
+        self.layers = nn.ModuleList(fusedLayers)
+        self.eval()
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        '''Return the (N, networks, classes) padded logits of every network'''
+
+        for layer in self.layers:
+            x = layer(x)
+
+        return x.view(x.shape[0], len(self.names), self.maxClasses)
+
+    def predictLogits(self, batch: torch.Tensor) -> Dict[str, torch.Tensor]:
+        '''Return the logits of each network for the given batch'''
+
+        with torch.no_grad():
+            outputs = self(batch)
+
+        return {name: outputs[:, index, :self.classNums[index]]
+                for index, name in enumerate(self.names)}
+
+    def getNames(self) -> List[str]:
+        '''Get the names of the fused networks'''
+
+        return self.names
+
+    @staticmethod
+    def fuseConv2d(layers: List[nn.Conv2d], isInputShared: bool) -> nn.Conv2d:
+        '''Concatenate convolutions, the first one reads the shared input, later ones use groups'''
+
+        first = layers[0]
+        groups = first.groups if isInputShared else first.groups * len(layers)
+        inChannels = first.in_channels if isInputShared else first.in_channels * len(layers)
+
+        fused = nn.Conv2d(inChannels, first.out_channels * len(layers), first.kernel_size,
+                          stride=first.stride, padding=first.padding, dilation=first.dilation,
+                          groups=groups, bias=first.bias is not None, padding_mode=first.padding_mode)
+
+        fused.weight.data = torch.cat([layer.weight.detach()
+                                       for layer in layers])
+        if first.bias is not None:
+            fused.bias.data = torch.cat([layer.bias.detach()
+                                         for layer in layers])
+
+        return fused.to(first.weight.device)
+
+    @staticmethod
+    def fuseBatchNorm(layers: List[nn.Module]) -> nn.Module:
+        '''Concatenate the statistics and affine parameters of eval mode batch norms'''
+
+        first = layers[0]
+        fused = type(first)(first.num_features * len(layers), eps=first.eps,
+                            affine=first.affine, track_running_stats=True)
+
+        fused.running_mean.data = torch.cat([layer.running_mean.detach()
+                                             for layer in layers])
+        fused.running_var.data = torch.cat([layer.running_var.detach()
+                                            for layer in layers])
+        if first.affine:
+            fused.weight.data = torch.cat([layer.weight.detach()
+                                           for layer in layers])
+            fused.bias.data = torch.cat([layer.bias.detach()
+                                         for layer in layers])
+
+        return fused.to(first.running_mean.device)
+
+    @staticmethod
+    def canFuse(networks: List[nn.Module]) -> bool:
+        '''Return whether the networks share the same layers apart from the number of classes'''
+
+        if len(networks) < 2:
+            return False
+
+        if not all(isinstance(network, BaseNetwork) and network.layers is not None
+                   for network in networks):
+            return False
+
+        layerLists = [list(network.layers) for network in networks]
+        if len({len(layers) for layers in layerLists}) != 1:
+            return False
+
+        if not isinstance(layerLists[0][-1], nn.Linear):
+            return False
+
+        for index, layers in enumerate(zip(*layerLists)):
+            first = layers[0]
+
+            if any(type(layer) is not type(first) for layer in layers):
+                return False
+
+            if isinstance(first, nn.Conv2d):
+                if any(layer.weight.shape != first.weight.shape or
+                       (layer.bias is None) != (first.bias is None) or
+                       layer.padding_mode != first.padding_mode for layer in layers):
+                    return False
+            elif isinstance(first, (nn.BatchNorm1d, nn.BatchNorm2d)):
+                if any(layer.num_features != first.num_features or layer.running_mean is None or
+                       layer.affine != first.affine or layer.eps != first.eps for layer in layers):
+                    return False
+            elif isinstance(first, nn.Linear):
+                isOutputLayer = index == len(layerLists[0]) - 1
+                if any(layer.in_features != first.in_features or
+                       (not isOutputLayer and layer.out_features != first.out_features)
+                       for layer in layers):
+                    return False
+            elif not isinstance(first, SHARED_LAYER_TYPES):
+                return False
+
+        return True
@@ -0,0 +1,179 @@
+import glob
+import inspect
+import io
+import os
+from typing import Callable, List, Tuple, Union
+
+import torch
+import torch.nn as nn
+
+'''Collection of inference backend related utility functions'''
+
+BACKENDS: List[str] = ['eager', 'torchscript', 'compile', 'onnx']
+
+
+class OnnxRuntimeModel:
+    '''Run an exported onnx graph with onnxruntime on the cpu like a torch model'''
+
+    def __init__(self, source: Union[str, bytes]) -> None:
+        '''Create inference session from the given onnx file or serialized graph'''
+
+        self.source = source
+        self.restart()
+
+    def restart(self) -> None:
+        '''Create a new session, the thread pools of a session do not survive forking the process'''
+
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(
+            self.source, providers=['CPUExecutionProvider'])
+        self.inputName = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        '''Return the logits of the given batch'''
+
+        inputs = {self.inputName: batch.detach().cpu().numpy()}
+        output = self.session.run(None, inputs)[0]
+
+        return torch.from_numpy(output)
+
+
+def getArtifactPath(modelPath: str, backend: str, variant: str = '*') -> str:
+    '''Return the path of the compiled artifact of the variant stored next to the given .pth file'''
+
+    basePath = f'{os.path.splitext(modelPath)[0]}.{variant}'
+
+    if backend == 'onnx':
+        return f'{basePath}.onnx'
+
+    return f'{basePath}.{backend}.pt'
+
+
+def saveArtifact(artifactPath: str, modelPath: str, backend: str, save: Callable[[str], None]) -> None:
+    '''Save the artifact through a temporary file and remove the artifacts of other variants of the model'''
+
+    temporaryPath = f'{artifactPath}.{os.getpid()}.tmp'
+
+    try:
+        save(temporaryPath)
+        os.replace(temporaryPath, artifactPath)
+    finally:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+
+    stalePattern = getArtifactPath(glob.escape(modelPath), backend)
+    for stalePath in glob.glob(stalePattern):
+        if stalePath != artifactPath:
+            try:
+                os.remove(stalePath)
+                print(f'Removed stale artifact: {stalePath}')
+            except OSError as error:
+                print(f'Error removing stale artifact {stalePath}: {error}')
+
+
+def createSampleBatch(imageSize: Tuple[int, int], device: str, batchSize: int = 8) -> torch.Tensor:
+    '''Create a reproducible random batch with the given (width, height) image size'''
+
+    width, height = imageSize
+    generator = torch.Generator().manual_seed(0)
+    sample = torch.randn(batchSize, 3, height, width, generator=generator)
+
+    return sample.to(device)
+
+
+def createTorchScriptModel(model: nn.Module, modelPath: str, sample: torch.Tensor, device: str,
+                           variant: str = None) -> Callable:
+    '''Load the cached traced model or trace and save a new one, without a variant nothing is cached'''
+
+    artifactPath = getArtifactPath(modelPath, 'torchscript', variant) if variant else None
+
+    if artifactPath and os.path.exists(artifactPath):
+        print(f'Loading cached TorchScript model: {artifactPath}')
+        return torch.jit.load(artifactPath, map_location=device)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, sample)
+    traced = torch.jit.freeze(traced)
+
+    if artifactPath:
+        try:
+            saveArtifact(artifactPath, modelPath, 'torchscript', lambda path: torch.jit.save(traced, path))
+            print(f'TorchScript model saved: {artifactPath}')
+        except (OSError, RuntimeError) as error:
+            print(f'Error saving TorchScript model: {error}')
+
+    return traced
+
+
+def createCompiledModel(model: nn.Module, modelPath: str) -> Callable:
+    '''Compile the model, the generated kernels are cached next to the model'''
+
+    cachePath = os.path.join(os.path.dirname(modelPath), 'inductorCache')
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', cachePath)
+
+    return torch.compile(model)
+
+
+def createOnnxModel(model: nn.Module, modelPath: str, sample: torch.Tensor, variant: str = None) -> Callable:
+    '''Load the cached onnx graph or export a new one, then run it with onnxruntime
+
+    Without a variant the graph is exported in memory and nothing is cached.
+    '''
+
+    artifactPath = getArtifactPath(modelPath, 'onnx', variant) if variant else None
+
+    if artifactPath and os.path.exists(artifactPath):
+        return OnnxRuntimeModel(artifactPath)
+
+    exportArgs = {
+        'input_names': ['input'],
+        'output_names': ['logits'],
+        'dynamic_axes': {'input': {0: 'batch'}, 'logits': {0: 'batch'}}
+    }
+
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        exportArgs['dynamo'] = False
+
+    if not artifactPath:
+        graph = io.BytesIO()
+        torch.onnx.export(model, (sample.cpu(),), graph, **exportArgs)
+        return OnnxRuntimeModel(graph.getvalue())
+
+    saveArtifact(artifactPath, modelPath, 'onnx',
+                 lambda path: torch.onnx.export(model, (sample.cpu(),), path, **exportArgs))
+    print(f'ONNX model exported: {artifactPath}')
+
+    return OnnxRuntimeModel(artifactPath)
+
+
+def createInferenceModel(backend: str, model: nn.Module, modelPath: str, sample: torch.Tensor, device: str,
+                         variant: str = None) -> Callable:
+    '''Return a callable running the eval mode model with the given backend
+
+    The artifacts are cached under the variant name, which has to identify the weights and every
+    transformation of the model, without a variant they are not cached.
+    '''
+
+    if backend == 'eager':
+        return model
+    elif backend == 'torchscript':
+        return createTorchScriptModel(model, modelPath, sample, device, variant)
+    elif backend == 'compile':
+        return createCompiledModel(model, modelPath)
+    elif backend == 'onnx':
+        if device != 'cpu':
+            raise ValueError('The onnx backend only runs on the cpu')
+        return createOnnxModel(model, modelPath, sample, variant)
+
+    raise ValueError(f'Unknown inference backend: {backend}')
+
+
+def checkParity(reference: Callable, candidate: Callable, sample: torch.Tensor) -> bool:
+    '''Return whether both models predict the same classes for the sample batch'''
+
+    with torch.no_grad():
+        expected = torch.argmax(reference(sample), 1).cpu()
+        actual = torch.argmax(candidate(sample), 1).cpu()
+
+    return torch.equal(expected, actual)
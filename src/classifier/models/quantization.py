@@ -0,0 +1,141 @@
+import copy
+import glob
+import os
+import random
+from typing import List, Tuple
+
+import cv2
+import torch
+import torch.nn as nn
+
+from ..utils.imageUtils import splitImageToTensors
+
+'''Collection of int8 quantization related utility functions'''
+
+QUANTIZATION_MODES: List[str] = ['none', 'dynamic', 'static']
+
+
+def quantizeDynamic(model: nn.Module) -> nn.Module:
+    '''Return a copy of the model with int8 dynamic quantized linear layers'''
+
+    from torch.ao.quantization import quantize_dynamic
+
+    return quantize_dynamic(copy.deepcopy(model).cpu().eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def quantizeStatic(model: nn.Module, calibrationBatch: torch.Tensor, batchSize: int = 32) -> nn.Module:
+    '''Return a copy of the model with static int8 convolutions and dynamic int8 linear layers'''
+
+    from torch.ao.quantization import default_dynamic_qconfig, get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    model = copy.deepcopy(model).cpu().eval()
+
+    # Everything from the first linear layer on runs dynamic, fused modules need a single qconfig
+    qconfigMapping = get_default_qconfig_mapping(
+        torch.backends.quantized.engine)
+    isDynamic = False
+    for name, module in model.named_modules():
+        if isinstance(module, nn.Linear):
+            isDynamic = True
+        if isDynamic and name:
+            qconfigMapping.set_module_name(name, default_dynamic_qconfig)
+
+    exampleInputs = (calibrationBatch[:1],)
+    prepared = prepare_fx(model, qconfigMapping, exampleInputs)
+
+    # Calibration pass collecting the activation ranges of the convolutions
+    with torch.no_grad():
+        for start in range(0, calibrationBatch.shape[0], batchSize):
+            prepared(calibrationBatch[start:start + batchSize])
+
+    return convert_fx(prepared)
+
+
+def quantizeModel(model: nn.Module, mode: str, calibrationBatch: torch.Tensor = None) -> nn.Module:
+    '''Return the model quantized with the given mode'''
+
+    if mode == 'none':
+        return model
+    elif mode == 'dynamic':
+        return quantizeDynamic(model)
+    elif mode == 'static':
+        if calibrationBatch is None:
+            raise ValueError('Static quantization requires calibration data')
+        return quantizeStatic(model, calibrationBatch)
+
+    raise ValueError(f'Unknown quantization mode: {mode}')
+
+
+def findImages(path: str) -> List[str]:
+    '''Return the sorted list of jpg images under the given path'''
+
+    return sorted(glob.glob(os.path.join(path, '**', '*.jpg'), recursive=True))
+
+
+def loadImageBatch(paths: List[str], imageSize: Tuple[int, int], mean: Tuple[float], std: Tuple[float]) -> torch.Tensor:
+    '''Load the images as a normalized batch the same way classification requests are prepared'''
+
+    tensors = []
+
+    for path in paths:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            print(f'Error reading image: {path}')
+            continue
+
+        tensors.append(splitImageToTensors(image, 1, 1, imageSize, mean, std))
+
+    if not tensors:
+        raise ValueError('No readable images found')
+
+    return torch.cat(tensors)
+
+
+def loadCalibrationBatch(dataPath: str, imageSize: Tuple[int, int], mean: Tuple[float], std: Tuple[float],
+                         sampleSize: int = 64, seed: int = 0) -> torch.Tensor:
+    '''Load a random sample of the images under the data path for calibration'''
+
+    paths = findImages(dataPath)
+    if not paths:
+        raise ValueError(f'No images found for calibration in: {dataPath}')
+
+    random.Random(seed).shuffle(paths)
+
+    return loadImageBatch(paths[:sampleSize], imageSize, mean, std)
+
+
+def loadLabelledSample(dataPath: str, classLabels: List[str], imageSize: Tuple[int, int], mean: Tuple[float],
+                       std: Tuple[float], samplesPerClass: int = 100) -> Tuple[torch.Tensor, torch.Tensor]:
+    '''Load images from the per class subdirectories of the data path with their class indices'''
+
+    batches = []
+    labels = []
+
+    for index, label in enumerate(classLabels):
+        paths = findImages(os.path.join(dataPath, label))[:samplesPerClass]
+        if not paths:
+            continue
+
+        batch = loadImageBatch(paths, imageSize, mean, std)
+        batches.append(batch)
+        labels.append(torch.full((batch.shape[0],), index, dtype=torch.long))
+
+    if not batches:
+        raise ValueError(f'No labelled images found in: {dataPath}')
+
+    return torch.cat(batches), torch.cat(labels)
+
+
+def measureAccuracy(model: nn.Module, batch: torch.Tensor, labels: torch.Tensor, batchSize: int = 64) -> float:
+    '''Return the ratio of correctly predicted images'''
+
+    correct = 0
+
+    with torch.no_grad():
+        for start in range(0, batch.shape[0], batchSize):
+            output = model(batch[start:start + batchSize])
+            predictions = torch.argmax(output, 1)
+            correct += int((predictions == labels[start:start + batchSize]).sum())
+
+    return correct / batch.shape[0]
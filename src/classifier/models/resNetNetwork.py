@@ -1,12 +1,14 @@
 import torch
 import torch.nn as nn
-from torchvision import models
 
 
 class ResNetNetwork:
     '''Wrapper class for resnet to use like custom model'''
 
     def __init__(self, id: str = 'resnet50'):
+        # Torchvision is slow to import, it is only imported when a resnet is served
+        from torchvision import models
+
         self.id = id
         self.model = models.resnet50(weights=None)
 
@@ -1,101 +1,589 @@
-import cv2
-import numpy as np
-from typing import Dict
+import base64
+from timeit import default_timer as timer
+from typing import Any, Dict, Iterator, List, Tuple, Union
 
+import numpy as np
 import torch
-from torchvision.transforms import transforms
 
-from .classificationMap import ClassificationMap, BaseClassification
-from .config.config import Config
 from .config.classifierConfig import ClassifierConfig
-from .models.baseNetwork import BaseNetwork
-from .utils.imageUtils import splitImageToTensors
+from .deadline import Deadline, checkDeadline
+from .metrics import Metrics
+from .modelRegistry import ModelRegistry
+from .modelSnapshot import ModelSnapshot
+from .resultCache import ResultCache
+from .utils.imageUtils import (PngBandReader, canReadPngBands, cropOrPadBand, decodeImageForGrid,
+                               estimateDecodedBytes, readFileHeader, readImageSize, resizeToTiles,
+                               slidingWindowView, splitImageToTensors, tilesToTensors)
+from .utils.windowUtils import aggregateWindowProbabilities, calculateWindowOverlap, countWindows
+
+
+SCORE_MODES: List[str] = ['none', 'probabilities', 'topk']
+
+
+class ImageTooLargeError(ValueError):
+    '''Raised when classifying the image would exceed the memory ceiling or the budgets of the request'''
+
+
+def checkImageBudget(config: ClassifierConfig, header: bytes, rows: int, cols: int) -> None:
+    '''Raise ImageTooLargeError if the grid has too many tiles or the image decodes to too many pixels
+
+    Only the header of the image is read, the pixel count of images other than png and jpeg is not known.
+    '''
+
+    maxTiles = config.getMaxRequestTiles()
+    if maxTiles and rows * cols > maxTiles:
+        raise ImageTooLargeError(
+            f'{rows * cols} tiles requested, at most {maxTiles} are accepted')
+
+    maxPixels = config.getMaxDecodedPixels()
+    if not maxPixels or not header:
+        return
+
+    width, height = config.getImageSize()
+    decodedBytes = estimateDecodedBytes(header, (cols * width, rows * height))
+
+    if decodedBytes is not None and decodedBytes // 3 > maxPixels:
+        raise ImageTooLargeError(
+            f'The image decodes to {decodedBytes // 3} pixels, at most {maxPixels} are accepted')
 
 
 class MultiModelClassifier:
     '''Classify images with multiple models'''
 
-    def __init__(self) -> None:
-        '''Basic initialization'''
+    def __init__(self, snapshot: ModelSnapshot = None, deadline: Deadline = None, profiled: bool = False) -> None:
+        '''Basic initialization, the networks are borrowed from the given or the served snapshot of the model registry
 
-        self.baseConfig = ClassifierConfig(Config.getPath())
+        With a deadline the classification is cancelled between its batches once it passed. A profiled
+        classification skips the result cache and runs its batches on the calling thread, so the profile
+        holds the whole work of the request.
+        '''
 
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        print(f'Using device: {self.device}')
+        if snapshot is None:
+            snapshot = ModelRegistry.getSnapshot()
+
+        self.baseConfig = snapshot.getConfig()
+        self.device = ModelRegistry.getDevice()
 
         self.rows = 1
         self.cols = 1
+        self.bandRows = 1
+        self.maxBandRows = 0
+        self.tileHeight = 0
+        self.stride = 0
         self.originalData = None
-        self.preparedData = None
-        self.classifications = ClassificationMap()
-
-        self.setupClassifiers()
+        self.header = None
+        self.decodedImage = None
+        self.bandReader: PngBandReader = None
+        self.classifications = snapshot.getClassificationMap()
+        self.engine = snapshot.getEngine()
+        self.scheduler = None if profiled else snapshot.getScheduler()
+        self.modelVersions = snapshot.getModelVersions()
+        self.resultCache = None if profiled else ModelRegistry.getResultCache()
+        self.deadline = deadline
 
-    def setupClassifiers(self) -> None:
-        '''Setup each classifier'''
+    def dataSetup(self, source: Union[bytes, str], rows: int, cols: int, stride: int = 0) -> None:
+        '''Prepare data, with a stride the tiles are classified by overlapping sliding windows'''
 
-        classifications: Dict[str,
-                              BaseClassification] = self.classifications.getClassifications()
+        width, height = self.baseConfig.getImageSize()
+        if stride < 0 or stride > min(width, height):
+            raise ValueError(
+                f'stride must be between 1 and the tile size of {min(width, height)} pixels')
 
-        for key, classification in classifications.items():
-            classification.configureAndSetupNetwork(self.baseConfig)
-
-    def dataSetup(self, image, rows: int, cols: int) -> None:
-        '''Prepare data'''
+        header = readFileHeader(source) if isinstance(source, str) else source
+        checkImageBudget(self.baseConfig, header, rows, cols)
 
         self.rows = rows
         self.cols = cols
-        self.originalData = image
+        self.stride = stride
+        self.originalData = source
+        self.header = header
+
+        Metrics.observe(Metrics.REQUEST_TILES, rows * cols)
 
         self.prepareImage()
 
     def prepareImage(self) -> None:
-        '''Prepare the given image to classification'''
+        '''Open png images to be decoded band by band, decode other images whole at the resolution of the tile grid'''
 
-        transformedImage = np.asarray(
-            bytearray(self.originalData.read()), dtype="uint8")
-        transformedImage = cv2.imdecode(transformedImage, cv2.IMREAD_COLOR)
+        self.releaseImage()
+        self.tileHeight = self.getBandTileHeight()
+        self.bandRows = self.planBands()
 
-        mean = tuple(self.baseConfig.getMean())
-        std = tuple(self.baseConfig.getStd())
+        if self.tileHeight:
+            self.bandReader = PngBandReader(self.originalData)
+            return
 
-        transformations = transforms.Compose(
-            [transforms.Resize(self.baseConfig.getImageSize(), antialias=False),
-             transforms.Normalize(mean, std)])
+        with Metrics.timeStage('decode'):
+            self.decodedImage = decodeImageForGrid(
+                self.originalData, self.rows, self.cols, self.baseConfig.getImageSize(),
+                self.baseConfig.getTileRemainder())
 
-        self.preparedData = splitImageToTensors(
-            transformedImage, self.rows, self.cols, transformations)
+        if self.decodedImage is None:
+            raise ValueError('Image could not be decoded')
 
-    def classifyWithMultiModels(self, image, rows: int, cols: int) -> None:
-        '''Classify images with multiple models'''
+        self.tileHeight = self.decodedImage.shape[0] // self.rows
 
-        result = self.createResponseSkeleton(rows, cols)
+    def getBandTileHeight(self) -> int:
+        '''Return the image rows of one tile row if the image is decoded band by band, 0 if it is decoded whole
+
+        The sliding windows need the whole image, as do images too small to give every tile row its own rows.
+        '''
+
+        if self.stride or not canReadPngBands(self.header):
+            return 0
+
+        width, height = readImageSize(self.header)
+
+        if self.baseConfig.getTileRemainder() == 'pad':
+            tileHeight = -(-height // self.rows)
+            return tileHeight if tileHeight * (self.rows - 1) < height else 0
+
+        return height // self.rows if width >= self.cols else 0
+
+    def releaseImage(self) -> None:
+        '''Free the decoded image and close the band reader'''
+
+        self.decodedImage = None
+
+        if self.bandReader is not None:
+            self.bandReader.close()
+            self.bandReader = None
+
+    def getTileRowBytes(self) -> int:
+        '''Return the estimated memory needed to prepare one row of tiles'''
+
+        width, height = self.baseConfig.getImageSize()
+
+        # The resized uint8 band, the float tiles and the copy made while resizing them
+        return self.cols * width * height * 3 * (1 + 2 * 4)
+
+    def planBands(self) -> int:
+        '''Return the number of tile rows prepared at once, checking the memory ceiling of the request
+
+        Images decoded band by band only hold the current band, other images are decoded whole first.
+        '''
+
+        bandRows = min(self.baseConfig.getStreamingBandRows() or self.rows,
+                       self.maxBandRows or self.rows, self.rows)
+
+        ceiling = self.baseConfig.getRequestMemoryBytes()
+        if not ceiling:
+            return bandRows
+
+        uploadBytes = 0 if isinstance(self.originalData, str) else len(self.originalData)
+
+        if self.tileHeight:
+            decodedBytes = 0
+            rowBytes = self.getTileRowBytes() + self.tileHeight * PngBandReader.estimateRowBytes(self.header)
+        else:
+            width, height = self.baseConfig.getImageSize()
+            decodedBytes = estimateDecodedBytes(
+                self.header, (self.cols * width, self.rows * height))
+            rowBytes = self.getTileRowBytes()
+
+        if decodedBytes is None:
+            raise ImageTooLargeError(
+                'Image size is unknown, only png and jpeg images are accepted with a memory ceiling')
+
+        fittingRows = (ceiling - uploadBytes - decodedBytes) // rowBytes
+        if fittingRows < 1:
+            raise ImageTooLargeError(
+                f'Classifying the image needs more memory than the ceiling of {ceiling} bytes')
+
+        return min(bandRows, fittingRows)
+
+    def getNormalization(self) -> Tuple[Tuple[float], Tuple[float]]:
+        '''Return the mean and std to normalize the tiles with, None if the networks have it folded in'''
+
+        if self.engine.isInputFolded():
+            return None, None
+
+        return tuple(self.baseConfig.getMean()), tuple(self.baseConfig.getStd())
+
+    def iterateBands(self) -> Iterator[Tuple[int, torch.Tensor]]:
+        '''Yield the first tile row and the normalized tiles of each band of tile rows'''
+
+        imageSize = self.baseConfig.getImageSize()
+        mean, std = self.getNormalization()
+
+        for startRow in range(0, self.rows, self.bandRows):
+            endRow = min(startRow + self.bandRows, self.rows)
+            band = self.readBand(startRow, endRow)
+
+            # Band edges fall on tile edges, so resizing band by band equals resizing the whole image
+            with Metrics.timeStage('split'):
+                band = resizeToTiles(band, endRow - startRow, self.cols, imageSize)
+                tiles = splitImageToTensors(band, endRow - startRow, self.cols, imageSize, mean, std)
+
+            yield startRow, tiles
+
+    def readBand(self, startRow: int, endRow: int):
+        '''Return the grid aligned image rows of the given tile rows, the bands are read in order'''
+
+        firstRow = startRow * self.tileHeight
+        lastRow = endRow * self.tileHeight
+
+        if self.bandReader is None:
+            return self.decodedImage[firstRow:lastRow]
+
+        with Metrics.timeStage('decode'):
+            band = self.bandReader.readRows(min(lastRow, self.bandReader.height) - firstRow)
+
+        return cropOrPadBand(band, lastRow - firstRow, self.cols, self.baseConfig.getTileRemainder())
+
+    def iterateBandLogits(self) -> Iterator[Tuple[int, Dict[str, torch.Tensor]]]:
+        '''Yield the first tile row and the (tiles, classes) logits of each classification for each band'''
+
+        if self.stride:
+            yield 0, self.predictWindowLogits()
+            return
+
+        for startRow, batch in self.iterateBands():
+            logits = self.predictLogits(batch)
+            del batch
+
+            yield startRow, logits
+
+    def predictWindowLogits(self) -> Dict[str, torch.Tensor]:
+        '''Classify the sliding windows of the whole image and aggregate them per tile
+
+        The log of the aggregated probabilities is returned, its argmax is the predicted class
+        and its softmax gives the aggregated probabilities back.
+        '''
+
+        imageSize = self.baseConfig.getImageSize()
+        width, height = imageSize
+
+        image = resizeToTiles(self.decodedImage, self.rows,
+                              self.cols, imageSize, enlarge=True)
+        windowRows = countWindows(image.shape[0], height, self.stride)
+        windowCols = countWindows(image.shape[1], width, self.stride)
+
+        denseStride = self.engine.getDenseStride()
+        if denseStride and self.stride % denseStride == 0:
+            probabilities = self.predictDenseProbabilities(
+                image, windowRows, windowCols)
+        else:
+            probabilities = self.predictWindowProbabilities(image)
+
+        rowOverlap = calculateWindowOverlap(
+            self.rows, height, windowRows, height, self.stride)
+        colOverlap = calculateWindowOverlap(
+            self.cols, width, windowCols, width, self.stride)
+
+        logits = {}
+        with Metrics.timeStage('aggregate'):
+            for key, value in probabilities.items():
+                tileProbabilities = aggregateWindowProbabilities(
+                    value, rowOverlap, colOverlap)
+                logits[key] = tileProbabilities.clamp_min(
+                    1e-12).log().reshape(self.rows * self.cols, -1)
+
+        return logits
+
+    def predictWindowProbabilities(self, image) -> Dict[str, torch.Tensor]:
+        '''Run every window through the networks in batches, return the (windowRows, windowCols, classes) probabilities'''
+
+        imageSize = self.baseConfig.getImageSize()
+        mean, std = self.getNormalization()
+
+        windows = slidingWindowView(image, imageSize, self.stride)
+        windowRows, windowCols = windows.shape[:2]
+
+        # Only the windows of the current batch are copied out of the image
+        rowsPerBatch = max(1, self.engine.getBatchSize() // windowCols)
+        outputs: Dict[str, List[torch.Tensor]] = {}
+
+        for start in range(0, windowRows, rowsPerBatch):
+            with Metrics.timeStage('split'):
+                batch = tilesToTensors(
+                    windows[start:start + rowsPerBatch], imageSize, mean, std)
+
+            for key, value in self.predictLogits(batch).items():
+                outputs.setdefault(key, []).append(
+                    torch.softmax(value.float(), 1))
+            del batch
+
+        return {key: torch.cat(value).view(windowRows, windowCols, -1) for key, value in outputs.items()}
+
+    def predictDenseProbabilities(self, image, windowRows: int, windowCols: int) -> Dict[str, torch.Tensor]:
+        '''Run the fully convolutional networks once on the whole image, return the probabilities of the windows'''
+
+        mean, std = self.getNormalization()
+        checkDeadline(self.deadline)
+
+        batch = tilesToTensors(
+            image[None], (image.shape[1], image.shape[0]), mean, std)
+        step = self.stride // self.engine.getDenseStride()
 
-        self.dataSetup(image, rows, cols)
+        result = {}
+        for key, value in self.engine.predictDense(batch).items():
+            value = value[:, ::step, ::step][:, :windowRows, :windowCols]
+            result[key] = torch.softmax(value.float(), 0).permute(1, 2, 0)
 
-        classifications: Dict[str,
-                              BaseClassification] = self.classifications.getClassifications()
+        return result
+
+    def readUpload(self, image) -> Union[bytes, str]:
+        '''Return the path of an upload spooled to disk, otherwise its bytes'''
+
+        if hasattr(image, 'temporary_file_path'):
+            return image.temporary_file_path()
+
+        with Metrics.timeStage('read'):
+            return image.read()
+
+    def getCacheKey(self, source: Union[bytes, str], rows: int, cols: int, options: Dict[str, Any] = None) -> str:
+        '''Return the result cache key of the image, the grid and the result options, None if caching is disabled'''
+
+        if not self.resultCache:
+            return None
+
+        with Metrics.timeStage('hash'):
+            if isinstance(source, str):
+                contentHash = ResultCache.hashFile(source)
+            else:
+                contentHash = ResultCache.hashContent(source)
+
+        params = {'rows': rows, 'cols': cols,
+                  'config': self.baseConfig.getOutputHash()}
+        params.update(options or {})
+
+        return ResultCache.createKey(contentHash, params, self.modelVersions)
+
+    def classifyWithMultiModels(self, image, rows: int, cols: int, stride: int = 0) -> None:
+        '''Classify images with multiple models, repeated requests are served from the result cache'''
+
+        source = self.readUpload(image)
+
+        cacheKey = self.getCacheKey(
+            source, rows, cols, {'stride': stride} if stride else None)
+        if cacheKey:
+            cachedResult = self.resultCache.get(cacheKey)
+            if cachedResult is not None:
+                return cachedResult
+
+        result = self.classifyData(source, rows, cols, stride)
+
+        if cacheKey:
+            self.resultCache.put(cacheKey, result, self.modelVersions)
+
+        return result
+
+    def classifyData(self, source: Union[bytes, str], rows: int, cols: int, stride: int = 0) -> None:
+        '''Decode and classify the encoded image bytes or image file'''
+
+        result = self.createResponseSkeleton(rows, cols)
 
-        for key, classification in classifications.items():
-            network: BaseNetwork = classification.getNetwork()
-            network.eval()
+        self.dataSetup(source, rows, cols, stride)
 
-            for row in range(0, self.rows):
-                for col in range(0, self.cols):
-                    res = None
+        # Each band goes through every network in a single batch and is freed before the next one
+        for startRow, logits in self.iterateBandLogits():
+            predictions = {key: torch.argmax(value, 1)
+                           for key, value in logits.items()}
 
-                    with torch.no_grad():
-                        imageTensor = self.preparedData[row][col]
-                        output = network(imageTensor)
-                        _, predictions = torch.max(output, 1)
-                        res = predictions[0]
+            self.fillResult(result, startRow, predictions)
 
-                        result[row][col][key] = int(res)
+        self.releaseImage()
 
         return result
 
+    def classifyToGrids(self, image, rows: int, cols: int, scoreMode: str = 'none', topk: int = 2,
+                        stride: int = 0) -> Tuple[Dict[str, np.ndarray], Dict[str, Dict[str, np.ndarray]]]:
+        '''Classify the image into one (rows, cols) uint8 class index grid per classification
+
+        With scores the (rows, cols, depth) uint8 arrays of each classification are returned too,
+        'probabilities' holds every class, 'classes' and 'scores' the top k ones, scaled to 0-255.
+        '''
+
+        if scoreMode not in SCORE_MODES:
+            raise ValueError(f'Unknown score mode: {scoreMode}')
+
+        topk = max(1, int(topk))
+        source = self.readUpload(image)
+
+        options = {'layout': 'arrays', 'scores': scoreMode, 'topk': topk}
+        if stride:
+            options['stride'] = stride
+
+        cacheKey = self.getCacheKey(source, rows, cols, options)
+        if cacheKey:
+            cachedResult = self.resultCache.get(cacheKey)
+            if cachedResult is not None:
+                return self.unpackArrays(cachedResult, rows, cols)
+
+        self.dataSetup(source, rows, cols, stride)
+
+        grids: Dict[str, np.ndarray] = {}
+        scores: Dict[str, Dict[str, np.ndarray]] = {}
+
+        for startRow, logits in self.iterateBandLogits():
+            for key, value in logits.items():
+                bandArrays = {'grid': torch.argmax(value, 1)}
+                if scoreMode != 'none':
+                    bandArrays.update(
+                        self.calculateScores(value, scoreMode, topk))
+
+                for name, array in bandArrays.items():
+                    if name == 'grid':
+                        target = grids.setdefault(
+                            key, np.empty((rows, cols), dtype=np.uint8))
+                    else:
+                        target = scores.setdefault(key, {}).setdefault(
+                            name, np.empty((rows, cols, array.shape[1]), dtype=np.uint8))
+
+                    bandArray = array.view(-1, cols, *array.shape[1:]).numpy()
+                    target[startRow:startRow + bandArray.shape[0]] = bandArray
+
+        self.releaseImage()
+
+        if cacheKey:
+            self.resultCache.put(cacheKey, self.packArrays(
+                grids, scores), self.modelVersions)
+
+        return grids, scores
+
+    def calculateScores(self, logits: torch.Tensor, scoreMode: str, topk: int) -> Dict[str, torch.Tensor]:
+        '''Return the uint8 quantized probabilities or top k classes of a batch of logits in one vectorized pass'''
+
+        probabilities = torch.softmax(logits.float(), 1)
+
+        if scoreMode == 'probabilities':
+            return {'probabilities': self.quantizeProbabilities(probabilities)}
+
+        values, indices = probabilities.topk(
+            min(topk, probabilities.shape[1]), 1)
+
+        return {
+            'classes': indices.to(torch.uint8),
+            'scores': self.quantizeProbabilities(values)
+        }
+
+    def quantizeProbabilities(self, probabilities: torch.Tensor) -> torch.Tensor:
+        '''Scale the probabilities to 0-255 and round them to uint8'''
+
+        return probabilities.mul(255).round_().to(torch.uint8)
+
+    def packArrays(self, grids: Dict[str, np.ndarray], scores: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Any]:
+        '''Pack the uint8 arrays into a json serializable cache entry'''
+
+        return {
+            'grids': {key: base64.b64encode(grid.tobytes()).decode('ascii') for key, grid in grids.items()},
+            'scores': {key: {name: base64.b64encode(array.tobytes()).decode('ascii') for name, array in arrays.items()}
+                       for key, arrays in scores.items()}
+        }
+
+    def unpackArrays(self, packed: Dict[str, Any], rows: int,
+                     cols: int) -> Tuple[Dict[str, np.ndarray], Dict[str, Dict[str, np.ndarray]]]:
+        '''Unpack the uint8 arrays of a cache entry'''
+
+        grids = {key: np.frombuffer(base64.b64decode(data), dtype=np.uint8).reshape(rows, cols)
+                 for key, data in packed['grids'].items()}
+        scores = {key: {name: np.frombuffer(base64.b64decode(data), dtype=np.uint8).reshape(rows, cols, -1)
+                        for name, data in arrays.items()}
+                  for key, arrays in packed['scores'].items()}
+
+        return grids, scores
+
+    def getModelVersions(self) -> Dict[str, str]:
+        '''Get the version of each model classifying the image'''
+
+        return self.modelVersions
+
+    def getLabels(self) -> Dict[str, List[Dict[str, Any]]]:
+        '''Return the label descriptions of each classification'''
+
+        return {key: classification.getLabelDescriptions()
+                for key, classification in self.classifications.getClassifications().items()}
+
+    def streamWithMultiModels(self, image, rows: int, cols: int, stride: int = 0) -> Iterator[Dict[str, Any]]:
+        '''Decode the image and return an iterator of per row result records followed by a summary record'''
+
+        startTime = timer()
+        source = self.readUpload(image)
+
+        cacheKey = self.getCacheKey(
+            source, rows, cols, {'stride': stride} if stride else None)
+        cachedResult = self.resultCache.get(cacheKey) if cacheKey else None
+
+        # Decoding errors are raised here, before the response starts
+        if cachedResult is None:
+            self.maxBandRows = max(1, self.engine.getBatchSize() // cols)
+            self.dataSetup(source, rows, cols, stride)
+
+        return self.generateRecords(rows, cols, cacheKey, cachedResult, startTime)
+
+    def generateRecords(self, rows: int, cols: int, cacheKey: str, cachedResult: List[List[Dict[str, int]]],
+                        startTime: float) -> Iterator[Dict[str, Any]]:
+        '''Yield the rows of the cached result or of each band as soon as it is classified, then the summary'''
+
+        if cachedResult is not None:
+            for row in range(0, rows):
+                yield {'row': row, 'result': cachedResult[row]}
+        else:
+            result = [] if cacheKey else None
+
+            for startRow, logits in self.iterateBandLogits():
+                predictions = {key: torch.argmax(value, 1)
+                               for key, value in logits.items()}
+                bandRows = next(iter(predictions.values())).shape[0] // cols
+
+                bandResult = [[dict() for col in range(cols)]
+                              for row in range(bandRows)]
+                self.fillResult(bandResult, 0, predictions)
+
+                for offset, rowResult in enumerate(bandResult):
+                    yield {'row': startRow + offset, 'result': rowResult}
+
+                if result is not None:
+                    result.extend(bandResult)
+
+            self.releaseImage()
+
+            if cacheKey:
+                self.resultCache.put(cacheKey, result, self.modelVersions)
+
+        yield {
+            'summary': {
+                'message': 'Classification succesful',
+                'rows': rows,
+                'cols': cols,
+                'modelVersions': self.modelVersions,
+                'cached': cachedResult is not None,
+                'elapsedMs': (timer() - startTime) * 1000
+            }
+        }
+
+    def fillResult(self, result, startRow: int, predictions: Dict[str, torch.Tensor]) -> None:
+        '''Write the predicted classes of the tile rows from startRow on into the response grid'''
+
+        with Metrics.timeStage('fill'):
+            for key, prediction in predictions.items():
+                grid = prediction.view(-1, self.cols).tolist()
+
+                for offset, gridRow in enumerate(grid):
+                    for col in range(0, self.cols):
+                        result[startRow + offset][col][key] = gridRow[col]
+
+    def predictLogits(self, batch: torch.Tensor) -> Dict[str, torch.Tensor]:
+        '''Return the logits of each classification for every tile of the batch'''
+
+        checkDeadline(self.deadline)
+
+        # Large requests fill a batch on their own, small ones share one
+        if self.scheduler and batch.shape[0] < self.scheduler.getMaxBatchSize():
+            return self.scheduler.submit(batch, self.deadline)
+
+        return self.engine.predictLogits(batch, self.deadline)
+
+    def predict(self, batch: torch.Tensor) -> Dict[str, torch.Tensor]:
+        '''Return the predicted class index of each classification for every tile of the batch'''
+
+        logits = self.predictLogits(batch)
+
+        return {key: torch.argmax(value, 1) for key, value in logits.items()}
+
     def createResponseSkeleton(self, rows: int, cols: int) -> None:
         '''Create response dictionary with the given rows and columns'''
 
-        result = [[dict() for row in range(rows)] for col in range(cols)]
+        result = [[dict() for col in range(cols)] for row in range(rows)]
         return result
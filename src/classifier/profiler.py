@@ -0,0 +1,184 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import threading
+import uuid
+from datetime import datetime
+from typing import List
+
+'''Opt-in profiling of single requests and training epochs with torch.profiler and cProfile'''
+
+PROFILE_MODES: List[str] = ['torch', 'cprofile']
+
+
+class ProfilingForbiddenError(Exception):
+    '''Raised when profiling is requested while it is disabled or with a wrong token'''
+
+
+class ProfilerBusyError(Exception):
+    '''Raised when a request asks to be profiled while another profile is being recorded'''
+
+
+def parseProfileModes(value: str) -> List[str]:
+    '''Parse comma separated profiler names, all selects every profiler, raise ValueError on unknown names'''
+
+    if not value:
+        return []
+
+    names = [name.strip().lower() for name in str(value).split(',') if name.strip()]
+    if 'all' in names:
+        return list(PROFILE_MODES)
+
+    for name in names:
+        if name not in PROFILE_MODES:
+            raise ValueError(f'Unknown profiler: {name}, expected one of {PROFILE_MODES + ["all"]}')
+
+    return [mode for mode in PROFILE_MODES if mode in names]
+
+
+def authorizeProfiling(configuredToken: str, token: str) -> None:
+    '''Raise ProfilingForbiddenError unless profiling is enabled and the token matches the configured one'''
+
+    if not configuredToken:
+        raise ProfilingForbiddenError('Profiling is disabled')
+
+    if not token or not hmac.compare_digest(str(token).encode('utf-8'), configuredToken.encode('utf-8')):
+        raise ProfilingForbiddenError('Invalid profiling token')
+
+
+def createProfileName() -> str:
+    '''Create a unique name of a request profile, starting with its time so the profiles sort by time'''
+
+    return f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+
+
+class Profiler:
+    '''Context manager recording the work inside it and writing the reports into the save path
+
+    The torch profiler writes <name>.trace.json, a Chrome trace to open in chrome://tracing or
+    Perfetto, and <name>.torch.txt with the operators taking the most CPU time and memory. cProfile
+    writes <name>.prof for pstats or snakeviz and <name>.cprofile.txt with the slowest functions.
+    Without modes nothing is recorded. One profile is recorded at a time in the process, because the
+    torch profiler is process wide.
+    '''
+
+    _lock = threading.Lock()
+
+    def __init__(self, modes: List[str], savePath: str, name: str, topCount: int = 30, wait: bool = False) -> None:
+        '''Init profiler, wait whether to wait for a running profile instead of raising ProfilerBusyError'''
+
+        self.modes = modes or []
+        self.savePath = savePath
+        self.name = name
+        self.topCount = topCount
+        self.wait = wait
+        self.files: List[str] = []
+
+        self._torchProfile = None
+        self._cProfile: cProfile.Profile = None
+        self._locked = False
+
+    def isActive(self) -> bool:
+        '''Return whether any profiler is selected'''
+
+        return bool(self.modes)
+
+    def __enter__(self) -> 'Profiler':
+        '''Start the selected profilers'''
+
+        if not self.isActive():
+            return self
+
+        if not Profiler._lock.acquire(blocking=self.wait):
+            raise ProfilerBusyError('Another profile is being recorded, retry later')
+        self._locked = True
+
+        try:
+            if 'torch' in self.modes:
+                import torch
+                from torch.profiler import ProfilerActivity, profile
+
+                activities = [ProfilerActivity.CPU]
+                if torch.cuda.is_available():
+                    activities.append(ProfilerActivity.CUDA)
+
+                self._torchProfile = profile(activities=activities, record_shapes=True, profile_memory=True)
+                self._torchProfile.__enter__()
+
+            if 'cprofile' in self.modes:
+                self._cProfile = cProfile.Profile()
+                self._cProfile.enable()
+        except Exception:
+            self._stop()
+            raise
+
+        return self
+
+    def __exit__(self, excType, excValue, traceback) -> None:
+        '''Stop the profilers and write their reports, also when the work failed'''
+
+        if not self.isActive():
+            return
+
+        try:
+            self._stop()
+            self.save()
+        finally:
+            self._torchProfile = None
+            self._cProfile = None
+
+    def _stop(self) -> None:
+        '''Stop the running profilers and free the profiling slot'''
+
+        try:
+            if self._cProfile:
+                self._cProfile.disable()
+            if self._torchProfile:
+                self._torchProfile.__exit__(None, None, None)
+        finally:
+            if self._locked:
+                self._locked = False
+                Profiler._lock.release()
+
+    def save(self) -> None:
+        '''Write the reports of the recorded profiles'''
+
+        os.makedirs(self.savePath, exist_ok=True)
+        basePath = os.path.join(self.savePath, self.name)
+
+        if self._torchProfile:
+            tracePath = f'{basePath}.trace.json'
+            self._torchProfile.export_chrome_trace(tracePath)
+
+            averages = self._torchProfile.key_averages()
+            summary = [
+                'Operators by self CPU time\n',
+                averages.table(sort_by='self_cpu_time_total', row_limit=self.topCount),
+                '\nOperators by self CPU memory\n',
+                averages.table(sort_by='self_cpu_memory_usage', row_limit=self.topCount)
+            ]
+
+            summaryPath = f'{basePath}.torch.txt'
+            with open(summaryPath, 'w') as summaryFile:
+                summaryFile.write('\n'.join(summary))
+
+            self.files += [tracePath, summaryPath]
+
+        if self._cProfile:
+            statsPath = f'{basePath}.prof'
+            self._cProfile.dump_stats(statsPath)
+
+            stream = io.StringIO()
+            stats = pstats.Stats(self._cProfile, stream=stream)
+            stats.sort_stats('cumulative').print_stats(self.topCount)
+            stats.sort_stats('tottime').print_stats(self.topCount)
+
+            summaryPath = f'{basePath}.cprofile.txt'
+            with open(summaryPath, 'w') as summaryFile:
+                summaryFile.write(stream.getvalue())
+
+            self.files += [statsPath, summaryPath]
+
+        print(f'Profile saved: {", ".join(self.files)}')
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+
+class ResultCache:
+    '''In-memory LRU cache of classification results with a byte budget and an optional disk tier'''
+
+    def __init__(self, maxBytes: int, diskPath: str = None, maxDiskBytes: int = 0) -> None:
+        '''Init cache with the memory budget in bytes, the directory of the disk tier and its budget, 0 means no limit'''
+
+        self.maxBytes = maxBytes
+        self.diskPath = diskPath
+        self.maxDiskBytes = maxDiskBytes
+
+        self._lock = threading.Lock()
+        # key -> (result, model versions, size in bytes)
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        # key -> size in bytes of the disk entry, least recently used first
+        self._diskEntries: OrderedDict = OrderedDict()
+        self._diskBytes = 0
+
+        self._hits = 0
+        self._diskHits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._diskEvictions = 0
+        self._invalidations = 0
+
+        if self.diskPath:
+            os.makedirs(self.diskPath, exist_ok=True)
+            self._scanDisk()
+
+    @staticmethod
+    def hashContent(data: bytes) -> str:
+        '''Return the content hash of the uploaded bytes'''
+
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def hashFile(path: str, chunkSize: int = 1024 * 1024) -> str:
+        '''Return the content hash of the uploaded file, read in chunks'''
+
+        contentHash = hashlib.sha256()
+        with open(path, 'rb') as inFile:
+            for chunk in iter(lambda: inFile.read(chunkSize), b''):
+                contentHash.update(chunk)
+
+        return contentHash.hexdigest()
+
+    @staticmethod
+    def createKey(contentHash: str, params: Dict[str, Any], versions: Dict[str, str]) -> str:
+        '''Create the cache key of the content, the request parameters and the model versions'''
+
+        keyData = json.dumps({'content': contentHash, 'params': params, 'versions': versions},
+                             sort_keys=True)
+
+        return hashlib.sha256(keyData.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Any:
+        '''Return the cached result of the key, None if not cached'''
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key][0]
+
+        if self.diskPath:
+            entry = self._readFromDisk(key)
+            if entry:
+                result, versions = entry
+                self._store(key, result, versions, writeToDisk=False)
+
+                with self._lock:
+                    self._diskHits += 1
+                    if key in self._diskEntries:
+                        self._diskEntries.move_to_end(key)
+
+                return result
+
+        with self._lock:
+            self._misses += 1
+
+        return None
+
+    def put(self, key: str, result: Any, versions: Dict[str, str]) -> None:
+        '''Cache the result of the key, computed with the given model versions'''
+
+        self._store(key, result, versions, writeToDisk=True)
+
+    def _store(self, key: str, result: Any, versions: Dict[str, str], writeToDisk: bool) -> None:
+        '''Store the entry in memory, evicting the least recently used ones over the budget'''
+
+        serialized = json.dumps({'versions': versions, 'result': result})
+        size = len(serialized)
+
+        if writeToDisk and self.diskPath:
+            self._writeToDisk(key, serialized)
+
+        if size > self.maxBytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[2]
+
+            self._entries[key] = (result, versions, size)
+            self._bytes += size
+
+            while self._bytes > self.maxBytes:
+                _, (_, _, evictedSize) = self._entries.popitem(last=False)
+                self._bytes -= evictedSize
+                self._evictions += 1
+
+    def getDiskEntryPath(self, key: str) -> str:
+        '''Return the path of the key on the disk tier'''
+
+        return os.path.join(self.diskPath, key[:2], f'{key}.json')
+
+    def _scanDisk(self) -> None:
+        '''Index the entries already on the disk tier, oldest first, and evict the ones over the budget'''
+
+        entries = []
+
+        for root, _, files in os.walk(self.diskPath):
+            for fileName in files:
+                if not fileName.endswith('.json'):
+                    continue
+
+                try:
+                    stat = os.stat(os.path.join(root, fileName))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, fileName[:-len('.json')], stat.st_size))
+
+        with self._lock:
+            for _, key, size in sorted(entries):
+                self._diskEntries[key] = size
+                self._diskBytes += size
+
+            evicted = self._popDiskOverBudget()
+
+        self._removeFromDisk(evicted)
+
+    def _popDiskOverBudget(self) -> List[str]:
+        '''Pop the least recently used disk entries over the budget from the index, return their keys
+
+        Called with the lock held, the files are removed by the caller after the lock is released.
+        '''
+
+        evicted = []
+
+        while self.maxDiskBytes and self._diskBytes > self.maxDiskBytes and self._diskEntries:
+            key, size = self._diskEntries.popitem(last=False)
+            self._diskBytes -= size
+            self._diskEvictions += 1
+            evicted.append(key)
+
+        return evicted
+
+    def _removeFromDisk(self, keys: List[str]) -> None:
+        '''Remove the disk entries of the keys, entries already removed by another process are skipped'''
+
+        for key in keys:
+            try:
+                os.remove(self.getDiskEntryPath(key))
+            except OSError:
+                continue
+
+    def _readFromDisk(self, key: str) -> Tuple[Any, Dict[str, str]]:
+        '''Read the entry of the key from the disk tier'''
+
+        path = self.getDiskEntryPath(key)
+
+        try:
+            with open(path, 'r') as inFile:
+                data = json.load(inFile)
+            return data['result'], data['versions']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _writeToDisk(self, key: str, serialized: str) -> None:
+        '''Write the serialized entry to the disk tier, atomically replacing an older one'''
+
+        path = self.getDiskEntryPath(key)
+        tempPath = f'{path}.{threading.get_ident()}.tmp'
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tempPath, 'w') as outFile:
+                outFile.write(serialized)
+            os.replace(tempPath, path)
+        except OSError as error:
+            print(f'Error writing result cache entry: {error}')
+            return
+
+        with self._lock:
+            if key in self._diskEntries:
+                self._diskBytes -= self._diskEntries.pop(key)
+
+            self._diskEntries[key] = len(serialized)
+            self._diskBytes += len(serialized)
+
+            evicted = self._popDiskOverBudget()
+
+        self._removeFromDisk(evicted)
+
+    def invalidateModel(self, name: str, version: str) -> int:
+        '''Drop every entry computed with the given version of the named model, return the number dropped'''
+
+        dropped = 0
+
+        with self._lock:
+            for key in list(self._entries.keys()):
+                versions = self._entries[key][1]
+                if versions.get(name) == version:
+                    self._bytes -= self._entries.pop(key)[2]
+                    dropped += 1
+
+        if self.diskPath:
+            dropped += self._invalidateDisk(name, version)
+
+        with self._lock:
+            self._invalidations += dropped
+
+        return dropped
+
+    def _invalidateDisk(self, name: str, version: str) -> int:
+        '''Remove the disk entries computed with the given version of the named model'''
+
+        dropped = 0
+
+        for root, _, files in os.walk(self.diskPath):
+            for fileName in files:
+                if not fileName.endswith('.json'):
+                    continue
+
+                path = os.path.join(root, fileName)
+                try:
+                    with open(path, 'r') as inFile:
+                        versions = json.load(inFile).get('versions', {})
+                    if versions.get(name) == version:
+                        os.remove(path)
+                        dropped += 1
+                        self._forgetDiskEntry(fileName[:-len('.json')])
+                except (OSError, ValueError):
+                    continue
+
+        return dropped
+
+    def _forgetDiskEntry(self, key: str) -> None:
+        '''Drop the key from the index of the disk tier'''
+
+        with self._lock:
+            if key in self._diskEntries:
+                self._diskBytes -= self._diskEntries.pop(key)
+
+    def clear(self) -> None:
+        '''Drop every in-memory entry'''
+
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def getStats(self) -> Dict[str, Any]:
+        '''Return cache statistics as a json dictionary'''
+
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.maxBytes,
+                'diskEnabled': self.diskPath is not None,
+                'diskEntries': len(self._diskEntries),
+                'diskBytes': self._diskBytes,
+                'maxDiskBytes': self.maxDiskBytes,
+                'hits': self._hits,
+                'diskHits': self._diskHits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'diskEvictions': self._diskEvictions,
+                'invalidations': self._invalidations
+            }
@@ -13,6 +13,7 @@ from .classificationMap import (
     BaseClassification)
 from .datasets.customDataset import CustomDataset
 from .models.baseNetwork import BaseNetwork
+from .profiler import Profiler
 from .transformations import Transformations
 from .utils.datasetUtils import splitDataSet
 from .utils.timeUtils import TimeUtils
@@ -21,10 +22,13 @@ from .utils.timeUtils import TimeUtils
 class Teacher:
     '''Classification teacher class'''
 
-    def __init__(self, classification: BaseClassification, config: ClassifierConfig = None) -> None:
-        '''Basic initialization'''
+    def __init__(self, classification: BaseClassification, config: ClassifierConfig = None,
+                 profileModes: List[str] = None, profileEpochs: List[int] = None) -> None:
+        '''Basic initialization, the given epochs, counted from 1, are profiled with the given profilers'''
 
         self.classification = classification
+        self.profileModes: List[str] = profileModes or []
+        self.profileEpochs: List[int] = profileEpochs or [1]
 
         if config:
             self.classification.configure(config)
@@ -161,8 +165,9 @@ class Teacher:
 
                 print(f'Epoch [ {epoch + 1} / {epochs} ]')
                 ActiveTrainingInfo.stepCurrentEpochs(1)
-                self.trainStep(self.dataLoaders['train'])
-                self.validationStep(self.dataLoaders['val'])
+                with self.createEpochProfiler(epoch + 1):
+                    self.trainStep(self.dataLoaders['train'])
+                    self.validationStep(self.dataLoaders['val'])
 
                 epochEndTime = timer()
                 epochTime = TimeUtils.getTimeDiffStr(
@@ -190,6 +195,14 @@ class Teacher:
             ActiveTrainingInfo.saveResultData()
             raise exception
 
+    def createEpochProfiler(self, epoch: int) -> Profiler:
+        '''Create the profiler of the epoch writing into the learning info of the run, inactive if not profiled'''
+
+        modes = self.profileModes if epoch in self.profileEpochs else []
+
+        return Profiler(modes, ActiveTrainingInfo.getSavePath(), f'profileEpoch{epoch}',
+                        self.config.getProfileTopCount(), wait=True)
+
     def trainStep(self, dataLoader: DataLoader) -> None:
         '''Single training step'''
 
@@ -0,0 +1,151 @@
+import unittest
+
+import torch
+import torch.nn as nn
+
+from classifier.models.baseNetwork import BaseNetwork
+from classifier.models.FirstNetwork import FirstNetwork
+from classifier.models.foldedNetwork import INPUT_SCALE, FoldedNetwork
+
+'''Parity tests of the folded networks against the networks they are folded from'''
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+# The (width, height) of the tiles FirstNetwork is built for
+IMAGE_SIZE = (60, 60)
+
+
+class SmallNetwork(BaseNetwork):
+    '''Convolution, batch norm and linear head with the padding of the first convolution given'''
+
+    def __init__(self, padding: int, paddingMode: str = 'zeros') -> None:
+        '''Init network whose first convolution pads with the given size and mode'''
+
+        super().__init__('small_network')
+
+        self.layers = nn.ModuleList([
+            nn.Conv2d(3, 4, kernel_size=3, padding=padding, padding_mode=paddingMode),
+            nn.BatchNorm2d(4),
+            nn.ReLU(),
+            nn.AvgPool2d(2),
+            nn.Flatten(1),
+            nn.LazyLinear(5),
+            nn.BatchNorm1d(5),
+            nn.ReLU(),
+            nn.Linear(5, 3)
+        ])
+
+
+def randomizeBatchNorms(network: nn.Module) -> None:
+    '''Give every batch norm non trivial statistics and affine parameters, so folding them changes the weights'''
+
+    generator = torch.Generator().manual_seed(1)
+
+    for module in network.modules():
+        if isinstance(module, (nn.BatchNorm1d, nn.BatchNorm2d)):
+            size = module.num_features
+            module.running_mean.copy_(torch.randn(size, generator=generator))
+            module.running_var.copy_(torch.rand(size, generator=generator) + 0.5)
+            module.weight.data.copy_(torch.rand(size, generator=generator) + 0.5)
+            module.bias.data.copy_(torch.randn(size, generator=generator))
+
+
+def createPixels(imageSize, count: int = 4) -> torch.Tensor:
+    '''Create a reproducible batch of 0-255 pixel values'''
+
+    width, height = imageSize
+    generator = torch.Generator().manual_seed(0)
+
+    return torch.randint(0, 256, (count, 3, height, width), generator=generator).float()
+
+
+def normalize(pixels: torch.Tensor) -> torch.Tensor:
+    '''Normalize the 0-255 pixels the way the tiles of the unfolded networks are'''
+
+    mean = torch.tensor(MEAN).view(1, -1, 1, 1)
+    std = torch.tensor(STD).view(1, -1, 1, 1)
+
+    return (pixels / INPUT_SCALE - mean) / std
+
+
+class FoldedNetworkTest(unittest.TestCase):
+    '''Compare the folded networks with the unfolded ones'''
+
+    def setUp(self) -> None:
+        '''Fix the seed of the network initialization'''
+
+        torch.manual_seed(0)
+
+    def assertFoldedMatches(self, network: BaseNetwork, imageSize) -> None:
+        '''Assert that the folded network gives the logits of the network'''
+
+        network.eval()
+        pixels = createPixels(imageSize)
+
+        with torch.no_grad():
+            network(normalize(pixels))
+            randomizeBatchNorms(network)
+
+            folded = FoldedNetwork(network, MEAN, STD)
+            expected = network(normalize(pixels))
+            actual = folded(pixels)
+
+        self.assertTrue(torch.allclose(actual, expected, rtol=1e-4, atol=1e-4),
+                        f'max difference {(actual - expected).abs().max().item()}')
+        self.assertTrue(FoldedNetwork.checkParity(network, folded, MEAN, STD, imageSize, 'cpu'))
+
+    def testFirstNetworkParity(self) -> None:
+        '''The reflect padded FirstNetwork with its batch norms folded gives the same logits'''
+
+        network = FirstNetwork(3)
+
+        self.assertTrue(FoldedNetwork.canFold(network))
+        self.assertFoldedMatches(network, IMAGE_SIZE)
+
+    def testFoldedHasNoBatchNorms(self) -> None:
+        '''Every batch norm is folded into the layer before it'''
+
+        folded = FoldedNetwork(FirstNetwork(3).eval(), MEAN, STD)
+
+        batchNorms = [module for module in folded.modules()
+                      if isinstance(module, (nn.BatchNorm1d, nn.BatchNorm2d))]
+        self.assertEqual(batchNorms, [])
+
+    def testUnpaddedNetworkParity(self) -> None:
+        '''A first convolution without padding is folded exactly'''
+
+        network = SmallNetwork(0)
+
+        self.assertTrue(FoldedNetwork.canFold(network))
+        self.assertFoldedMatches(network, (16, 16))
+
+    def testZeroPaddingIsNotFolded(self) -> None:
+        '''A zero padded first convolution would pad the raw pixels instead of the normalized ones'''
+
+        network = SmallNetwork(1)
+
+        self.assertFalse(FoldedNetwork.canFold(network))
+        with self.assertRaises(ValueError):
+            FoldedNetwork(network.eval(), MEAN, STD)
+
+    def testZeroPaddingWouldNotMatch(self) -> None:
+        '''Folding a zero padded first convolution anyway changes the logits at the image border'''
+
+        network = SmallNetwork(1).eval()
+        pixels = createPixels((16, 16))
+
+        with torch.no_grad():
+            network(normalize(pixels))
+            randomizeBatchNorms(network)
+
+            first = FoldedNetwork.foldInputNormalization(network.layers[0], MEAN, STD)
+            expected = network.layers[0](normalize(pixels))
+            actual = first(pixels)
+
+        self.assertFalse(torch.allclose(actual, expected, rtol=1e-4, atol=1e-4))
+        self.assertTrue(torch.allclose(actual[:, :, 1:-1, 1:-1], expected[:, :, 1:-1, 1:-1], rtol=1e-4, atol=1e-4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import math
+from timeit import default_timer as timer
+from typing import Callable, Dict, List
+
+import torch
+
+'''Collection of inference benchmarking related utility functions'''
+
+
+def measureLatency(model: Callable, batch: torch.Tensor, repeats: int = 10, warmup: int = 2) -> Dict[str, float]:
+    '''Measure the latency of running the model on the batch and the resulting throughput'''
+
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(batch)
+
+        times = []
+        for _ in range(repeats):
+            startTime = timer()
+            model(batch)
+            times.append(timer() - startTime)
+
+    times.sort()
+    average = sum(times) / len(times)
+
+    return {
+        'batchSize': batch.shape[0],
+        'averageMs': average * 1000.0,
+        'medianMs': times[len(times) // 2] * 1000.0,
+        'minMs': times[0] * 1000.0,
+        'tilesPerSecond': batch.shape[0] / average
+    }
+
+
+def percentile(sortedValues: List[float], fraction: float) -> float:
+    '''Return the nearest-rank percentile of the sorted values, 0 without values'''
+
+    if not sortedValues:
+        return 0.0
+
+    rank = math.ceil(fraction * len(sortedValues))
+
+    return sortedValues[min(len(sortedValues), max(1, rank)) - 1]
+
+
+def summarizeLatencies(times: List[float]) -> Dict[str, float]:
+    '''Return the mean and the p50, p95 and p99 of the latencies in seconds as milliseconds'''
+
+    times = sorted(times)
+
+    return {
+        'meanMs': sum(times) / len(times) * 1000.0 if times else 0.0,
+        'p50Ms': percentile(times, 0.50) * 1000.0,
+        'p95Ms': percentile(times, 0.95) * 1000.0,
+        'p99Ms': percentile(times, 0.99) * 1000.0,
+        'maxMs': times[-1] * 1000.0 if times else 0.0
+    }
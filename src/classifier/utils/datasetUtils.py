@@ -1,4 +1,3 @@
-from sklearn.model_selection import train_test_split
 from typing import Dict
 
 import torch
@@ -9,6 +8,8 @@ from torch.utils.data import Dataset, Subset, random_split
 
 def splitDatasetTrainTest(dataSet: Dataset, testSize: float) -> Dict[str, Subset]:
     '''Split dataset into training and test sets'''
+    from sklearn.model_selection import train_test_split
+
     dataSets = {}
     arrays = list(range(len(dataSet)))
     trainIdx, testIdx = train_test_split(arrays, test_size=testSize)
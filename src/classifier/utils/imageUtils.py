@@ -1,17 +1,21 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import cv2
 from pathlib import Path
+import io
 import os
+import struct
+import zlib
+from typing import Dict, List, Tuple, Union
 
 import torch
-import torchvision.transforms as transforms
+import torch.nn.functional as F
 
 '''Collection of image transformation related utility functions'''
 
 
 def imshow(image):
     '''Show image'''
+    import matplotlib.pyplot as plt
 
     image = image / 2 + 0.5     # unnormalize
     npimg = image.numpy()
@@ -44,27 +48,438 @@ def splitImage(image, rows: int, cols: int) -> None:
     return result
 
 
-def splitImageToTensors(image, rows: int, cols: int, transformations) -> None:
-    '''Split the image and covert to tensors'''
+def cropOrPadToGrid(image, rows: int, cols: int, remainderMode: str = 'crop'):
+    '''Crop or pad the image so its size is divisible by the given rows and columns'''
 
-    result = []
+    height, width = image.shape[:2]
 
-    parts = splitImage(image, rows, cols)
-    for row in range(0, rows):
-        resultRow = []
-        for col in range(0, cols):
-            imageTensor = imageToTensor(parts[row][col])
-            imageTensor = transformations(imageTensor)
+    if remainderMode == 'pad':
+        bottom = -height % rows
+        right = -width % cols
 
-            resultRow.append(imageTensor)
+        if bottom or right:
+            image = cv2.copyMakeBorder(
+                image, 0, bottom, 0, right, cv2.BORDER_REPLICATE)
 
-        result.append(resultRow)
+        return image
 
-    return result
+    if remainderMode != 'crop':
+        raise ValueError(f'Unknown tile remainder mode: {remainderMode}')
+
+    # Slicing only creates a view, the remainder pixels are not copied
+    return image[:height - height % rows, :width - width % cols]
+
+
+def splitImageView(image, rows: int, cols: int):
+    '''Return a (rows, cols, tileHeight, tileWidth, channels) view of the image without copying'''
+
+    height, width, channels = image.shape
+    tileHeight = height // rows
+    tileWidth = width // cols
+
+    if tileHeight == 0 or tileWidth == 0:
+        raise ValueError(
+            f'Image of size {width}x{height} cannot be split into {rows} rows and {cols} columns')
+
+    rowStride, colStride, channelStride = image.strides
+
+    return np.lib.stride_tricks.as_strided(
+        image,
+        shape=(rows, cols, tileHeight, tileWidth, channels),
+        strides=(tileHeight * rowStride, tileWidth * colStride,
+                 rowStride, colStride, channelStride))
+
+
+def readImageSize(data: bytes) -> Tuple[int, int]:
+    '''Read the (width, height) of a png or jpeg image from its header, None if unknown'''
+
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+
+    if data[:2] != b'\xff\xd8':
+        return None
+
+    # Walk the jpeg segments until the start of frame marker holding the size
+    position = 2
+    while position + 9 < len(data):
+        if data[position] != 0xFF:
+            return None
+
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[position + 5:position + 7], 'big')
+            width = int.from_bytes(data[position + 7:position + 9], 'big')
+            return width, height
+
+        position += 2 + int.from_bytes(data[position + 2:position + 4], 'big')
+
+    return None
+
+
+REDUCED_READ_FLAGS: Dict[int, int] = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+def readFileHeader(path: str, size: int = 256 * 1024) -> bytes:
+    '''Read the beginning of the file holding the image header'''
+
+    with open(path, 'rb') as inFile:
+        return inFile.read(size)
+
+
+def getReducedFactor(header: bytes, targetSize: Tuple[int, int]) -> int:
+    '''Return the largest jpeg decode scale down factor keeping the image at least (width, height) big'''
+
+    if header[:2] != b'\xff\xd8':
+        return 1
+
+    imageSize = readImageSize(header)
+    if imageSize is None:
+        return 1
+
+    width, height = imageSize
+    targetWidth, targetHeight = targetSize
+
+    # The decoder scales by 1/2, 1/4 or 1/8 rounding the size up
+    for factor in [8, 4, 2]:
+        if -(-width // factor) >= targetWidth and -(-height // factor) >= targetHeight:
+            return factor
+
+    return 1
+
+
+def estimateDecodedBytes(header: bytes, targetSize: Tuple[int, int]) -> int:
+    '''Return the size of the decoded bgr image in bytes, None if the header is unknown'''
+
+    imageSize = readImageSize(header)
+    if imageSize is None:
+        return None
+
+    width, height = imageSize
+    factor = getReducedFactor(header, targetSize)
+
+    return -(-width // factor) * -(-height // factor) * 3
+
+
+def decodeImageForGrid(source: Union[bytes, str], rows: int, cols: int, imageSize: Tuple[int, int],
+                       remainderMode: str = 'crop'):
+    '''Decode the encoded bytes or the image file at the lowest resolution the grid needs'''
+
+    width, height = imageSize
+    targetSize = (cols * width, rows * height)
+
+    if isinstance(source, str):
+        flag = REDUCED_READ_FLAGS[getReducedFactor(readFileHeader(source), targetSize)]
+        image = cv2.imread(source, flag)
+    else:
+        flag = REDUCED_READ_FLAGS[getReducedFactor(source, targetSize)]
+        image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+
+    if image is None:
+        return None
+
+    return cropOrPadToGrid(image, rows, cols, remainderMode)
+
+
+def cropOrPadBand(band, height: int, cols: int, remainderMode: str = 'crop'):
+    '''Crop or pad a band of image rows to the given height and to a width divisible by the given columns'''
+
+    if remainderMode == 'pad':
+        bottom = height - band.shape[0]
+        right = -band.shape[1] % cols
+
+        if bottom or right:
+            band = cv2.copyMakeBorder(
+                band, 0, bottom, 0, right, cv2.BORDER_REPLICATE)
+
+        return band
+
+    if remainderMode != 'crop':
+        raise ValueError(f'Unknown tile remainder mode: {remainderMode}')
+
+    return band[:height, :band.shape[1] - band.shape[1] % cols]
+
+
+PNG_SIGNATURE: bytes = b'\x89PNG\r\n\x1a\n'
+
+# The channels of the png color types read band by band, grey, rgb, grey with alpha and rgb with alpha,
+# and the order of the OpenCV decoded channels in the png rows
+PNG_BAND_CHANNELS: Dict[int, List[int]] = {
+    0: [0],
+    2: [2, 1, 0],
+    4: [0, 3],
+    6: [2, 1, 0, 3]
+}
+
+
+def canReadPngBands(header: bytes) -> bool:
+    '''Return whether the image is a png that can be decoded band by band
+
+    Only non interlaced 8 bit grey and rgb images, with or without alpha, are supported. Images
+    with exif data are decoded whole, as OpenCV rotates them by their orientation.
+    '''
+
+    if header[:8] != PNG_SIGNATURE or len(header) < 33 or header[12:16] != b'IHDR':
+        return False
+
+    depth, colorType, interlace = header[24], header[25], header[28]
+    if depth != 8 or colorType not in PNG_BAND_CHANNELS or interlace != 0:
+        return False
+
+    # Walk the chunks before the image data
+    position = 8
+    while position + 8 <= len(header):
+        chunkType = header[position + 4:position + 8]
+        if chunkType in (b'IDAT', b'IEND'):
+            return True
+        if chunkType == b'eXIf':
+            return False
+
+        position += 12 + int.from_bytes(header[position:position + 4], 'big')
+
+    return True
+
+
+def createPngChunk(chunkType: bytes, data: bytes) -> bytes:
+    '''Return the png chunk of the given type holding the data'''
+
+    return struct.pack('>I', len(data)) + chunkType + data + struct.pack('>I', zlib.crc32(chunkType + data))
+
+
+class PngBandReader:
+    '''Decode a png image band by band from the encoded bytes or the image file
+
+    The image data is inflated incrementally. The filtered rows of each band are wrapped into a small
+    uncompressed png, after the last row of the previous band which their filters refer to, and decoded
+    by OpenCV. The bands equal the rows of the whole decoded image, while only the compressed data and
+    the current band are held in memory.
+    '''
+
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, source: Union[bytes, str]) -> None:
+        '''Open the image and read the header, raise ValueError if it is not a supported png'''
+
+        self.file = open(source, 'rb') if isinstance(source, str) else io.BytesIO(source)
+        self.inflater = zlib.decompressobj()
+        self.pending = bytearray()
+        self.previousRow: bytes = None
+        self.remaining = 0
+        self.ended = False
+
+        try:
+            self.readHeader()
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def estimateRowBytes(header: bytes) -> int:
+        '''Return the estimated memory needed to decode one image row of the png'''
+
+        width = int.from_bytes(header[16:20], 'big')
+        rowBytes = 1 + width * len(PNG_BAND_CHANNELS[header[25]])
+
+        # The inflated rows, their copy wrapped into the band png, the decoded and the bgr rows
+        return 3 * rowBytes + 3 * width
+
+    def readHeader(self) -> None:
+        '''Read the chunks up to the start of the image data'''
+
+        header = self.file.read(8 + 25)
+        if not canReadPngBands(header):
+            raise ValueError('Image could not be decoded')
+
+        self.width, self.height = struct.unpack('>II', header[16:24])
+        self.headerTail = header[24:29]
+        self.channels = PNG_BAND_CHANNELS[header[25]]
+        self.rowBytes = 1 + self.width * len(self.channels)
+
+        # Ancillary chunks are left out of the band pngs, OpenCV ignores them when decoding to bgr
+        while True:
+            length, chunkType = self.readChunkHeader()
+            if chunkType == b'IDAT':
+                self.remaining = length
+                return
+
+            if not chunkType or chunkType == b'IEND':
+                raise ValueError('Image could not be decoded')
+
+            self.file.seek(length + 4, os.SEEK_CUR)
+
+    def readChunkHeader(self) -> Tuple[int, bytes]:
+        '''Read the length and the type of the next chunk, the type is empty at the end of the file'''
+
+        data = self.file.read(8)
+        if len(data) < 8:
+            return 0, b''
+
+        return int.from_bytes(data[:4], 'big'), data[4:]
+
+    def readCompressed(self) -> bytes:
+        '''Read the next piece of the compressed image data, empty after the last image data chunk'''
+
+        while self.remaining == 0 and not self.ended:
+            # Skip the checksum of the finished chunk, the image data chunks follow each other
+            self.file.read(4)
+            length, chunkType = self.readChunkHeader()
+
+            if chunkType == b'IDAT':
+                self.remaining = length
+            else:
+                self.ended = True
+
+        if self.ended:
+            return b''
+
+        data = self.file.read(min(self.remaining, self.READ_SIZE))
+        if not data:
+            self.ended = True
+
+        self.remaining -= len(data)
+
+        return data
+
+    def readRows(self, count: int):
+        '''Decode the next rows of the image to a (count, width, 3) bgr image'''
+
+        needed = count * self.rowBytes
+        while len(self.pending) < needed:
+            data = self.inflater.unconsumed_tail or self.readCompressed()
+            if not data:
+                raise ValueError('Image could not be decoded, the image data is truncated')
+
+            self.pending += self.inflater.decompress(data, needed - len(self.pending))
+
+        rows = self.pending[:needed]
+        del self.pending[:needed]
+
+        if self.previousRow is not None:
+            rows[0:0] = self.previousRow
+
+        imageHeight = len(rows) // self.rowBytes
+        band = b''.join([
+            PNG_SIGNATURE,
+            createPngChunk(b'IHDR', struct.pack('>II', self.width, imageHeight) + self.headerTail),
+            createPngChunk(b'IDAT', zlib.compress(rows, 0)),
+            createPngChunk(b'IEND', b'')
+        ])
+        del rows
+
+        image = cv2.imdecode(np.frombuffer(band, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError('Image could not be decoded')
+
+        image = image.reshape(imageHeight, self.width, -1)
+
+        # The last row is stored unfiltered in the png channel order for the filters of the next band
+        self.previousRow = b'\x00' + np.ascontiguousarray(image[-1][:, self.channels]).tobytes()
+
+        if imageHeight > count:
+            image = image[1:]
+
+        if image.shape[2] < 3:
+            return cv2.cvtColor(image[:, :, 0], cv2.COLOR_GRAY2BGR)
+
+        return np.ascontiguousarray(image[:, :, :3])
+
+    def close(self) -> None:
+        '''Close the image file'''
+
+        self.file.close()
+
+
+def resizeToTiles(image, rows: int, cols: int, imageSize: Tuple[int, int], enlarge: bool = False):
+    '''Shrink the grid aligned image to exactly rows * cols tiles of the given (width, height) size'''
+
+    width, height = imageSize
+    targetWidth = cols * width
+    targetHeight = rows * height
+
+    if image.shape[:2] == (targetHeight, targetWidth):
+        return image
+
+    # Without enlarge smaller images are upsampled tile by tile when converted to tensors
+    if image.shape[0] >= targetHeight and image.shape[1] >= targetWidth:
+        image = cv2.resize(image, (targetWidth, targetHeight),
+                           interpolation=cv2.INTER_AREA)
+    elif enlarge:
+        image = cv2.resize(image, (targetWidth, targetHeight),
+                           interpolation=cv2.INTER_LINEAR)
+
+    return image
+
+
+def slidingWindowView(image, windowSize: Tuple[int, int], stride: int):
+    '''Return a (windowRows, windowCols, height, width, channels) view of the (width, height) windows without copying'''
+
+    height, width, channels = image.shape
+    windowWidth, windowHeight = windowSize
+
+    if height < windowHeight or width < windowWidth:
+        raise ValueError(
+            f'Image of size {width}x{height} is smaller than the {windowWidth}x{windowHeight} window')
+
+    windowRows = (height - windowHeight) // stride + 1
+    windowCols = (width - windowWidth) // stride + 1
+    rowStride, colStride, channelStride = image.strides
+
+    return np.lib.stride_tricks.as_strided(
+        image,
+        shape=(windowRows, windowCols, windowHeight, windowWidth, channels),
+        strides=(stride * rowStride, stride * colStride,
+                 rowStride, colStride, channelStride))
+
+
+def tilesToTensors(tiles, imageSize: Tuple[int, int], mean: Tuple[float], std: Tuple[float]) -> torch.Tensor:
+    '''Convert a (..., height, width, channels) uint8 stack of tiles to a normalized (N, 3, height, width) batch
+
+    Without mean and std the batch keeps the 0-255 pixel values for networks with the normalization folded in.
+    '''
+
+    tiles = torch.from_numpy(tiles)
+
+    # The only copy of the pixel data is the dtype conversion of the whole stack
+    batch = tiles.movedim(-1, -3).to(
+        torch.float32, memory_format=torch.contiguous_format)
+    batch = batch.view(-1, *batch.shape[-3:])
+
+    width, height = imageSize
+    if batch.shape[2:] != (height, width):
+        batch = F.interpolate(batch, size=(height, width),
+                              mode='bilinear', align_corners=False, antialias=False)
+
+    if mean is None:
+        return batch
+
+    batch.div_(255.0)
+
+    meanTensor = torch.tensor(mean, dtype=batch.dtype).view(1, -1, 1, 1)
+    stdTensor = torch.tensor(std, dtype=batch.dtype).view(1, -1, 1, 1)
+
+    return batch.sub_(meanTensor).div_(stdTensor)
+
+
+def splitImageToTensors(image, rows: int, cols: int, imageSize: Tuple[int, int],
+                        mean: Tuple[float], std: Tuple[float], remainderMode: str = 'crop') -> torch.Tensor:
+    '''Split the uint8 image and convert the tiles to a normalized (rows * cols, 3, height, width) batch'''
+
+    image = cropOrPadToGrid(image, rows, cols, remainderMode)
+
+    return tilesToTensors(splitImageView(image, rows, cols), imageSize, mean, std)
 
 
 def imageToTensor(image) -> None:
     '''Convert the given image to tensor'''
+    import torchvision.transforms as transforms
 
     transformedImage = image
 
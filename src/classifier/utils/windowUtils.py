@@ -0,0 +1,37 @@
+import torch
+
+'''Collection of sliding window related utility functions'''
+
+
+def countWindows(length: int, windowLength: int, stride: int) -> int:
+    '''Return the number of windows fitting along an axis of the given length'''
+
+    return (length - windowLength) // stride + 1
+
+
+def calculateWindowOverlap(tileCount: int, tileLength: int, windowCount: int, windowLength: int,
+                           stride: int) -> torch.Tensor:
+    '''Return the (tileCount, windowCount) overlapping lengths of the tiles and the windows along an axis'''
+
+    tileStart = torch.arange(tileCount) * tileLength
+    windowStart = torch.arange(windowCount) * stride
+
+    start = torch.maximum(tileStart[:, None], windowStart[None, :])
+    end = torch.minimum(tileStart[:, None] + tileLength,
+                        windowStart[None, :] + windowLength)
+
+    return (end - start).clamp_min(0).float()
+
+
+def aggregateWindowProbabilities(probabilities: torch.Tensor, rowOverlap: torch.Tensor,
+                                 colOverlap: torch.Tensor) -> torch.Tensor:
+    '''Average the (windowRows, windowCols, classes) window probabilities over each tile
+
+    The windows are weighted by their overlapping area with the tile, the result is (rows, cols, classes).
+    '''
+
+    summed = torch.einsum('ry,yxc,kx->rkc', rowOverlap,
+                          probabilities, colOverlap)
+    weights = rowOverlap.sum(1)[:, None] * colOverlap.sum(1)[None, :]
+
+    return summed / weights[..., None]
@@ -47,6 +47,9 @@ class ConfigSerializer(serializers.Serializer):
     augmentDataSet = serializers.BooleanField(required=False)
     balanceDataSet = serializers.BooleanField(required=False)
     useResNet = serializers.BooleanField(required=False)
+    profile = serializers.CharField(required=False)
+    profileEpochs = serializers.ListField(
+        required=False, child=serializers.IntegerField(min_value=1), min_length=1)
 
     def validate(self, data):
         '''Add multi field custom validation'''
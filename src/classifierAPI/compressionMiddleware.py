@@ -0,0 +1,94 @@
+import importlib.util
+from typing import Dict
+
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+ZSTD_AVAILABLE = importlib.util.find_spec('zstandard') is not None
+
+
+def parseAcceptEncoding(header: str) -> Dict[str, float]:
+    '''Return the quality value of each coding of the Accept-Encoding header, codings with a malformed q are skipped'''
+
+    qualities = {}
+
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = None
+
+        if quality is not None and 0 <= quality <= 1:
+            qualities[coding.lower()] = quality
+
+    return qualities
+
+
+def chooseEncoding(header: str) -> str:
+    '''Return the supported coding the client prefers, zstd on a tie, None if it accepts neither
+
+    A coding listed with q=0 is refused, * gives the quality of the codings not listed.
+    '''
+
+    qualities = parseAcceptEncoding(header)
+    supported = ['zstd', 'gzip'] if ZSTD_AVAILABLE else ['gzip']
+
+    bestEncoding = None
+    bestQuality = 0.0
+
+    for encoding in supported:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > bestQuality:
+            bestEncoding = encoding
+            bestQuality = quality
+
+    return bestEncoding
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    '''Compress json responses with zstd or gzip, whichever the client accepts'''
+
+    minimumLength = 200
+
+    def process_response(self, request, response):
+        '''Compress the response body if the client accepts it'''
+
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+
+        if not response.get('Content-Type', '').startswith('application/json'):
+            return response
+
+        if len(response.content) < self.minimumLength:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = chooseEncoding(request.headers.get('Accept-Encoding', ''))
+
+        if encoding == 'zstd':
+            import zstandard
+
+            content = zstandard.ZstdCompressor().compress(response.content)
+        elif encoding == 'gzip':
+            content = compress_string(response.content)
+        else:
+            return response
+
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+
+        return response
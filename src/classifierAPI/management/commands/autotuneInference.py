@@ -0,0 +1,161 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+from django.core.management.base import BaseCommand, CommandError
+
+from classifier.config.classifierConfig import ClassifierConfig
+from classifier.config.config import Config
+from classifier.inferenceProfile import InferenceProfile
+from classifier.utils.benchmarkUtils import measureLatency
+from classifier.utils.imageUtils import tilesToTensors
+
+MEMORY_FORMATS: List[str] = ['contiguous', 'channelsLast']
+
+
+def measureSettings(configPath: str, interopThreads: int, threadCounts: List[int], batchSizes: List[int],
+                    memoryFormats: List[str], tileCount: int, repeats: int) -> List[Dict[str, Any]]:
+    '''Load the served networks in a fresh process and measure their throughput for every setting
+
+    Torch only accepts the number of inter-op threads before the first parallel work of a process,
+    so every inter-op thread count is measured in its own process.
+    '''
+
+    if interopThreads > 0:
+        torch.set_num_interop_threads(interopThreads)
+
+    # The measured profile must not influence the measurement
+    os.environ['USE_INFERENCE_PROFILE'] = 'false'
+    Config(configPath)
+
+    from classifier.modelRegistry import ModelRegistry
+
+    ModelRegistry.load()
+    engine = ModelRegistry.getEngine()
+    config = ModelRegistry.getConfig()
+
+    width, height = config.getImageSize()
+    tiles = np.random.default_rng(0).integers(
+        0, 256, (tileCount, height, width, 3), dtype=np.uint8)
+
+    mean, std = None, None
+    if not engine.isInputFolded():
+        mean, std = tuple(config.getMean()), tuple(config.getStd())
+    batch = tilesToTensors(tiles, (width, height), mean, std)
+
+    results = []
+    for threads in threadCounts:
+        torch.set_num_threads(threads)
+
+        for memoryFormat in memoryFormats:
+            engine.setChannelsLast(memoryFormat == 'channelsLast')
+
+            for batchSize in batchSizes:
+                engine.setBatchSize(batchSize)
+                latency = measureLatency(engine.predictLogits, batch, repeats, warmup=1)
+
+                results.append({
+                    'torchThreads': threads,
+                    'interopThreads': interopThreads,
+                    'inferenceBatchSize': batchSize,
+                    'channelsLast': memoryFormat == 'channelsLast',
+                    'tilesPerSecond': latency['tilesPerSecond']
+                })
+
+    networks = ModelRegistry.getNetworkIds(
+        ModelRegistry.getClassificationMap().getClassifications())
+    ModelRegistry.reset()
+
+    for result in results:
+        result['networks'] = networks
+
+    return results
+
+
+class Command(BaseCommand):
+    '''Find the fastest inference settings of this machine and save them as the inference profile'''
+
+    help = ('Measure the throughput of the served networks on synthetic tiles for a grid of torch threads, '
+            'inter-op threads, batch sizes and memory formats, then save the best settings as the inference profile')
+
+    def add_arguments(self, parser) -> None:
+        '''Add command line arguments'''
+
+        parser.add_argument('--threads', type=int, nargs='+', default=None,
+                            help='Torch thread counts to measure, powers of two up to the cores per inference worker by default')
+        parser.add_argument('--interop-threads', type=int, nargs='+', default=[0],
+                            help='Inter-op thread counts to measure, 0 is the torch default')
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 64, 128, 256],
+                            help='Inference batch sizes to measure')
+        parser.add_argument('--memory-formats', nargs='+', choices=MEMORY_FORMATS, default=MEMORY_FORMATS,
+                            help='Memory formats to measure')
+        parser.add_argument('--tiles', type=int, default=512,
+                            help='Number of synthetic tiles classified per measurement')
+        parser.add_argument('--repeats', type=int, default=3,
+                            help='Number of timed runs of each measurement')
+        parser.add_argument('--output', default=None,
+                            help='Path of the profile, the inference profile loaded at startup by default')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the measurements, do not write the profile')
+
+    def handle(self, *args, **options) -> None:
+        '''Run the measurements and save the best settings'''
+
+        if not Config.getPath():
+            raise CommandError('Configuration is not loaded, run the command with manage.py')
+
+        config = ClassifierConfig(Config.getPath())
+        threadCounts = options['threads'] or self.getDefaultThreadCounts(
+            config.getInferenceWorkers())
+
+        if min(threadCounts + options['batch_sizes']) < 1 or min(options['interop_threads']) < 0:
+            raise CommandError('Thread counts and batch sizes must be positive')
+
+        results = []
+        context = multiprocessing.get_context('spawn')
+
+        for interopThreads in options['interop_threads']:
+            self.stdout.write(f'Measuring with {interopThreads} inter-op threads')
+
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                future = executor.submit(measureSettings, Config.getPath(), interopThreads, threadCounts,
+                                         options['batch_sizes'], options['memory_formats'], options['tiles'],
+                                         options['repeats'])
+                results.extend(future.result())
+
+        results.sort(key=lambda result: result['tilesPerSecond'], reverse=True)
+        for result in results:
+            self.stdout.write(f"threads {result['torchThreads']:>3}, inter-op {result['interopThreads']:>3}, "
+                              f"batch {result['inferenceBatchSize']:>4}, channels last {str(result['channelsLast']):>5}: "
+                              f"{result['tilesPerSecond']:.1f} tiles/s")
+
+        best = results[0]
+        profile = InferenceProfile(best['torchThreads'], best['interopThreads'], best['inferenceBatchSize'],
+                                   best['channelsLast'], best['tilesPerSecond'], best['networks'])
+
+        self.stdout.write(json.dumps(profile.getAsJson(), indent=4))
+
+        if options['dry_run']:
+            return
+
+        path = options['output'] or Config.getInferenceProfilePath()
+        profile.save(path)
+        self.stdout.write(f'Inference profile saved: {path}')
+
+    def getDefaultThreadCounts(self, workers: int) -> List[int]:
+        '''Return the powers of two up to the cores of one inference worker and the core count itself'''
+
+        cores = max(1, (os.cpu_count() or 1) // workers)
+
+        threadCounts = []
+        threads = 1
+        while threads < cores:
+            threadCounts.append(threads)
+            threads *= 2
+        threadCounts.append(cores)
+
+        return threadCounts
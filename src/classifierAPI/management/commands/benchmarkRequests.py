@@ -0,0 +1,541 @@
+import http.client
+import itertools
+import json
+import os
+import resource
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from timeit import default_timer as timer
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from classifier.config.config import Config
+from classifier.utils.benchmarkUtils import summarizeLatencies
+
+DEFAULT_GRIDS: List[str] = ['1x1', '8x8', '32x32', '64x64']
+
+# Metrics compared with the baseline, True if a higher value is better
+COMPARED_METRICS: Dict[str, bool] = {
+    'p50Ms': False,
+    'p95Ms': False,
+    'p99Ms': False,
+    'requestsPerSecond': True,
+    'tilesPerSecond': True
+}
+
+# Each sender thread is its own client, so the per client limit of the inference queue applies per thread
+CLIENT_ID_HEADER = 'X-Client-Id'
+
+
+class RequestShape:
+    '''Path, query, headers and form fields of a classification request to replay'''
+
+    def __init__(self, name: str, path: str, fields: Dict[str, str], headers: Dict[str, str] = None,
+                 query: Dict[str, str] = None, imagePath: str = None, fixedGrid: bool = False) -> None:
+        '''Init shape, a fixed grid keeps its rows and cols instead of running every benchmarked grid'''
+
+        self.name = name
+        self.path = '/' + path.lstrip('/')
+        self.fields = fields
+        self.headers = headers or {}
+        self.query = query or {}
+        self.imagePath = imagePath
+        self.fixedGrid = fixedGrid
+
+    def withGrid(self, rows: int, cols: int) -> 'RequestShape':
+        '''Return a copy of the shape splitting the image into the given grid'''
+
+        fields = dict(self.fields, rows=str(rows), cols=str(cols))
+
+        return RequestShape(self.name, self.path, fields, self.headers, self.query, self.imagePath, True)
+
+    def getGrid(self) -> Tuple[int, int]:
+        '''Return the rows and cols of the request, 1 x 1 if it does not split the image'''
+
+        return int(self.fields.get('rows', 1)), int(self.fields.get('cols', 1))
+
+    def getUrl(self) -> str:
+        '''Return the path with the query string'''
+
+        if not self.query:
+            return self.path
+
+        return f'{self.path}?{urlencode(self.query)}'
+
+    def getKey(self) -> str:
+        '''Return the name identifying the shape and its grid in the report and the baseline'''
+
+        rows, cols = self.getGrid()
+
+        return f'{self.name} {rows}x{cols}'
+
+
+def getRootPath() -> str:
+    '''Return the main dir of the repository, the parent of the directory of the loaded configuration'''
+
+    if Config.getPath():
+        return os.path.dirname(os.path.dirname(os.path.abspath(Config.getPath())))
+
+    return os.getcwd()
+
+
+def checkFile(path: str, description: str) -> str:
+    '''Return the path, raise CommandError if it is not a file'''
+
+    if not os.path.isfile(path):
+        raise CommandError(f'{description} not found: {path}')
+
+    return path
+
+
+def parseGrid(value: str) -> Tuple[int, int]:
+    '''Parse a rows x cols grid like 8x8'''
+
+    try:
+        rows, cols = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise CommandError(f'Invalid grid: {value}, expected <rows>x<cols>')
+
+    if rows < 1 or cols < 1:
+        raise CommandError(f'Invalid grid: {value}, rows and cols must be positive')
+
+    return rows, cols
+
+
+def readCollectionShapes(path: str) -> List[RequestShape]:
+    '''Read the image uploading requests of a Postman collection, the other requests are not replayed'''
+
+    with open(path, 'r', encoding='utf-8') as collectionFile:
+        collection = json.load(collectionFile)
+
+    shapes = []
+    items = list(collection.get('item', []))
+
+    while items:
+        item = items.pop(0)
+        if 'item' in item:
+            items.extend(item['item'])
+            continue
+
+        request = item.get('request', {})
+        formData = [entry for entry in request.get('body', {}).get('formdata', []) if not entry.get('disabled')]
+        if not any(entry.get('key') == 'image' and entry.get('type') == 'file' for entry in formData):
+            continue
+
+        url = request.get('url', '')
+        if isinstance(url, dict):
+            urlPath = '/'.join(url.get('path', []))
+            query = {entry['key']: entry.get('value', '')
+                     for entry in url.get('query', []) if not entry.get('disabled')}
+        else:
+            splitUrl = urlsplit(url if '://' in url else f'http://{url}')
+            urlPath = splitUrl.path
+            query = dict(parse_qsl(splitUrl.query))
+
+        fields = {entry['key']: str(entry.get('value', '')) for entry in formData if entry.get('type') != 'file'}
+        headers = {entry['key']: entry.get('value', '')
+                   for entry in request.get('header', []) if not entry.get('disabled')}
+
+        shapes.append(RequestShape(item.get('name', urlPath), urlPath, fields, headers, query))
+
+    return shapes
+
+
+def readJsonlShapes(path: str) -> List[RequestShape]:
+    '''Read request shapes from json lines
+
+    Each line holds the optional name, path (api/classifyImage by default), query, headers and image
+    of a request, every other key is sent as a form field. A line with rows and cols keeps its grid.
+    '''
+
+    shapes = []
+
+    with open(path, 'r', encoding='utf-8') as jsonlFile:
+        for lineNumber, line in enumerate(jsonlFile, 1):
+            if not line.strip():
+                continue
+
+            data = json.loads(line)
+            name = data.pop('name', f'{os.path.basename(path)}:{lineNumber}')
+            requestPath = data.pop('path', 'api/classifyImage')
+            query = data.pop('query', {})
+            headers = data.pop('headers', {})
+            imagePath = data.pop('image', None)
+            fields = {key: str(value) for key, value in data.items()}
+
+            shapes.append(RequestShape(name, requestPath, fields, headers, query, imagePath,
+                                       'rows' in fields and 'cols' in fields))
+
+    return shapes
+
+
+def createMultipartBody(fields: Dict[str, str], image: bytes) -> Tuple[bytes, str]:
+    '''Encode the form fields and the image as multipart form data, return the body and its content type'''
+
+    boundary = uuid.uuid4().hex
+    parts = []
+
+    for key, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'
+                     .encode('utf-8'))
+
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="image"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8'))
+    parts.append(image)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode('utf-8'))
+
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class InProcessClient:
+    '''Send the requests through the Django test client of this process, one client per thread'''
+
+    def __init__(self) -> None:
+        '''Init client'''
+
+        self._local = threading.local()
+
+    def send(self, shape: RequestShape, image: bytes, headers: Dict[str, str]) -> int:
+        '''Send the request, read the whole response and return its status code'''
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import Client
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = Client()
+            self._local.client = client
+
+        data = dict(shape.fields, image=SimpleUploadedFile('image', image))
+        meta = {'HTTP_' + name.upper().replace('-', '_'): value for name, value in headers.items()}
+        response = client.post(shape.getUrl(), data, **meta)
+
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+
+        return response.status_code
+
+
+class HttpClient:
+    '''Send the requests to a running server, each thread keeps its connection open'''
+
+    def __init__(self, url: str, timeout: float) -> None:
+        '''Init client of the server at the url'''
+
+        splitUrl = urlsplit(url if '://' in url else f'http://{url}')
+        if splitUrl.scheme not in ['http', 'https']:
+            raise CommandError(f'Unsupported url scheme: {splitUrl.scheme}')
+
+        self.scheme = splitUrl.scheme
+        self.host = splitUrl.hostname
+        self.port = splitUrl.port
+        self.basePath = splitUrl.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def getConnection(self) -> http.client.HTTPConnection:
+        '''Return the connection of the calling thread'''
+
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connectionClass = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            connection = connectionClass(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+
+        return connection
+
+    def send(self, shape: RequestShape, image: bytes, headers: Dict[str, str]) -> int:
+        '''Send the request, read the whole response and return its status code'''
+
+        body, contentType = createMultipartBody(shape.fields, image)
+        headers = dict(headers, **{'Content-Type': contentType})
+
+        # A kept alive connection the server closed meanwhile is opened again once
+        for attempt in range(2):
+            connection = self.getConnection()
+            try:
+                connection.request('POST', self.basePath + shape.getUrl(), body, headers)
+                response = connection.getresponse()
+                response.read()
+
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+
+def readPeakRssMb(serverPid: int = None) -> float:
+    '''Return the peak resident memory of the server process, this process if no pid is given'''
+
+    if serverPid is None:
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    try:
+        with open(f'/proc/{serverPid}/status', 'r') as statusFile:
+            for line in statusFile:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+
+    return None
+
+
+def compareWithBaseline(results: List[Dict[str, Any]], baseline: Dict[str, Any],
+                        tolerance: float) -> List[Dict[str, Any]]:
+    '''Compare the results with the baseline results of the same name
+
+    A metric regressed if it got worse by more than the tolerance percent.
+    '''
+
+    baselineResults = {result['name']: result for result in baseline.get('results', [])}
+    comparison = []
+
+    for result in results:
+        baselineResult = baselineResults.get(result['name'])
+        if baselineResult is None:
+            continue
+
+        metrics = {}
+        regressions = []
+
+        for metric, higherIsBetter in COMPARED_METRICS.items():
+            baselineValue = baselineResult.get(metric)
+            value = result[metric]
+            if not baselineValue:
+                continue
+
+            changePercent = (value - baselineValue) / baselineValue * 100.0
+            metrics[metric] = {'baseline': baselineValue, 'current': value, 'changePercent': changePercent}
+
+            worsePercent = -changePercent if higherIsBetter else changePercent
+            if worsePercent > tolerance:
+                regressions.append(metric)
+
+        comparison.append({'name': result['name'], 'metrics': metrics, 'regressions': regressions})
+
+    return comparison
+
+
+class Command(BaseCommand):
+    '''Replay the request shapes of the Postman collection or a json lines file and report latency and throughput'''
+
+    help = ('Send the classification requests of the Postman collection and the given json lines file, for every '
+            'grid and concurrency, in process through the Django test client or to a running server, and report '
+            'the p50/p95/p99 latency, requests/s, tiles/s and peak RSS as json, optionally compared with a baseline')
+
+    def add_arguments(self, parser) -> None:
+        '''Add command line arguments'''
+
+        parser.add_argument('--url', default=None,
+                            help='Base url of a running server, the requests are handled in process without it')
+        parser.add_argument('--collection', default=None,
+                            help='Postman collection to replay the image uploads of, empty to skip it, '
+                                 'ImageClassifier.postman_collection of the main dir by default')
+        parser.add_argument('--requests', default=None,
+                            help='Json lines file of request shapes to replay')
+        parser.add_argument('--image', default=None,
+                            help='Image sent by the shapes without their own image, '
+                                 'testImage.png of the main dir by default')
+        parser.add_argument('--grids', nargs='+', default=DEFAULT_GRIDS,
+                            help='Grids (<rows>x<cols>) the shapes without a fixed grid are sent with')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4],
+                            help='Numbers of requests sent at once')
+        parser.add_argument('--count', type=int, default=20,
+                            help='Number of timed requests of each shape, grid and concurrency')
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Number of untimed requests before each measurement')
+        parser.add_argument('--cached', action='store_true',
+                            help='Send identical images so repeated requests hit the result cache')
+        parser.add_argument('--server-pid', type=int, default=None,
+                            help='Process id of the server to read the peak RSS of in http mode')
+        parser.add_argument('--timeout', type=float, default=300.0,
+                            help='Seconds to wait for a response in http mode')
+        parser.add_argument('--output', default=None,
+                            help='Path to write the json report to, printed if not given')
+        parser.add_argument('--baseline', default=None,
+                            help='Earlier json report to compare the results with')
+        parser.add_argument('--tolerance', type=float, default=10.0,
+                            help='Percent a metric may get worse than the baseline before it counts as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Fail if a metric regressed compared to the baseline')
+
+    def handle(self, *args, **options) -> None:
+        '''Run the measurements and report them'''
+
+        if options['url'] is None and not Config.getPath():
+            raise CommandError('Configuration is not loaded, run the command with manage.py')
+
+        if min(options['concurrency']) < 1 or options['count'] < 1 or options['warmup'] < 0 or options['tolerance'] < 0:
+            raise CommandError('Concurrency and count must be positive, warmup and tolerance not negative')
+
+        if options['collection'] is None:
+            options['collection'] = os.path.join(getRootPath(), 'ImageClassifier.postman_collection')
+        if options['image'] is None:
+            options['image'] = os.path.join(getRootPath(), 'testImage.png')
+
+        shapes = self.getShapes(options)
+        if not shapes:
+            raise CommandError('No classification requests to replay')
+
+        baseline = None
+        if options['baseline']:
+            with open(checkFile(options['baseline'], 'Baseline'), 'r') as baselineFile:
+                baseline = json.load(baselineFile)
+
+        if options['url']:
+            client = HttpClient(options['url'], options['timeout'])
+        else:
+            client = InProcessClient()
+
+        images: Dict[str, bytes] = {}
+        for shape in shapes:
+            imagePath = shape.imagePath or options['image']
+            if imagePath not in images:
+                with open(checkFile(imagePath, 'Image'), 'rb') as imageFile:
+                    images[imagePath] = imageFile.read()
+
+        # The suffix makes each image unique, so the result cache does not answer the measured requests
+        self.runId = uuid.uuid4().hex[:8]
+        self.requestIndex = itertools.count()
+        self.cached = options['cached']
+
+        results = []
+        for shape in shapes:
+            image = images[shape.imagePath or options['image']]
+
+            for concurrency in options['concurrency']:
+                result = self.measure(client, shape, image, concurrency, options['count'], options['warmup'])
+                result['peakRssMb'] = readPeakRssMb(options['server_pid']) if options['url'] else readPeakRssMb()
+                results.append(result)
+
+                self.stdout.write(f"{result['name']}: p50 {result['p50Ms']:.1f} ms, p95 {result['p95Ms']:.1f} ms, "
+                                  f"p99 {result['p99Ms']:.1f} ms, {result['requestsPerSecond']:.2f} requests/s, "
+                                  f"{result['tilesPerSecond']:.1f} tiles/s, {result['errors']} errors")
+
+        report = {
+            'createdAt': datetime.now().isoformat(timespec='seconds'),
+            'mode': 'http' if options['url'] else 'inProcess',
+            'url': options['url'],
+            'cached': options['cached'],
+            'cpuCount': os.cpu_count(),
+            'peakRssMb': max((result['peakRssMb'] for result in results if result['peakRssMb'] is not None),
+                             default=None),
+            'results': results
+        }
+
+        regressions = []
+        if baseline is not None:
+            report['baseline'] = options['baseline']
+            report['comparison'] = compareWithBaseline(results, baseline, options['tolerance'])
+
+            for entry in report['comparison']:
+                changes = ', '.join(f"{metric} {values['changePercent']:+.1f}%"
+                                    for metric, values in entry['metrics'].items())
+                self.stdout.write(f"{entry['name']} vs baseline: {changes}")
+                regressions += [f"{entry['name']} {metric}" for metric in entry['regressions']]
+
+        if options['output']:
+            with open(options['output'], 'w') as outputFile:
+                json.dump(report, outputFile, indent=4)
+            self.stdout.write(f'Benchmark report saved: {options["output"]}')
+        else:
+            self.stdout.write(json.dumps(report, indent=4))
+
+        if regressions:
+            message = f'Regressed by more than {options["tolerance"]}%: {", ".join(regressions)}'
+            if options['fail_on_regression']:
+                raise CommandError(message)
+            self.stdout.write(message)
+
+    def getShapes(self, options: Dict[str, Any]) -> List[RequestShape]:
+        '''Read the request shapes and expand the ones without a fixed grid to every benchmarked grid'''
+
+        shapes = []
+        if options['collection']:
+            shapes += readCollectionShapes(checkFile(options['collection'], 'Postman collection'))
+        if options['requests']:
+            shapes += readJsonlShapes(checkFile(options['requests'], 'Request shapes'))
+
+        grids = [parseGrid(grid) for grid in options['grids']]
+
+        expandedShapes = []
+        for shape in shapes:
+            if shape.fixedGrid:
+                expandedShapes.append(shape)
+            else:
+                expandedShapes += [shape.withGrid(rows, cols) for rows, cols in grids]
+
+        return expandedShapes
+
+    def createImage(self, image: bytes) -> bytes:
+        '''Return the image to send, with a unique suffix the decoders ignore unless cached images are measured'''
+
+        if self.cached:
+            return image
+
+        return image + f'benchmark-{self.runId}-{next(self.requestIndex)}'.encode('utf-8')
+
+    def measure(self, client: Any, shape: RequestShape, image: bytes, concurrency: int, count: int,
+                warmup: int) -> Dict[str, Any]:
+        '''Send the warmup requests one by one, then the timed requests with the given concurrency'''
+
+        threadIds: Dict[int, int] = {}
+        threadIdsLock = threading.Lock()
+
+        def sendRequest(index: int) -> Tuple[float, int]:
+            '''Send one request as the client of the calling thread, return its latency and status code'''
+
+            with threadIdsLock:
+                threadId = threadIds.setdefault(threading.get_ident(), len(threadIds))
+
+            headers = dict({CLIENT_ID_HEADER: f'benchmark-{self.runId}-{threadId}'}, **shape.headers)
+            requestImage = self.createImage(image)
+
+            startTime = timer()
+            try:
+                status = client.send(shape, requestImage, headers)
+            except Exception as exception:
+                self.stderr.write(f'Request failed: {exception}')
+                status = 0
+
+            return timer() - startTime, status
+
+        for index in range(warmup):
+            sendRequest(index)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            startTime = timer()
+            responses = list(executor.map(sendRequest, range(count)))
+            wallSeconds = timer() - startTime
+
+        times = [seconds for seconds, status in responses if 200 <= status < 400]
+        statusCodes: Dict[str, int] = {}
+        for _, status in responses:
+            statusCodes[str(status)] = statusCodes.get(str(status), 0) + 1
+
+        rows, cols = shape.getGrid()
+
+        result = {
+            'name': f'{shape.getKey()} c{concurrency}',
+            'path': shape.getUrl(),
+            'rows': rows,
+            'cols': cols,
+            'concurrency': concurrency,
+            'requests': count,
+            'errors': count - len(times),
+            'statusCodes': statusCodes,
+            'wallSeconds': wallSeconds,
+            'requestsPerSecond': len(times) / wallSeconds,
+            'tilesPerSecond': len(times) * rows * cols / wallSeconds
+        }
+        result.update(summarizeLatencies(times))
+
+        return result
@@ -0,0 +1,91 @@
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules only the training and plotting code needs, the serving path must not import them
+TRAINING_MODULES: List[str] = ['matplotlib', 'sklearn', 'scipy', 'torchvision', 'pandas']
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)$')
+
+
+def parseImportTimes(output: str) -> List[Tuple[str, int, int, int]]:
+    '''Parse the -X importtime report into (module, self us, cumulative us, depth) in import order'''
+
+    imports = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            selfTime, cumulativeTime, indent, module = match.groups()
+            imports.append((module, int(selfTime), int(cumulativeTime), (len(indent) - 1) // 2))
+
+    return imports
+
+
+class Command(BaseCommand):
+    '''Report the import time of the API modules and the training modules they pull in'''
+
+    help = ('Import the URL configuration (or the given modules) in a fresh interpreter with -X importtime, '
+            'report the total import time, the slowest modules and the training only modules that got imported')
+
+    def add_arguments(self, parser) -> None:
+        '''Add command line arguments'''
+
+        parser.add_argument('--module', nargs='+', default=['classifierAPI.urls'],
+                            help='Modules to import after the django setup')
+        parser.add_argument('--top', type=int, default=20,
+                            help='Number of the slowest top level imports to report')
+        parser.add_argument('--strict', action='store_true',
+                            help='Fail if a training only module was imported')
+
+    def handle(self, *args, **options) -> None:
+        '''Run the imports in a subprocess and report their times'''
+
+        statements = ['import django', 'django.setup()'] + \
+            [f'import {module}' for module in options['module']]
+
+        environment = dict(os.environ)
+        environment.setdefault('DJANGO_SETTINGS_MODULE', 'classifierAPI.settings')
+
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', '; '.join(statements)],
+                                 cwd=os.path.dirname(os.path.abspath(sys.modules['__main__'].__file__)),
+                                 env=environment, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise CommandError(f'Importing failed:\n{process.stderr[-2000:]}')
+
+        imports = parseImportTimes(process.stderr)
+        topLevel = [entry for entry in imports if entry[3] == 0]
+        total = sum(entry[2] for entry in topLevel)
+
+        self.stdout.write(f'Imported {len(imports)} modules in {total / 1e6:.2f} s')
+
+        # The slowest imports directly below the top level show which package made a module slow
+        children = [entry for entry in imports if entry[3] <= 1]
+        children.sort(key=lambda entry: entry[2], reverse=True)
+        for module, selfTime, cumulativeTime, depth in children[:options['top']]:
+            self.stdout.write(f'{cumulativeTime / 1e3:>9.1f} ms  {"  " * depth}{module}')
+
+        loaded = self.findTrainingModules(imports)
+        if not loaded:
+            self.stdout.write('No training only modules imported')
+            return
+
+        for module, cumulativeTime in loaded.items():
+            self.stdout.write(
+                f'Training only module imported: {module} ({cumulativeTime / 1e3:.1f} ms)')
+
+        if options['strict']:
+            raise CommandError(f'Training only modules imported: {", ".join(loaded)}')
+
+    def findTrainingModules(self, imports: List[Tuple[str, int, int, int]]) -> Dict[str, int]:
+        '''Return the cumulative import time of each imported training only package'''
+
+        loaded = {}
+        for module, selfTime, cumulativeTime, depth in imports:
+            if module in TRAINING_MODULES:
+                loaded[module] = cumulativeTime
+
+        return loaded
@@ -0,0 +1,113 @@
+import json
+from typing import Any, Dict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from classifier.classificationMap import BaseClassification, ClassificationMap
+from classifier.config.classifierConfig import ClassifierConfig
+from classifier.config.config import Config
+from classifier.models.quantization import (
+    loadCalibrationBatch, loadLabelledSample, measureAccuracy, quantizeModel)
+from classifier.utils.benchmarkUtils import measureLatency
+
+
+class Command(BaseCommand):
+    '''Compare int8 quantized networks with the fp32 ones'''
+
+    help = 'Report the accuracy delta and the latency gain of int8 quantization for each classification'
+
+    def add_arguments(self, parser) -> None:
+        '''Add command line arguments'''
+
+        parser.add_argument('--classification', default=None,
+                            help='Only report the given classification')
+        parser.add_argument('--samples', type=int, default=100,
+                            help='Number of evaluation images per class')
+        parser.add_argument('--batch-size', type=int, default=64,
+                            help='Batch size of the latency measurement')
+        parser.add_argument('--repeats', type=int, default=10,
+                            help='Number of timed runs of the latency measurement')
+        parser.add_argument('--output', default=None,
+                            help='Path of the json file to write the report to')
+
+    def handle(self, *args, **options) -> None:
+        '''Run the report'''
+
+        if not Config.getPath():
+            raise CommandError('Configuration is not loaded, run the command with manage.py')
+
+        classificationMap = ClassificationMap()
+        classifications = classificationMap.getClassifications()
+
+        if options['classification']:
+            name = options['classification']
+            if name not in classifications:
+                raise CommandError(f'Unknown classification: {name}')
+            classifications = {name: classifications[name]}
+
+        report = {}
+        for key, classification in classifications.items():
+            self.stdout.write(f'Measuring {key}')
+            report[key] = self.reportClassification(classification, options)
+
+        formattedReport = json.dumps(report, indent=4)
+        self.stdout.write(formattedReport)
+
+        if options['output']:
+            with open(options['output'], 'w') as outFile:
+                outFile.write(formattedReport)
+
+    def reportClassification(self, classification: BaseClassification, options: Dict[str, Any]) -> Dict[str, Any]:
+        '''Measure the fp32 network and each quantized variant of the given classification'''
+
+        classification.device = 'cpu'
+        classification.configureAndSetupNetwork(
+            ClassifierConfig(Config.getPath()))
+        config = classification.getConfigutation()
+
+        model = classification.getNetwork().getModel()
+        model.eval()
+
+        imageSize = config.getImageSize()
+        mean = tuple(config.getMean())
+        std = tuple(config.getStd())
+
+        try:
+            batch, labels = loadLabelledSample(config.getDataPath(), classification.getClassLabels(),
+                                               imageSize, mean, std, options['samples'])
+            calibrationBatch = loadCalibrationBatch(
+                config.getDataPath(), imageSize, mean, std, config.getCalibrationSamples(), seed=1)
+        except ValueError as error:
+            return {'error': str(error)}
+
+        timingBatch = batch[:options['batch_size']]
+
+        baseAccuracy = measureAccuracy(model, batch, labels)
+        baseLatency = measureLatency(model, timingBatch, options['repeats'])
+
+        result = {
+            'samples': batch.shape[0],
+            'fp32': {
+                'accuracy': baseAccuracy,
+                'latency': baseLatency
+            }
+        }
+
+        for mode in ['dynamic', 'static']:
+            try:
+                quantized = quantizeModel(model, mode, calibrationBatch)
+            except Exception as exception:
+                result[mode] = {'error': str(exception)}
+                continue
+
+            accuracy = measureAccuracy(quantized, batch, labels)
+            latency = measureLatency(quantized, timingBatch, options['repeats'])
+
+            result[mode] = {
+                'accuracy': accuracy,
+                'accuracyDelta': accuracy - baseAccuracy,
+                'latency': latency,
+                'speedup': baseLatency['averageMs'] / latency['averageMs']
+            }
+
+        return result
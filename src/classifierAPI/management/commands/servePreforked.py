@@ -0,0 +1,191 @@
+import os
+import signal
+import socket
+import time
+from typing import Dict, List
+
+import torch
+from django.core.management.base import BaseCommand, CommandError
+
+from classifier.config.classifierConfig import ClassifierConfig
+from classifier.config.config import Config
+from classifier.modelRegistry import ModelRegistry
+from classifier.modelWatcher import ModelWatcher
+
+# Seconds the parent sleeps between checking for exited workers
+WAIT_INTERVAL = 0.5
+
+
+def partitionCores(cores: List[int], workers: int) -> List[List[int]]:
+    '''Split the cores into a contiguous partition for each worker, workers share cores if there are fewer'''
+
+    if workers >= len(cores):
+        return [[cores[index % len(cores)]] for index in range(workers)]
+
+    size, remainder = divmod(len(cores), workers)
+
+    partitions = []
+    start = 0
+    for index in range(workers):
+        end = start + size + (1 if index < remainder else 0)
+        partitions.append(cores[start:end])
+        start = end
+
+    return partitions
+
+
+class Command(BaseCommand):
+    '''Serve the API from pre-forked worker processes sharing the weights loaded by the parent'''
+
+    help = ('Load the networks once, then fork worker processes each serving the ASGI application '
+            'on its own partition of the cores from a shared listening socket')
+
+    def add_arguments(self, parser) -> None:
+        '''Add command line arguments'''
+
+        parser.add_argument('--host', default='0.0.0.0',
+                            help='Address to listen on')
+        parser.add_argument('--port', type=int, default=8000,
+                            help='Port to listen on')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of worker processes, servingWorkers of the configuration by default')
+        parser.add_argument('--log-level', default='info',
+                            help='Log level of the workers')
+
+    def handle(self, *args, **options) -> None:
+        '''Load the networks, fork the workers and restart the ones that exit until stopped'''
+
+        if not Config.getPath():
+            raise CommandError('Configuration is not loaded, run the command with manage.py')
+
+        if not hasattr(os, 'fork'):
+            raise CommandError('Pre-forked serving needs a platform supporting fork')
+
+        if torch.cuda.is_available():
+            raise CommandError('CUDA cannot be used by forked processes, serve with uvicorn instead')
+
+        cores = ModelRegistry.getAvailableCores()
+        workers = options['workers'] or ClassifierConfig(
+            Config.getPath()).getServingWorkers() or len(cores)
+        partitions = partitionCores(cores, workers)
+
+        # Imported before forking, so the workers share the loaded modules as well
+        from classifierAPI.asgi import application
+
+        ModelRegistry.loadForFork()
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((options['host'], options['port']))
+        listener.listen(2048)
+        listener.set_inheritable(True)
+
+        self.stdout.write(
+            f"Serving on {options['host']}:{options['port']} with {workers} workers")
+
+        # Worker process id -> index of its core partition
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+
+        for index in range(workers):
+            pid = self.forkWorker(application, listener, partitions[index], options['log_level'])
+            self.children[pid] = index
+
+        signal.signal(signal.SIGTERM, self.stopWorkers)
+        signal.signal(signal.SIGINT, self.stopWorkers)
+
+        # The parent watches the model files without a thread, as it keeps forking, and serves reloaded
+        # models by forking new workers sharing them
+        watcher = ModelRegistry.createWatcher(ModelRegistry.reloadForFork)
+        nextCheck = time.monotonic() + watcher.interval if watcher else None
+
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid == 0:
+                time.sleep(WAIT_INTERVAL)
+
+                if watcher and not self.stopping and time.monotonic() >= nextCheck:
+                    if self.checkModels(watcher):
+                        self.replaceWorkers(application, listener, partitions, options['log_level'])
+                    nextCheck = time.monotonic() + watcher.interval
+                continue
+
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+
+            self.stderr.write(
+                f'Worker {pid} exited with status {status}, starting a new one')
+            time.sleep(1.0)
+            newPid = self.forkWorker(application, listener, partitions[index], options['log_level'])
+            self.children[newPid] = index
+
+        listener.close()
+
+    def checkModels(self, watcher: ModelWatcher) -> bool:
+        '''Check the watched files, return whether changed models were reloaded in the parent'''
+
+        try:
+            return watcher.check()
+        except Exception as exception:
+            self.stderr.write(f'Error checking model files: {exception}')
+            return False
+
+    def replaceWorkers(self, application, listener: socket.socket, partitions: List[List[int]], logLevel: str) -> None:
+        '''Fork new workers serving the reloaded models, then let the old ones finish their requests and exit'''
+
+        oldChildren = dict(self.children)
+
+        for pid, index in oldChildren.items():
+            newPid = self.forkWorker(application, listener, partitions[index], logLevel)
+            self.children[newPid] = index
+
+            # An old worker is not replaced again when it exits
+            del self.children[pid]
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        self.stdout.write(f'Serving reloaded models with {len(oldChildren)} new workers')
+
+    def stopWorkers(self, signalNumber: int, frame) -> None:
+        '''Ask every worker to finish its requests and exit'''
+
+        self.stopping = True
+
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def forkWorker(self, application, listener: socket.socket, cores: List[int], logLevel: str) -> int:
+        '''Fork a worker serving the application on the given cores, return its process id'''
+
+        pid = os.fork()
+        if pid:
+            return pid
+
+        # The worker never returns to the command, it exits when the server stops
+        exitCode = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+            ModelRegistry.setupForkedWorker(cores)
+            print(f'Worker {os.getpid()} serving on cores {cores}')
+
+            import uvicorn
+
+            config = uvicorn.Config(application, lifespan='off', log_level=logLevel)
+            uvicorn.Server(config).run(sockets=[listener])
+        except BaseException as exception:
+            print(f'Worker {os.getpid()} failed: {exception}')
+            exitCode = 1
+        finally:
+            os._exit(exitCode)
@@ -0,0 +1,44 @@
+from timeit import default_timer as timer
+
+from django.utils.deprecation import MiddlewareMixin
+
+from classifier.metrics import Metrics
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    '''Record the duration and the status of every request and the time spent rendering the DRF responses'''
+
+    def process_request(self, request) -> None:
+        '''Remember when the request arrived'''
+
+        request.metricsStartTime = timer()
+
+    def process_template_response(self, request, response):
+        '''Time the rendering of the response data, which runs after the view returned'''
+
+        renderStartTime = timer()
+
+        def observeRender(renderedResponse):
+            '''Observe the rendering time once the response is rendered'''
+
+            Metrics.observeStage('serialize', timer() - renderStartTime)
+
+        response.add_post_render_callback(observeRender)
+
+        return response
+
+    def process_response(self, request, response):
+        '''Observe the request duration by route, streamed bodies are not included'''
+
+        startTime = getattr(request, 'metricsStartTime', None)
+        if startTime is None:
+            return response
+
+        # The route pattern keeps the number of label values bounded
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match else 'unmatched'
+
+        Metrics.observe(Metrics.REQUEST_SECONDS, timer() - startTime, route=route)
+        Metrics.increment(Metrics.REQUESTS_TOTAL, route=route, status=str(response.status_code))
+
+        return response
@@ -0,0 +1,210 @@
+import base64
+import importlib.util
+import json
+import struct
+from typing import Any, Dict, List, Union
+
+import numpy as np
+from django.http import HttpResponse, JsonResponse
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+
+'''Compact encodings of the classification grids
+
+compact: json with one base64 string of rows * cols uint8 class indices per classification
+binary: header followed by the raw uint8 grids, see encodeBinary
+msgpack: the compact layout with raw bytes instead of base64, needs the msgpack package
+The optional scores are encoded like the grids in every format but binary.
+'''
+
+COMPACT_FORMATS: List[str] = ['compact', 'binary', 'msgpack']
+
+MODEL_VERSIONS_HEADER = 'X-Model-Versions'
+
+BINARY_MAGIC = b'ICLS'
+BINARY_VERSION = 1
+
+MSGPACK_AVAILABLE = importlib.util.find_spec('msgpack') is not None
+
+
+class CompactJSONRenderer(JSONRenderer):
+    '''Json renderer selected with ?format=compact'''
+
+    format = 'compact'
+
+
+class BinaryRenderer(BaseRenderer):
+    '''Pass the encoded binary grids through, error dictionaries are rendered as json'''
+
+    media_type = 'application/octet-stream'
+    format = 'binary'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data: Any, accepted_media_type: str = None, renderer_context: Dict[str, Any] = None) -> bytes:
+        '''Return the encoded bytes'''
+
+        if isinstance(data, bytes):
+            return data
+
+        return json.dumps(data).encode('utf-8')
+
+
+class MsgpackRenderer(BaseRenderer):
+    '''Render the response data with msgpack'''
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data: Any, accepted_media_type: str = None, renderer_context: Dict[str, Any] = None) -> bytes:
+        '''Return the msgpack encoded data'''
+
+        import msgpack
+
+        return msgpack.packb(data, use_bin_type=True)
+
+
+GRID_RENDERERS: List[type] = [JSONRenderer, BrowsableAPIRenderer, CompactJSONRenderer, BinaryRenderer]
+if MSGPACK_AVAILABLE:
+    GRID_RENDERERS.append(MsgpackRenderer)
+
+
+def selectFormat(request) -> str:
+    '''Select the response format of a plain django request from ?format= or the Accept header'''
+
+    requested = request.GET.get('format')
+    if requested:
+        if requested not in COMPACT_FORMATS + ['json']:
+            raise ValueError(f'Unknown response format: {requested}')
+        return requested
+
+    accept = request.headers.get('Accept', '')
+    if 'application/octet-stream' in accept:
+        return 'binary'
+    if MSGPACK_AVAILABLE and ('application/msgpack' in accept or 'application/x-msgpack' in accept):
+        return 'msgpack'
+
+    return 'json'
+
+
+def encodeBinary(rows: int, cols: int, grids: Dict[str, np.ndarray]) -> bytes:
+    '''Encode the grids as little endian binary
+
+    Header: magic 'ICLS', version (uint8), rows (uint32), cols (uint32), classification count (uint8),
+    then for each classification its name length (uint8) and utf-8 name.
+    Body: the rows * cols row-major uint8 grid of each classification in header order.
+    '''
+
+    parts = [struct.pack('<4sBIIB', BINARY_MAGIC,
+                         BINARY_VERSION, rows, cols, len(grids))]
+
+    for key in grids.keys():
+        name = key.encode('utf-8')
+        parts.append(struct.pack('<B', len(name)) + name)
+
+    for grid in grids.values():
+        parts.append(np.ascontiguousarray(grid, dtype=np.uint8).tobytes())
+
+    return b''.join(parts)
+
+
+def encodeArray(responseFormat: str, array: np.ndarray) -> Union[str, bytes]:
+    '''Return the uint8 array as raw bytes for msgpack, as base64 otherwise'''
+
+    data = np.ascontiguousarray(array, dtype=np.uint8).tobytes()
+
+    if responseFormat == 'msgpack':
+        return data
+
+    return base64.b64encode(data).decode('ascii')
+
+
+def createNestedResult(grids: Dict[str, np.ndarray]) -> List[List[Dict[str, int]]]:
+    '''Create the default nested list of per tile dictionaries from the class index grids'''
+
+    lists = {key: grid.tolist() for key, grid in grids.items()}
+    rows, cols = next(iter(grids.values())).shape
+
+    return [[{key: values[row][col] for key, values in lists.items()} for col in range(cols)]
+            for row in range(rows)]
+
+
+def createScoresData(responseFormat: str, scoreMode: str, topk: int,
+                     scores: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Any]:
+    '''Create the scores section, the uint8 scores are the probabilities scaled to 0-255'''
+
+    data = {
+        'mode': scoreMode,
+        'dtype': 'uint8',
+        'scale': 255,
+        'order': 'row-major',
+        'shapes': {key: {name: list(array.shape) for name, array in arrays.items()}
+                   for key, arrays in scores.items()},
+        'result': {key: {name: encodeArray(responseFormat, array) for name, array in arrays.items()}
+                   for key, arrays in scores.items()}
+    }
+
+    if scoreMode == 'topk':
+        data['k'] = topk
+
+    return data
+
+
+def createFormattedData(responseFormat: str, rows: int, cols: int, grids: Dict[str, np.ndarray],
+                        scores: Dict[str, Dict[str, np.ndarray]] = None, scoreMode: str = 'none', topk: int = 2,
+                        labels: Dict[str, List[Dict[str, Any]]] = None, modelVersions: Dict[str, str] = None) -> Any:
+    '''Create the response data of the format, rendered by its renderer
+
+    The binary format has no place for the model versions, they are sent in the MODEL_VERSIONS_HEADER.
+    '''
+
+    if responseFormat == 'binary':
+        if scoreMode != 'none':
+            raise ValueError('Scores are not available in the binary format')
+        return encodeBinary(rows, cols, grids)
+
+    data = {
+        'message': 'Classification succesful',
+        'rows': rows,
+        'cols': cols
+    }
+
+    if modelVersions is not None:
+        data['modelVersions'] = modelVersions
+
+    if responseFormat in COMPACT_FORMATS:
+        data['format'] = responseFormat
+        data['dtype'] = 'uint8'
+        data['order'] = 'row-major'
+        data['result'] = {key: encodeArray(responseFormat, grid)
+                          for key, grid in grids.items()}
+    else:
+        data['result'] = createNestedResult(grids)
+
+    if scoreMode != 'none':
+        data['scores'] = createScoresData(
+            responseFormat, scoreMode, topk, scores)
+        data['labels'] = labels
+
+    return data
+
+
+def createVersionHeaders(modelVersions: Dict[str, str]) -> Dict[str, str]:
+    '''Create the response headers naming the model versions that classified the image'''
+
+    return {MODEL_VERSIONS_HEADER: json.dumps(modelVersions, separators=(',', ':'))}
+
+
+def createFormattedResponse(responseFormat: str, data: Any, modelVersions: Dict[str, str] = None) -> HttpResponse:
+    '''Create the plain django response of the formatted data'''
+
+    headers = createVersionHeaders(modelVersions) if modelVersions else None
+
+    if responseFormat == 'binary':
+        return HttpResponse(data, content_type=BinaryRenderer.media_type, headers=headers)
+    if responseFormat == 'msgpack':
+        return HttpResponse(MsgpackRenderer().render(data), content_type=MsgpackRenderer.media_type,
+                            headers=headers)
+
+    return JsonResponse(data, headers=headers)
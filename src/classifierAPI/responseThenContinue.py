@@ -1,3 +1,4 @@
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
 
 
@@ -13,3 +14,23 @@ class ResponseThenContinue(Response):
         '''Override close to call the callback after close'''
         super().close()
         self.thenCallback()
+
+
+class StreamingResponseThenContinue(StreamingHttpResponse):
+    '''Streaming response calling the given callback once it is closed, also if its content was never iterated'''
+
+    def __init__(self, streamingContent, thenCallback, **kwargs):
+        '''Override init'''
+        super().__init__(streamingContent, **kwargs)
+        self.thenCallback = thenCallback
+
+    def close(self):
+        '''Override close to call the callback after close'''
+        try:
+            super().close()
+        finally:
+            self.thenCallback()
+
+    def __del__(self):
+        '''A response replaced by a middleware is never closed, call the callback when it is collected'''
+        self.thenCallback()
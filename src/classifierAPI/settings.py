@@ -38,11 +38,15 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     
     'rest_framework',
-    'drf_yasg'
+    'drf_yasg',
+
+    'classifierAPI'
 ]
 
 MIDDLEWARE = [
+    'classifierAPI.metricsMiddleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'classifierAPI.compressionMiddleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
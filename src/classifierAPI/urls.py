@@ -32,7 +32,11 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/status', views.status),
+    path('api/ready', views.ready),
+    path('api/metrics', views.metrics),
     path('api/classifyImage', views.classifyImage),
+    path('api/classifyImageAsync', views.classifyImageAsync),
+    path('api/classifyImages', views.classifyImages),
     path('api/trainModel', views.singleClassTeach),
     path('api/trainingStatus', views.getTrainingStatus),
     path('api/dataSetMeanStd', views.getDataSetMeanAndStd),
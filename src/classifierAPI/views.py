@@ -1,15 +1,44 @@
+import asyncio
+import json
+from concurrent.futures import Executor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Tuple, Union
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 
 from classifier.activeTrainingInfo import ActiveTrainingInfo, TrainingStatus
+from classifier.admissionController import AdmissionTicket, RequestRejectedError
+from classifier.batchClassifier import BatchClassifier, BatchImage, checkBatchBudget, readArchiveImages
 from classifier.classificationMap import BaseClassification, ClassificationMap
 from classifier.classificationType import ClassificationType, ClassificationTypeUtils
 from classifier.config.classifierConfig import ClassifierConfig
-from classifier.multiModelClassifier import MultiModelClassifier
-from classifier.teacher import Teacher
-from classifier.utils.imageUtils import calculateMeanAndStdForImages
+from classifier.config.config import Config
+from classifier.deadline import Deadline, DeadlineExceededError
+from classifier.metrics import Metrics
+from classifier.modelRegistry import ModelRegistry
+from classifier.multiModelClassifier import SCORE_MODES, ImageTooLargeError, MultiModelClassifier, checkImageBudget
+from classifier.profiler import (Profiler, ProfilerBusyError, ProfilingForbiddenError, authorizeProfiling,
+                                 createProfileName, parseProfileModes)
+from classifier.utils.imageUtils import calculateMeanAndStdForImages, readFileHeader
 from .ConfigSerializer import ConfigSerializer
-from .responseThenContinue import ResponseThenContinue
+from .responseFormats import (COMPACT_FORMATS, GRID_RENDERERS, createFormattedData, createFormattedResponse,
+                              createVersionHeaders, selectFormat)
+from .responseThenContinue import ResponseThenContinue, StreamingResponseThenContinue
+
+# Requests of the same client id share the per client limit of the inference queue
+CLIENT_ID_HEADER = 'X-Client-Id'
+
+UPLOAD_HEADER_BYTES = 256 * 1024
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Admins profile a request by naming the profilers and sending the configured profiling token
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN_HEADER = 'X-Profile-Token'
+PROFILE_ID_HEADER = 'X-Profile-Id'
 
 
 @api_view(['GET'])
@@ -18,34 +47,437 @@ def status(request):
 
     response = {'status': 'OK'}
 
+    if ModelRegistry.isLoaded():
+        scheduler = ModelRegistry.getScheduler()
+        if scheduler:
+            response['batching'] = scheduler.getStats()
+
+        resultCache = ModelRegistry.getResultCache()
+        if resultCache:
+            response['resultCache'] = resultCache.getStats()
+
+        admissionController = ModelRegistry.getAdmissionController()
+        if admissionController:
+            response['admission'] = admissionController.getStats()
+
     return Response(response)
 
 
+def getMetricsSamples() -> Dict[str, Tuple[str, float]]:
+    '''Return the totals and gauges kept by the result cache, the batching scheduler and the admission controller'''
+
+    if not ModelRegistry.isLoaded():
+        return {}
+
+    samples = {}
+
+    resultCache = ModelRegistry.getResultCache()
+    if resultCache:
+        stats = resultCache.getStats()
+        samples['classifier_result_cache_hits_total'] = ('Result cache hits', stats['hits'])
+        samples['classifier_result_cache_misses_total'] = ('Result cache misses', stats['misses'])
+        samples['classifier_result_cache_bytes'] = ('Size of the cached results', stats['bytes'])
+
+    scheduler = ModelRegistry.getScheduler()
+    if scheduler:
+        stats = scheduler.getStats()
+        samples['classifier_batching_queue_depth'] = ('Requests waiting for a shared batch', stats['queueDepth'])
+        samples['classifier_batching_batches_total'] = ('Shared batches run', stats['batches'])
+
+    admissionController = ModelRegistry.getAdmissionController()
+    if admissionController:
+        stats = admissionController.getStats()
+        samples['classifier_admission_active'] = ('Requests being classified', stats['active'])
+        samples['classifier_admission_queued'] = ('Requests waiting for admission', stats['queued'])
+        samples['classifier_admission_rejected_total'] = ('Requests rejected by the admission control',
+                                                          stats['rejectedClient'] + stats['rejectedFull'])
+        samples['classifier_admission_expired_total'] = ('Requests whose deadline passed while waiting',
+                                                         stats['expired'])
+
+    return samples
+
+
+def metrics(request):
+    '''Get the latency histograms and counters of the inference path in the Prometheus text format'''
+
+    if not Metrics.isEnabled():
+        return JsonResponse({'error': 'Metrics are disabled'}, status=404)
+
+    return HttpResponse(Metrics.render(getMetricsSamples()), content_type=METRICS_CONTENT_TYPE)
+
+
+@api_view(['GET'])
+def ready(request):
+    '''Report whether the networks are loaded and requests can be served, start loading them if not'''
+
+    if ModelRegistry.isLoaded():
+        return Response({'status': 'ready', 'modelVersions': ModelRegistry.getModelVersions()})
+
+    # A failed load is reported once and retried by the next check
+    loadError = ModelRegistry.getLoadError()
+    ModelRegistry.preload()
+
+    response = Response({'status': 'loading'})
+    if loadError:
+        response = Response({'status': 'error', 'error': loadError})
+    response.status_code = 503
+
+    return response
+
+
+def getGridSize(data) -> Tuple[int, int]:
+    '''Return the rows and columns to split the image to, 1 if not given'''
+
+    rows = 1
+    if 'rows' in data:
+        rows = int(data['rows'])
+
+    cols = 1
+    if 'cols' in data:
+        cols = int(data['cols'])
+
+    if rows < 1 or cols < 1:
+        raise ValueError('rows and cols must be positive')
+
+    return rows, cols
+
+
+def getStride(data) -> int:
+    '''Return the sliding window stride in pixels, 0 classifies each tile on its own'''
+
+    return int(data.get('stride', 0))
+
+
+def getDeadline(data) -> Deadline:
+    '''Return the deadline of the request from its deadline field in milliseconds or the configured default'''
+
+    milliseconds = float(data.get('deadline', 0)) or ModelRegistry.getConfig().getRequestDeadlineMs()
+
+    return Deadline.fromMilliseconds(milliseconds)
+
+
+def getClientId(request) -> str:
+    '''Return the id the client sent in the CLIENT_ID_HEADER, its address if it did not send one'''
+
+    return request.headers.get(CLIENT_ID_HEADER) or request.META.get('REMOTE_ADDR', 'unknown')
+
+
+def readUploadHeader(file) -> bytes:
+    '''Read the beginning of the uploaded image holding its header, the upload can still be read afterwards'''
+
+    if hasattr(file, 'temporary_file_path'):
+        return readFileHeader(file.temporary_file_path())
+
+    header = file.read(UPLOAD_HEADER_BYTES)
+    file.seek(0)
+
+    return header
+
+
+def checkRequestBudget(file, rows: int, cols: int) -> None:
+    '''Reject the request with ImageTooLargeError before decoding if its tiles or pixels exceed the budgets'''
+
+    checkImageBudget(ModelRegistry.getConfig(), readUploadHeader(file), rows, cols)
+
+
+def admitRequest(request, deadline: Deadline) -> AdmissionTicket:
+    '''Wait for the turn of the request in the inference queue, None if admission control is disabled'''
+
+    admissionController = ModelRegistry.getAdmissionController()
+    if admissionController is None:
+        return None
+
+    return admissionController.acquire(getClientId(request), deadline)
+
+
+def releaseRequest(ticket: AdmissionTicket) -> None:
+    '''Free the inference queue slot of the request, do nothing without a ticket'''
+
+    if ticket:
+        ModelRegistry.getAdmissionController().release(ticket)
+
+
+def createRejectedResponse(exception: RequestRejectedError) -> Response:
+    '''Create the response of a request the inference queue did not admit'''
+
+    response = Response({'error': str(exception)}, headers={'Retry-After': str(exception.retryAfter)})
+    response.status_code = exception.statusCode
+
+    return response
+
+
+def getProfileModes(request, value: str) -> List[str]:
+    '''Return the profilers named by the header or payload value, empty if the request is not profiled
+
+    ProfilingForbiddenError is raised if profiling is disabled or the token header does not match.
+    '''
+
+    modes = parseProfileModes(value)
+    if modes:
+        authorizeProfiling(ModelRegistry.getConfig().getProfilingToken(), request.headers.get(PROFILE_TOKEN_HEADER))
+
+    return modes
+
+
+def getRequestProfileModes(request, data) -> List[str]:
+    '''Return the profilers the PROFILE_HEADER of the classification request names'''
+
+    modes = getProfileModes(request, request.headers.get(PROFILE_HEADER))
+    if modes and isStreamRequested(data):
+        raise ValueError('Profiling is not available for the streamed response')
+
+    return modes
+
+
+def runProfiled(modes: List[str], function: Callable[..., Any], *args) -> Tuple[Any, Dict[str, str]]:
+    '''Run the function under the given profilers and return its result and the headers naming the profile'''
+
+    if not modes:
+        return function(*args), {}
+
+    profiler = Profiler(modes, Config.getProfilesPath(), createProfileName(),
+                        ModelRegistry.getConfig().getProfileTopCount())
+    with profiler:
+        result = function(*args)
+
+    return result, {PROFILE_ID_HEADER: profiler.name}
+
+
+def runClassification(file, rows: int, cols: int, stride: int = 0, deadline: Deadline = None,
+                      profiled: bool = False) -> Dict[str, Any]:
+    '''Classify the given image and assemble the response data'''
+
+    imageClassifier = MultiModelClassifier(deadline=deadline, profiled=profiled)
+    result = imageClassifier.classifyWithMultiModels(file, rows, cols, stride)
+
+    response = {
+        'message': 'Classification succesful',
+        'rows': rows,
+        'cols': cols,
+        'modelVersions': imageClassifier.getModelVersions(),
+        'result': result
+    }
+
+    return response
+
+
+def getScoreOptions(data) -> Tuple[str, int]:
+    '''Return the requested score mode and the number of top classes'''
+
+    scoreMode = data.get('scores', 'none')
+    topk = int(data.get('topk', 2))
+
+    if scoreMode not in SCORE_MODES:
+        raise ValueError(f'Unknown score mode: {scoreMode}')
+
+    if scoreMode != 'none' and isStreamRequested(data):
+        raise ValueError('Scores are not available in the streamed response')
+
+    return scoreMode, topk
+
+
+def runGridClassification(file, rows: int, cols: int, responseFormat: str, scoreMode: str, topk: int,
+                          stride: int = 0, deadline: Deadline = None,
+                          profiled: bool = False) -> Tuple[Any, Dict[str, str]]:
+    '''Classify the given image into class index grids, encode them in the response format and return the model versions'''
+
+    imageClassifier = MultiModelClassifier(deadline=deadline, profiled=profiled)
+    grids, scores = imageClassifier.classifyToGrids(file, rows, cols, scoreMode, topk, stride)
+    modelVersions = imageClassifier.getModelVersions()
+
+    with Metrics.timeStage('encode'):
+        data = createFormattedData(responseFormat, rows, cols, grids, scores, scoreMode, topk,
+                                   imageClassifier.getLabels(), modelVersions)
+
+    return data, modelVersions
+
+
+def isStreamRequested(data) -> bool:
+    '''Return whether the client asked for a newline delimited json stream of the rows'''
+
+    return Config.toBool(data.get('stream', False))
+
+
+def encodeRecords(records: Iterator[Dict[str, Any]], onClose: Callable[[], None] = None) -> Iterator[bytes]:
+    '''Encode the records as newline delimited json, an error ends the stream with an error record
+
+    onClose is called once the stream ended or was closed.
+    '''
+
+    try:
+        for record in records:
+            yield (json.dumps(record) + '\n').encode('utf-8')
+    except Exception as exception:
+        print(exception)
+        yield (json.dumps({'error': f'Error happened: {exception}'}) + '\n').encode('utf-8')
+    finally:
+        if onClose:
+            onClose()
+
+
+async def encodeRecordsAsync(records: Iterator[Dict[str, Any]], executor: Executor,
+                             onClose: Callable[[], None] = None) -> AsyncIterator[bytes]:
+    '''Encode the records in the executor, so classifying the next band does not block the event loop'''
+
+    loop = asyncio.get_running_loop()
+    lines = encodeRecords(records, onClose)
+
+    try:
+        while True:
+            line = await loop.run_in_executor(executor, next, lines, None)
+            if line is None:
+                return
+            yield line
+    finally:
+        # A disconnected client cancels the stream while a band may still be classified in the executor
+        if onClose:
+            onClose()
+
+
 @api_view(['POST'])
+@renderer_classes(GRID_RENDERERS)
 def classifyImage(request):
     '''Split and classify each part of the given image'''
 
+    ticket = None
+
     try:
-        file = request.data['image']
-        print(request.data)
-        print(file)
+        # Django parses the multipart body on first access
+        with Metrics.timeStage('parse'):
+            file = request.data['image']
+        rows, cols = getGridSize(request.data)
+
+        scoreMode, topk = getScoreOptions(request.data)
+        stride = getStride(request.data)
+        deadline = getDeadline(request.data)
+        profileModes = getRequestProfileModes(request, request.data)
+
+        checkRequestBudget(file, rows, cols)
+        ticket = admitRequest(request, deadline)
+
+        if isStreamRequested(request.data):
+            records = MultiModelClassifier(deadline=deadline).streamWithMultiModels(file, rows, cols, stride)
+
+            # The stream releases the queue slot once its last row is sent or the response is closed
+            streamTicket, ticket = ticket, None
+            return StreamingResponseThenContinue(encodeRecords(records, lambda: releaseRequest(streamTicket)),
+                                                 lambda: releaseRequest(streamTicket),
+                                                 content_type='application/x-ndjson')
+
+        responseFormat = request.accepted_renderer.format
+        if responseFormat in COMPACT_FORMATS or scoreMode != 'none':
+            (data, modelVersions), profileHeaders = runProfiled(
+                profileModes, runGridClassification, file, rows, cols, responseFormat, scoreMode, topk, stride,
+                deadline, bool(profileModes))
+            return Response(data, headers={**createVersionHeaders(modelVersions), **profileHeaders})
+
+        response, profileHeaders = runProfiled(
+            profileModes, runClassification, file, rows, cols, stride, deadline, bool(profileModes))
+
+        return Response(response, headers=profileHeaders)
+    except KeyError as exception:
+        response = Response({'error': f'Key not found: {exception}'})
+        response.status_code = 400
+
+        return response
+    except ImageTooLargeError as exception:
+        response = Response({'error': str(exception)})
+        response.status_code = 413
+
+        return response
+    except RequestRejectedError as exception:
+        return createRejectedResponse(exception)
+    except ProfilingForbiddenError as exception:
+        response = Response({'error': str(exception)})
+        response.status_code = 403
+
+        return response
+    except ProfilerBusyError as exception:
+        response = Response({'error': str(exception)})
+        response.status_code = 409
+
+        return response
+    except DeadlineExceededError as exception:
+        response = Response({'error': str(exception)})
+        response.status_code = 504
+
+        return response
+    except Exception as exception:
+        print(exception)
+        response = Response({'error': f'Error happened: {exception}'})
+        response.status_code = 400
+
+        return response
+    finally:
+        releaseRequest(ticket)
 
-        rows = 1
-        if 'rows' in request.data:
-            rows = int(request.data['rows'])
 
-        cols = 1
-        if 'cols' in request.data:
-            cols = int(request.data['cols'])
+def getListValue(values: List[Any], index: int, count: int, name: str) -> Any:
+    '''Return the value of the indexed image from a form field given once or once per image'''
+
+    if not values:
+        return 1
+    if len(values) == 1:
+        return values[0]
+    if len(values) == count:
+        return values[index]
+
+    raise ValueError(f'{name} must be given once or for every image')
+
+
+def getBatchImages(data, files) -> List[BatchImage]:
+    '''Read the images of a batch request from the multipart parts or from the uploaded archive'''
+
+    if 'archive' in files:
+        defaultGrid = getGridSize(data)
+        grids = json.loads(data['grids']) if 'grids' in data else {}
+
+        config = ModelRegistry.getConfig()
+        archiveImages = readArchiveImages(files['archive'], config.getMaxBatchImages(), config.getMaxArchiveBytes())
+
+        return [BatchImage(name, content, *(getGridSize(grids[name]) if name in grids else defaultGrid))
+                for name, content in archiveImages]
+
+    uploads = files.getlist('images')
+    if not uploads:
+        raise KeyError('images')
+
+    rowsList = data.getlist('rows')
+    colsList = data.getlist('cols')
+
+    images = []
+    for index, upload in enumerate(uploads):
+        grid = {
+            'rows': getListValue(rowsList, index, len(uploads), 'rows'),
+            'cols': getListValue(colsList, index, len(uploads), 'cols')
+        }
+        images.append(BatchImage(upload.name, upload.read(), *getGridSize(grid)))
 
-        imageClassifier = MultiModelClassifier()
-        result = imageClassifier.classifyWithMultiModels(file, rows, cols)
+    return images
+
+
+@api_view(['POST'])
+def classifyImages(request):
+    '''Split and classify each part of every given image'''
+
+    ticket = None
+
+    try:
+        with Metrics.timeStage('parse'):
+            images = getBatchImages(request.data, request.FILES)
+        deadline = getDeadline(request.data)
+
+        checkBatchBudget(ModelRegistry.getConfig(), images)
+        ticket = admitRequest(request, deadline)
+
+        batchClassifier = BatchClassifier(deadline)
+        results = batchClassifier.classifyImages(images)
 
         response = {
             'message': 'Classification succesful',
-            'rows': rows,
-            'cols': cols,
-            'result': result
+            'count': len(results),
+            'modelVersions': batchClassifier.modelVersions,
+            'results': results
         }
 
         return Response(response)
@@ -53,6 +485,18 @@ def classifyImage(request):
         response = Response({'error': f'Key not found: {exception}'})
         response.status_code = 400
 
+        return response
+    except ImageTooLargeError as exception:
+        response = Response({'error': str(exception)})
+        response.status_code = 413
+
+        return response
+    except RequestRejectedError as exception:
+        return createRejectedResponse(exception)
+    except DeadlineExceededError as exception:
+        response = Response({'error': str(exception)})
+        response.status_code = 504
+
         return response
     except Exception as exception:
         print(exception)
@@ -60,6 +504,100 @@ def classifyImage(request):
         response.status_code = 400
 
         return response
+    finally:
+        releaseRequest(ticket)
+
+
+def admitRequestData(request) -> Tuple[AdmissionTicket, Deadline, List[str]]:
+    '''Parse the multipart request, check its budgets and wait for its turn, runs off the event loop
+
+    Returns the admission ticket, the deadline and the profilers of the request.
+    '''
+
+    with Metrics.timeStage('parse'):
+        file = request.FILES['image']
+
+    deadline = getDeadline(request.POST)
+    rows, cols = getGridSize(request.POST)
+    profileModes = getRequestProfileModes(request, request.POST)
+
+    checkRequestBudget(file, rows, cols)
+
+    return admitRequest(request, deadline), deadline, profileModes
+
+
+def classifyRequestData(request, deadline: Deadline = None,
+                        profiled: bool = False) -> Union[Dict[str, Any], Iterator[Dict[str, Any]], HttpResponse]:
+    '''Classify the image of the parsed request or prepare its row stream, runs in the inference executor'''
+
+    file = request.FILES['image']
+    rows, cols = getGridSize(request.POST)
+
+    scoreMode, topk = getScoreOptions(request.POST)
+    stride = getStride(request.POST)
+
+    if isStreamRequested(request.POST):
+        return MultiModelClassifier(deadline=deadline).streamWithMultiModels(file, rows, cols, stride)
+
+    responseFormat = selectFormat(request)
+    if responseFormat in COMPACT_FORMATS or scoreMode != 'none':
+        data, modelVersions = runGridClassification(
+            file, rows, cols, responseFormat, scoreMode, topk, stride, deadline, profiled)
+        return createFormattedResponse(responseFormat, data, modelVersions)
+
+    return runClassification(file, rows, cols, stride, deadline, profiled)
+
+
+@csrf_exempt
+async def classifyImageAsync(request):
+    '''Split and classify each part of the given image without blocking the server worker'''
+
+    if request.method != 'POST':
+        return JsonResponse({'error': f'Method not allowed: {request.method}'}, status=405)
+
+    ticket = None
+
+    try:
+        # Loading the models on first use is blocking too, so it also runs off the event loop
+        executor = await sync_to_async(ModelRegistry.getExecutor, thread_sensitive=False)()
+
+        # Waiting in the inference queue blocks a thread, not the inference executor
+        ticket, deadline, profileModes = await sync_to_async(admitRequestData, thread_sensitive=False)(request)
+
+        loop = asyncio.get_running_loop()
+        response, profileHeaders = await loop.run_in_executor(
+            executor, runProfiled, profileModes, classifyRequestData, request, deadline, bool(profileModes))
+
+        if isStreamRequested(request.POST):
+            streamTicket, ticket = ticket, None
+            return StreamingResponseThenContinue(
+                encodeRecordsAsync(response, executor, lambda: releaseRequest(streamTicket)),
+                lambda: releaseRequest(streamTicket), content_type='application/x-ndjson')
+
+        if isinstance(response, HttpResponse):
+            for name, value in profileHeaders.items():
+                response[name] = value
+            return response
+
+        return JsonResponse(response, headers=profileHeaders)
+    except KeyError as exception:
+        return JsonResponse({'error': f'Key not found: {exception}'}, status=400)
+    except ImageTooLargeError as exception:
+        return JsonResponse({'error': str(exception)}, status=413)
+    except RequestRejectedError as exception:
+        return JsonResponse({'error': str(exception)}, status=exception.statusCode,
+                            headers={'Retry-After': str(exception.retryAfter)})
+    except ProfilingForbiddenError as exception:
+        return JsonResponse({'error': str(exception)}, status=403)
+    except ProfilerBusyError as exception:
+        return JsonResponse({'error': str(exception)}, status=409)
+    except DeadlineExceededError as exception:
+        return JsonResponse({'error': str(exception)}, status=504)
+    except Exception as exception:
+        print(exception)
+        return JsonResponse({'error': f'Error happened: {exception}'}, status=400)
+    finally:
+        releaseRequest(ticket)
 
 
 @api_view(['POST'])
@@ -87,11 +625,17 @@ def singleClassTeach(request):
         classification: BaseClassification = ClassificationMap.getClassificationByType(ClassificationMap(),
                                                                                        classificationType)
 
+        profileModes = getProfileModes(request, request.data.get('profile'))
+        profileEpochs = request.data.get('profileEpochs', [1])
+
         config = ClassifierConfig(None)
         config.setFromJson(request.data)
         classification.configureAndSetupNetwork(config)
 
-        teacher = Teacher(classification, config)
+        # The training stack is only imported by the processes that train
+        from classifier.teacher import Teacher
+
+        teacher = Teacher(classification, config, profileModes, profileEpochs)
 
         message = {
             'message': 'Training started, for more information call the trainingStatus endpoint'
@@ -99,6 +643,11 @@ def singleClassTeach(request):
 
         return ResponseThenContinue(message, teacher.train)
 
+    except ProfilingForbiddenError as exception:
+        response = Response({'error': str(exception)})
+        response.status_code = 403
+
+        return response
     except Exception as exception:
         print(exception)
         response = Response({'error': f'Error happened: {exception}'})